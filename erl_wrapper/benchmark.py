@@ -0,0 +1,391 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from data_io import read_h5, read_pkl, write_pkl, write_vol, mkdir
+from eval_erl import (
+    compute_segment_lut,
+    compute_segment_lut_tile,
+    evaluate_skeletons,
+    expected_run_length,
+    get_skeleton_lengths,
+)
+from networkx_lite import NetworkXGraphLite
+from synthetic import generate_dataset
+from node_layout import get_node_order, NodeLayout
+from chunked_store import write_zarr
+from lut_archive import LutArchive
+
+# benchmarks of the hot paths on deterministic synthetic data
+# python benchmark.py -s small -o bench_small.json
+# python benchmark.py -s small -b bench_small.json  (compare with a saved baseline)
+# the startup of the evaluation entry points (`python -m test_axonEM --help` in a fresh interpreter)
+# is checked against a time budget, and must not load the dependencies only needed by other paths
+
+SCALES = {
+    "tiny": dict(volume_size=(32, 128, 128), num_skeletons=10, nodes_per_skeleton=50),
+    "small": dict(volume_size=(64, 256, 256), num_skeletons=50, nodes_per_skeleton=200),
+    "medium": dict(
+        volume_size=(128, 512, 512), num_skeletons=200, nodes_per_skeleton=500
+    ),
+    "large": dict(
+        volume_size=(256, 1024, 1024), num_skeletons=1000, nodes_per_skeleton=1000
+    ),
+}
+
+# entry points whose startup is benchmarked and the modules they must not import
+IMPORT_MODULES = ["test_axonEM", "eval_server"]
+HEAVY_MODULES = ["h5py", "scipy", "networkx", "kimimaro"]
+
+
+def time_function(func, repeat=3, setup=None):
+    """
+    The function `time_function` times a function over several runs.
+
+    :param func: The function to time, called without arguments
+    :param repeat: The number of runs
+    :param setup: An optional function called before each run, not timed
+    :return: a dictionary with the minimum, median and maximum run time in seconds.
+    """
+    run_times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        func()
+        run_times.append(time.perf_counter() - start_time)
+    return {
+        "min": float(np.min(run_times)),
+        "median": float(np.median(run_times)),
+        "max": float(np.max(run_times)),
+        "repeat": repeat,
+    }
+
+
+def launch_entry_point(module, trace_imports=False):
+    """
+    The function `launch_entry_point` launches an entry point as `python -m <module> --help`, i.e.,
+    the interpreter startup, the imports of the module and its argument parser.
+
+    :param module: The name of the entry point module (in this folder)
+    :param trace_imports: If True, the imports are traced (`-X importtime`)
+    :return: the list of `HEAVY_MODULES` loaded by the launch if `trace_imports`, else None.
+    """
+    command = [sys.executable] + (["-X", "importtime"] if trace_imports else [])
+    output = subprocess.run(
+        command + ["-m", module, "--help"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    if not trace_imports:
+        return None
+    # "import time: self [us] | cumulative | imported package" lines
+    imported = {
+        line.split("|")[-1].strip().split(".")[0]
+        for line in output.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    return [x for x in HEAVY_MODULES if x in imported]
+
+
+def check_import_budget(result, import_budget):
+    """
+    The function `check_import_budget` checks that the entry points start within the time budget
+    without loading heavy dependencies.
+
+    :param result: The output of `run_benchmarks`
+    :param import_budget: The maximum median time in seconds to launch an entry point
+    :return: the list of failed checks (empty if all passed).
+    """
+    failures = []
+    for module in IMPORT_MODULES:
+        name = f"launch_{module}"
+        if name not in result["results"]:
+            continue
+        run_time = result["results"][name]["median"]
+        if run_time > import_budget:
+            failures.append(f"{name}: {run_time:.3f}s > {import_budget:.3f}s")
+        heavy_modules = launch_entry_point(module, trace_imports=True)
+        if len(heavy_modules) > 0:
+            failures.append(f"{name}: imports {', '.join(heavy_modules)}")
+    return failures
+
+
+def run_benchmarks(config, repeat=3, output_folder=None, benchmarks=None):
+    """
+    The function `run_benchmarks` generates a synthetic dataset and times the hot paths of the ERL
+    evaluation on it.
+
+    :param config: The keyword arguments of `generate_dataset`
+    :param repeat: The number of runs of each benchmark
+    :param output_folder: The folder for the temporary files. A new temporary folder is used (and
+    removed) if not given
+    :param benchmarks: The names of the benchmarks to run, defaults to all
+    :return: a dictionary mapping benchmark names to their timings.
+    """
+    data = generate_dataset(**config)
+    gt_graph = data["gt_graph"]
+    node_position = data["node_position"]
+    cleanup = output_folder is None
+    if cleanup:
+        output_folder = tempfile.mkdtemp(prefix="erl_benchmark_")
+    mkdir(output_folder, "all")
+
+    seg_path = os.path.join(output_folder, "seg.h5")
+    mask_path = os.path.join(output_folder, "mask.h5")
+    write_vol(seg_path, data["segmentation"])
+    write_vol(mask_path, data["mask"])
+    # the same volumes in zarr directory stores
+    seg_zarr_path = os.path.join(output_folder, "seg.zarr")
+    mask_zarr_path = os.path.join(output_folder, "mask.zarr")
+    chunks = [min(16, x) for x in data["segmentation"].shape[:1]] + [
+        min(128, x) for x in data["segmentation"].shape[1:]
+    ]
+    write_zarr(seg_zarr_path, data["segmentation"], chunks)
+    write_zarr(mask_zarr_path, data["mask"], chunks)
+    graph_path = os.path.join(output_folder, "gt_graph.pkl")
+    write_pkl(graph_path, gt_graph)
+    node_npz = os.path.join(output_folder, "gt_nodes.npz")
+    edge_npz = os.path.join(output_folder, "gt_edges.npz")
+    gt_graph.save_npz(node_npz, edge_npz)
+
+    # tiles of the segmentation for compute_segment_lut_tile
+    volume_size = data["segmentation"].shape
+    tile_size = [volume_size[0], volume_size[1] // 2, volume_size[2] // 2]
+    tile_format = os.path.join(output_folder, "tile", "%04d", "%d_%d.h5")
+    tile_lut_format = os.path.join(output_folder, "tile_lut", "%04d", "%d_%d.h5")
+    os.makedirs(os.path.dirname(tile_format % (0, 0, 0)), exist_ok=True)
+    for y in range(2):
+        for x in range(2):
+            write_vol(
+                tile_format % (0, y, x),
+                data["segmentation"][
+                    :,
+                    y * tile_size[1] : (y + 1) * tile_size[1],
+                    x * tile_size[2] : (x + 1) * tile_size[2],
+                ],
+            )
+
+    position_attributes = ["z", "y", "x"]
+    node_segment_lut, mask_segment_id = compute_segment_lut(
+        seg_path, node_position, mask_path, chunk_num=4
+    )
+    skeleton_lengths = get_skeleton_lengths(
+        gt_graph, position_attributes, "skeleton_id", store_edge_length="length"
+    )
+
+    # nodes reordered by z-slice and Morton code (node_layout.py)
+    node_order = get_node_order(node_position)
+    node_layout = NodeLayout(node_position[node_order, 0])
+
+    # archive of lookup tables (lut_archive.py)
+    archive = LutArchive(os.path.join(output_folder, "luts.erllut"))
+    archive.put("submission", node_segment_lut, mask_segment_id)
+
+    def clear_tile_lut():
+        shutil.rmtree(os.path.join(output_folder, "tile_lut"), ignore_errors=True)
+        os.makedirs(os.path.join(output_folder, "tile_lut"))
+
+    def load_npz():
+        graph = NetworkXGraphLite(["skeleton_id", "z", "y", "x"], "length")
+        graph.load_npz(node_npz, edge_npz)
+
+    cases = {
+        "compute_segment_lut": (
+            lambda: compute_segment_lut(seg_path, node_position, mask_path, chunk_num=4),
+            None,
+        ),
+        "compute_segment_lut_layout": (
+            lambda: compute_segment_lut(
+                seg_path,
+                node_position[node_order],
+                mask_path,
+                chunk_num=4,
+                node_layout=node_layout,
+            ),
+            None,
+        ),
+        "compute_segment_lut_zarr": (
+            lambda: compute_segment_lut(
+                seg_zarr_path, node_position, mask_zarr_path, chunk_num=4
+            ),
+            None,
+        ),
+        "compute_segment_lut_tile": (
+            lambda: compute_segment_lut_tile(
+                tile_format,
+                [0],
+                range(2),
+                range(2),
+                node_position,
+                tile_lut_format,
+                tile_size,
+            ),
+            clear_tile_lut,
+        ),
+        "get_skeleton_lengths": (
+            lambda: get_skeleton_lengths(
+                gt_graph, position_attributes, "skeleton_id", store_edge_length="length"
+            ),
+            None,
+        ),
+        "evaluate_skeletons": (
+            lambda: evaluate_skeletons(
+                gt_graph, "skeleton_id", node_segment_lut, mask_segment_id, 50
+            ),
+            None,
+        ),
+        "expected_run_length": (
+            lambda: expected_run_length(
+                gt_graph,
+                "skeleton_id",
+                "length",
+                node_segment_lut,
+                mask_segment_id,
+                50,
+                skeleton_lengths=skeleton_lengths,
+            ),
+            None,
+        ),
+        "read_h5": (lambda: read_h5(seg_path), None),
+        "launch_test_axonEM": (lambda: launch_entry_point("test_axonEM"), None),
+        "launch_eval_server": (lambda: launch_entry_point("eval_server"), None),
+        "lut_archive_get": (lambda: archive.get("submission"), None),
+        "load_npz": (load_npz, None),
+        "load_pickle": (lambda: read_pkl(graph_path), None),
+    }
+
+    results = {}
+    try:
+        for name, (func, setup) in cases.items():
+            if benchmarks is not None and name not in benchmarks:
+                continue
+            results[name] = time_function(func, repeat, setup)
+            print(f"{name}: {results[name]['median']:.4f}s")
+    finally:
+        if cleanup:
+            shutil.rmtree(output_folder, ignore_errors=True)
+    return {
+        # json-compatible copy (tuples become lists), to compare with saved baselines
+        "config": json.loads(json.dumps(config)),
+        "num_nodes": int(len(node_position)),
+        "num_edges": int(gt_graph.edges._edges.nnz),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def compare_benchmarks(result, baseline):
+    """
+    The function `compare_benchmarks` compares the median run times with a saved baseline.
+
+    :param result: The output of `run_benchmarks`
+    :param baseline: The output of a previous `run_benchmarks` call
+    :return: a dictionary mapping benchmark names to the ratio of the new over the old median time.
+    """
+    if baseline["config"] != result["config"]:
+        print("Warning: the baseline was computed with a different config")
+    ratio = {}
+    for name, timing in result["results"].items():
+        if name in baseline["results"]:
+            ratio[name] = timing["median"] / max(
+                baseline["results"][name]["median"], 1e-12
+            )
+            print(f"{name}: x{ratio[name]:.2f} of the baseline")
+    return ratio
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="ERL benchmarks on synthetic data")
+    parser.add_argument(
+        "-s",
+        "--scale",
+        type=str,
+        choices=list(SCALES),
+        help="size of the synthetic dataset",
+        default="small",
+    )
+    parser.add_argument(
+        "-sr",
+        "--split-rate",
+        type=float,
+        help="probability of each gt edge to be split",
+        default=0.02,
+    )
+    parser.add_argument(
+        "-mr",
+        "--merge-rate",
+        type=float,
+        help="probability of each split piece to be merged",
+        default=0.1,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        type=int,
+        help="number of runs of each benchmark",
+        default=3,
+    )
+    parser.add_argument(
+        "-n",
+        "--benchmarks",
+        type=str,
+        help="comma-separated benchmark names (default: all)",
+        default="",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        help="save the timings as a json baseline",
+        default="",
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline-path",
+        type=str,
+        help="compare the timings with this json baseline",
+        default="",
+    )
+    parser.add_argument(
+        "-ib",
+        "--import-budget",
+        type=float,
+        help="maximum startup time in seconds of the entry points (0: no check)",
+        default=0.5,
+    )
+    args = parser.parse_args()
+    args.benchmarks = args.benchmarks.split(",") if args.benchmarks else None
+    return args
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    config = dict(
+        SCALES[args.scale], split_rate=args.split_rate, merge_rate=args.merge_rate
+    )
+    result = run_benchmarks(config, args.repeat, benchmarks=args.benchmarks)
+    if args.output_path:
+        with open(args.output_path, "w") as fid:
+            json.dump(result, fid, indent=2)
+    if args.baseline_path:
+        with open(args.baseline_path, "r") as fid:
+            compare_benchmarks(result, json.load(fid))
+    if args.import_budget > 0:
+        failures = check_import_budget(result, args.import_budget)
+        for failure in failures:
+            print(f"Import budget exceeded: {failure}")
+        if len(failures) > 0:
+            sys.exit(1)
@@ -0,0 +1,328 @@
+import argparse
+import numpy as np
+from data_io import read_pkl, write_pkl
+from eval_erl import get_graph_edge_lengths
+
+# store the gt skeletons as chains of nodes between branch points and endpoints, with the
+# cumulative edge length along each chain. After the segment lookup, the edges of a chain are
+# scored by runs of nodes with the same segment: only the run boundaries are classified, instead of
+# every edge. The scores are exactly those of the per-edge `score_skeleton_edges`: the edge lengths
+# between integer positions are multiples of 2^-23, so that their sums in float64 are exact in any
+# order (`exact` is False if a skeleton is too long for this, > 2^30 physical units)
+#
+# skeleton_chains = SkeletonChains.from_graph(gt_graph)
+# scores = skeleton_chains.score(node_segment_lut, merging_segments)
+# python chains.py -g gt_human_32nm_skel_stats.p
+
+
+class SkeletonChains:
+    # The SkeletonChains class stores the edges of the gt skeletons as chains of nodes.
+    def __init__(self):
+        # nodes of chain c: nodes[offsets[c] : offsets[c + 1]], consecutive nodes are joined by an
+        # edge and the branch points (resp. endpoints) are repeated in each of their chains
+        self.nodes = None
+        self.offsets = None
+        # length from the first node of the chain to each node
+        self.cum_length = None
+        # skeleton id of each chain
+        self.skeleton = None
+        # sorted ids of the skeletons with edges and their length
+        self.skeleton_ids = None
+        self.skeleton_length = None
+        self.exact = True
+
+    @classmethod
+    def from_graph(cls, gt_graph, skeleton_id_attribute="skeleton_id"):
+        """
+        The function `from_graph` builds the chains of a gt graph, with the edge lengths computed
+        from the node positions by `get_graph_edge_lengths`.
+
+        :param gt_graph: The ground truth graph (node position in physical unit)
+        :param skeleton_id_attribute: The name of the node attribute containing the skeleton ID
+        :return: a `SkeletonChains`.
+        """
+        node_skeleton, edges, edge_length = get_graph_edge_lengths(
+            gt_graph, skeleton_id_attribute, "length", ["z", "y", "x"]
+        )
+        skeleton_chains = cls()
+        skeleton_chains.load_edges(node_skeleton, edges, edge_length)
+        return skeleton_chains
+
+    def load_edges(self, node_skeleton, edges, edge_length):
+        """
+        The function `load_edges` splits the skeleton edges into chains: a depth-first traversal
+        visits the nodes of an unbranched path one after the other, the edges closing a cycle are
+        chains of their own.
+
+        :param node_skeleton: The skeleton id of each node (N)
+        :param edges: The node indices of each edge (E, 2)
+        :param edge_length: The length of each edge (E)
+        """
+        import scipy.sparse as sp
+        from scipy.sparse.csgraph import connected_components, depth_first_order
+
+        node_skeleton = np.asarray(node_skeleton)
+        edges = np.asarray(edges, np.int64).reshape(-1, 2)
+        edge_length = np.asarray(edge_length, np.float32)
+        num_nodes = len(node_skeleton)
+        degree = np.bincount(edges.ravel(), minlength=num_nodes)
+
+        # one traversal from a virtual root linked to a node of each connected component
+        graph = sp.coo_matrix(
+            (np.ones(len(edges), np.int8), (edges[:, 0], edges[:, 1])),
+            shape=(num_nodes, num_nodes),
+        ).tocsr()
+        _, component = connected_components(graph, directed=False)
+        _, first_node = np.unique(component, return_index=True)
+        root = num_nodes
+        row = np.concatenate([edges[:, 0], edges[:, 1], np.full(len(first_node), root)])
+        col = np.concatenate([edges[:, 1], edges[:, 0], first_node])
+        graph = sp.coo_matrix(
+            (np.ones(len(row), np.int8), (row, col)), shape=(num_nodes + 1,) * 2
+        ).tocsr()
+        order, parent = depth_first_order(graph, root, return_predecessors=True)
+        order = order[1:]
+        parent = parent[order]
+
+        node_parent = np.full(num_nodes, root, np.int64)
+        node_parent[order] = parent
+
+        # a node continues the chain of its parent if the parent is inside an unbranched path: the
+        # preorder visits the node right after its parent
+        is_member = parent != root
+        parent_index = np.where(is_member, parent, 0)
+        is_next = (
+            is_member & (degree[parent_index] == 2) & (node_parent[parent_index] != root)
+        )
+        members = order[is_member]
+        heads = np.flatnonzero(~is_next[is_member])
+        anchors = parent[is_member][heads]
+
+        # length of the edge between each node and its parent
+        parent_length = np.zeros(num_nodes, np.float32)
+        is_child = node_parent[edges[:, 1]] == edges[:, 0]
+        is_parent = ~is_child & (node_parent[edges[:, 0]] == edges[:, 1])
+        parent_length[edges[is_child, 1]] = edge_length[is_child]
+        parent_length[edges[is_parent, 0]] = edge_length[is_parent]
+        # the other edges close a cycle
+        cycle_edges = ~(is_child | is_parent)
+
+        nodes = np.concatenate(
+            [np.insert(members, heads, anchors), edges[cycle_edges].ravel()]
+        )
+        length = np.concatenate(
+            [
+                np.insert(parent_length[members], heads, 0),
+                np.stack(
+                    [np.zeros(cycle_edges.sum(), np.float32), edge_length[cycle_edges]],
+                    axis=1,
+                ).ravel(),
+            ]
+        )
+        self.offsets = np.concatenate(
+            [
+                heads + np.arange(len(heads)),
+                len(members) + len(heads) + 2 * np.arange(int(cycle_edges.sum()) + 1),
+            ]
+        )
+        self.nodes = nodes.astype(np.uint32 if num_nodes < 2**32 else np.uint64)
+        self.skeleton = node_skeleton[nodes[self.offsets[:-1]]]
+        self._set_cum_length(length)
+
+    def _set_cum_length(self, length):
+        # cumulative lengths in integer multiples of the smallest power of two dividing all the
+        # lengths, so that the sums are exact
+        nonzero = length[length > 0]
+        quantum_exp = int(np.frexp(nonzero)[1].min()) - 24 if len(nonzero) > 0 else 0
+        quanta = np.ldexp(length.astype(np.float64), -quantum_exp)
+        self.exact = bool(quanta.sum() < 2**62)
+        cum_quanta = np.cumsum(quanta.astype(np.int64))
+        cum_quanta -= np.repeat(cum_quanta[self.offsets[:-1]], np.diff(self.offsets))
+        chain_quanta = cum_quanta[self.offsets[1:] - 1]
+
+        self.cum_length = np.ldexp(cum_quanta.astype(np.float64), quantum_exp)
+        self.exact &= bool(np.all(self._get_skeleton_lengths(chain_quanta) < 2**53))
+        self.skeleton_length = self._get_skeleton_lengths(self.cum_length[self.offsets[1:] - 1])
+
+    def _get_skeleton_lengths(self, chain_length):
+        self.skeleton_ids, chain_index = np.unique(self.skeleton, return_inverse=True)
+        return np.bincount(
+            chain_index.ravel(), chain_length.astype(np.float64), len(self.skeleton_ids)
+        )
+
+    def load_arrays(self, nodes, offsets, skeleton, cum_length, exact=True):
+        """
+        The function `load_arrays` loads the chains from their arrays, e.g., as stored in a gt
+        bundle.
+
+        :param nodes: The nodes of all the chains, one after the other
+        :param offsets: The index of the first node of each chain, and the total number of nodes
+        :param skeleton: The skeleton id of each chain
+        :param cum_length: The length from the first node of the chain to each node
+        :param exact: Whether the sums of the edge lengths are exact
+        """
+        self.nodes, self.offsets = nodes, offsets
+        self.skeleton, self.cum_length = skeleton, cum_length
+        self.exact = bool(exact)
+        self.skeleton_length = self._get_skeleton_lengths(cum_length[offsets[1:] - 1])
+
+    def reorder_nodes(self, order):
+        """
+        The function `reorder_nodes` remaps the chain nodes after the gt nodes were permuted (see
+        `NetworkXGraphLite.reorder_nodes`).
+
+        :param order: The old index of each node in the new order
+        """
+        new_index = np.empty(len(order), np.int64)
+        new_index[np.asarray(order)] = np.arange(len(order))
+        self.nodes = new_index[self.nodes].astype(self.nodes.dtype)
+
+    def score(self, node_segment_lut, merging_segments, skeleton_ids=None):
+        """
+        The function `score` is the run-length version of `score_skeleton_edges`: the edges within a
+        run of nodes of the same segment share their class, and the length of the run is the
+        difference of the cumulative lengths at its ends.
+
+        :param node_segment_lut: The segment id of each node
+        :param merging_segments: The sorted array of merging segments
+        :param skeleton_ids: The sorted ids of the skeletons to score, defaults to all the
+        skeletons with edges (`skeleton_ids`)
+        :return: a dictionary of arrays aligned with `skeleton_ids`: "length", "erl", "ommitted",
+        "split", "merged" and "correct".
+        """
+        nodes, cum_length, chain_skeleton = self.nodes, self.cum_length, self.skeleton
+        chain_size = np.diff(self.offsets)
+        if skeleton_ids is None:
+            skeleton_ids = self.skeleton_ids
+        else:
+            skeleton_ids = np.asarray(skeleton_ids)
+            chain_mask = np.isin(chain_skeleton, skeleton_ids)
+            if not np.all(chain_mask):
+                position_mask = np.repeat(chain_mask, chain_size)
+                nodes, cum_length = nodes[position_mask], cum_length[position_mask]
+                chain_skeleton, chain_size = (
+                    chain_skeleton[chain_mask],
+                    chain_size[chain_mask],
+                )
+        num_skeleton = len(skeleton_ids)
+        chain_start = np.concatenate([[0], np.cumsum(chain_size)])
+        chain_index = np.searchsorted(skeleton_ids, chain_skeleton)
+        segment = np.asarray(node_segment_lut)[nodes]
+
+        # (i, i + 1) is an edge unless i is the last node of a chain
+        is_edge = np.ones(max(len(nodes) - 1, 0), bool)
+        is_edge[chain_start[1:-1] - 1] = False
+        is_same = is_edge & (segment[:-1] == segment[1:])
+        # edges between two segments
+        boundary = np.flatnonzero(is_edge & ~is_same)
+        boundary_skeleton = chain_index[
+            np.searchsorted(chain_start, boundary, side="right") - 1
+        ]
+        boundary_ommitted = (segment[boundary] == 0) | (segment[boundary + 1] == 0)
+
+        # runs of nodes joined by edges within a segment
+        run_start = np.concatenate([[0], np.flatnonzero(~is_same) + 1])
+        run_last = np.concatenate([run_start[1:], [len(nodes)]]) - 1
+        run_edges = run_last - run_start
+        has_edges = run_edges > 0
+        run_start, run_last, run_edges = (
+            run_start[has_edges],
+            run_last[has_edges],
+            run_edges[has_edges],
+        )
+        run_skeleton = chain_index[
+            np.searchsorted(chain_start, run_start, side="right") - 1
+        ]
+        run_segment = segment[run_start]
+        run_length = cum_length[run_last] - cum_length[run_start]
+        run_ommitted = run_segment == 0
+        run_merged = ~run_ommitted & np.isin(run_segment, merging_segments)
+        run_correct = ~(run_ommitted | run_merged)
+
+        def count(index, weights=None):
+            return np.bincount(index, weights, minlength=num_skeleton).astype(np.int64)
+
+        # skeletons without edges have a zero length
+        skeleton_length = np.zeros(num_skeleton)
+        length_index = np.searchsorted(skeleton_ids, self.skeleton_ids)
+        is_scored = length_index < num_skeleton
+        is_scored[is_scored] = (
+            skeleton_ids[length_index[is_scored]] == self.skeleton_ids[is_scored]
+        )
+        skeleton_length[length_index[is_scored]] = self.skeleton_length[is_scored]
+        scores = {
+            "length": skeleton_length,
+            "ommitted": count(boundary_skeleton[boundary_ommitted])
+            + count(run_skeleton[run_ommitted], run_edges[run_ommitted]),
+            "split": count(boundary_skeleton[~boundary_ommitted]),
+            "merged": count(run_skeleton[run_merged], run_edges[run_merged]),
+            "correct": count(run_skeleton[run_correct], run_edges[run_correct]),
+        }
+
+        # run length of each (skeleton, segment) pair of correct runs
+        pairs, pair_index = np.unique(
+            np.stack(
+                [
+                    run_skeleton[run_correct].astype(np.uint64),
+                    run_segment[run_correct].astype(np.uint64),
+                ],
+                axis=1,
+            ),
+            axis=0,
+            return_inverse=True,
+        )
+        pair_length = np.bincount(
+            pair_index.ravel(), run_length[run_correct], minlength=len(pairs)
+        )
+        scores["erl"] = np.bincount(
+            pairs[:, 0].astype(np.int64), pair_length**2, minlength=num_skeleton
+        ) / np.maximum(scores["length"], 1e-12)
+        return scores
+
+
+def add_skeleton_chains(gt_stats_path, output_path=None):
+    """
+    The function `add_skeleton_chains` stores the chains of the gt skeletons next to the gt graph,
+    resolution and (optional) mask index and node layout of a precomputed gt statistics file.
+
+    :param gt_stats_path: The path to the gt statistics file ([gt_graph, gt_res, ...])
+    :param output_path: The path to the output statistics file, defaults to `gt_stats_path`
+    """
+    gt_stats = read_pkl(gt_stats_path)
+    gt_graph, gt_res = gt_stats[:2]
+    extras = [x for x in gt_stats[2:] if not isinstance(x, SkeletonChains)]
+    write_pkl(
+        gt_stats_path if output_path is None else output_path,
+        [gt_graph, gt_res] + extras + [SkeletonChains.from_graph(gt_graph)],
+    )
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Store the gt skeletons as chains for the run-length evaluation"
+    )
+    parser.add_argument(
+        "-g",
+        "--gt-stats-path",
+        type=str,
+        help="path to ground truth skeleton statistics",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        help="output path (default: overwrite the gt skeleton statistics)",
+        default=None,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # python chains.py -g gt_human_32nm_skel_stats.p
+    # the SkeletonChains is pickled from the chains module, not from __main__, so that the gt file
+    # can be loaded by the other modules
+    from chains import add_skeleton_chains
+
+    args = get_arguments()
+    add_skeleton_chains(args.gt_stats_path, args.output_path)
@@ -0,0 +1,308 @@
+import os
+import bz2
+import json
+import lzma
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# zarr (v2) and n5 arrays in directory stores, read without the zarr/z5py packages:
+# the json metadata is parsed here, the raw/zlib/gzip/bz2/lzma chunks are decoded with the
+# standard library (other codecs, e.g., blosc, with numcodecs if installed) on a thread pool
+# (zlib releases the GIL). Missing chunks are filled with the fill value
+#
+# array = open_chunked_array("pred.zarr", "seg")
+# slab = array[start_z:last_z]
+# values = array.read_points(points)
+
+
+def get_codec(config):
+    """
+    The function `get_codec` returns the decoding function of a compressor configuration.
+
+    :param config: The zarr compressor (`{"id": ...}`) or n5 compression (`{"type": ...}`)
+    configuration, or None
+    :return: a function mapping the stored bytes to the decoded bytes.
+    """
+    if config is None:
+        return lambda data: data
+    name = config.get("id", config.get("type"))
+    if name == "raw":
+        return lambda data: data
+    if name in ["zlib", "gzip"]:
+        # automatic zlib/gzip header detection
+        return lambda data: zlib.decompress(data, 32 + zlib.MAX_WBITS)
+    if name in ["bz2", "bzip2"]:
+        return bz2.decompress
+    if name in ["lzma", "xz"]:
+        return lzma.decompress
+    try:
+        import numcodecs
+    except ImportError:
+        raise ValueError(f"codec {name} requires numcodecs: pip install numcodecs")
+    if "id" not in config:
+        config = dict(config, id=config["type"])
+        del config["type"]
+    codec = numcodecs.get_codec(config)
+    return lambda data: codec.decode(data)
+
+
+def is_chunked_array(path):
+    """
+    The function `is_chunked_array` checks if a folder is a zarr (v2) or n5 array.
+    """
+    if os.path.exists(os.path.join(path, ".zarray")):
+        return True
+    attributes_path = os.path.join(path, "attributes.json")
+    if os.path.exists(attributes_path):
+        with open(attributes_path, "r") as fid:
+            return "dimensions" in json.load(fid)
+    return False
+
+
+class ChunkedArray:
+    # The ChunkedArray class reads a zarr (v2) or n5 array stored in a folder.
+    def __init__(self, path, num_threads=None):
+        """
+        :param path: The folder of the array
+        :param num_threads: The number of threads decoding the chunks, defaults to the number of
+        cpus (at most 8)
+        """
+        self.path = path
+        self.num_threads = (
+            min(8, os.cpu_count() or 1) if num_threads is None else num_threads
+        )
+        if os.path.exists(os.path.join(path, ".zarray")):
+            with open(os.path.join(path, ".zarray"), "r") as fid:
+                meta = json.load(fid)
+            self.format = "zarr"
+            self.shape = tuple(meta["shape"])
+            self.chunks = tuple(meta["chunks"])
+            self.dtype = np.dtype(meta["dtype"])
+            self.order = meta.get("order", "C")
+            self.fill_value = meta.get("fill_value") or 0
+            self.separator = meta.get("dimension_separator", ".")
+            self._decode = get_codec(meta.get("compressor"))
+            self._filters = [get_codec(x) for x in (meta.get("filters") or [])[::-1]]
+        elif is_chunked_array(path):
+            with open(os.path.join(path, "attributes.json"), "r") as fid:
+                meta = json.load(fid)
+            # n5 lists the dimensions from the fastest varying one (xyz)
+            self.format = "n5"
+            self.shape = tuple(meta["dimensions"][::-1])
+            self.chunks = tuple(meta["blockSize"][::-1])
+            self.dtype = np.dtype(meta["dataType"]).newbyteorder(">")
+            self.order = "C"
+            self.fill_value = 0
+            compression = meta.get("compression", {"type": meta.get("compressionType")})
+            self._decode = get_codec(compression)
+            self._filters = []
+        else:
+            raise ValueError(f"not a zarr or n5 array: {path}")
+        self.ndim = len(self.shape)
+        self.grid = tuple(-(-x // y) for x, y in zip(self.shape, self.chunks))
+
+    def get_chunk_path(self, index):
+        """
+        The function `get_chunk_path` returns the file of a chunk.
+
+        :param index: The grid index of the chunk
+        """
+        if self.format == "n5":
+            return os.path.join(self.path, *[str(x) for x in index[::-1]])
+        return os.path.join(self.path, self.separator.join(str(x) for x in index))
+
+    def read_chunk(self, index):
+        """
+        The function `read_chunk` reads and decodes a chunk.
+
+        :param index: The grid index of the chunk
+        :return: the chunk as an array of shape `chunks`, cropped at the volume boundary (None if
+        the chunk is not stored).
+        """
+        filename = self.get_chunk_path(index)
+        if not os.path.exists(filename):
+            return None
+        with open(filename, "rb") as fid:
+            data = fid.read()
+        shape = [
+            min(c, s - i * c) for i, c, s in zip(index, self.chunks, self.shape)
+        ]
+        if self.format == "n5":
+            # header: mode, number of dimensions, block size (big-endian)
+            mode, ndim = np.frombuffer(data[:4], ">u2")
+            block_shape = np.frombuffer(data[4 : 4 + 4 * ndim], ">u4")[::-1]
+            offset = 4 + 4 * ndim + (4 if mode == 1 else 0)
+            chunk = np.frombuffer(self._decode(data[offset:]), self.dtype)
+            chunk = chunk[: int(np.prod(block_shape))].reshape(block_shape)
+        else:
+            data = self._decode(data)
+            for decode in self._filters:
+                data = decode(data)
+            chunk = np.frombuffer(data, self.dtype).reshape(self.chunks, order=self.order)
+        return chunk[tuple(slice(0, x) for x in shape)]
+
+    def _get_chunk_indices(self, box):
+        ranges = [
+            range(b[0] // c, -(-b[1] // c)) for b, c in zip(box, self.chunks)
+        ]
+        return np.stack(
+            [x.ravel() for x in np.meshgrid(*ranges, indexing="ij")], axis=1
+        ).reshape(-1, self.ndim)
+
+    def read_box(self, box):
+        """
+        The function `read_box` reads the content of a box.
+
+        :param box: The `[start, last)` range of each dimension
+        :return: the content of the box as a numpy array.
+        """
+        box = [[max(0, x[0]), min(x[1], s)] for x, s in zip(box, self.shape)]
+        out = np.empty([max(0, x[1] - x[0]) for x in box], self.dtype.newbyteorder("="))
+        if out.size == 0:
+            return out
+
+        def read(index):
+            chunk = self.read_chunk(index)
+            start = np.array(index) * self.chunks
+            src = []
+            dst = []
+            for d in range(self.ndim):
+                low = max(box[d][0], start[d])
+                high = min(box[d][1], start[d] + self.chunks[d])
+                src.append(slice(low - start[d], high - start[d]))
+                dst.append(slice(low - box[d][0], high - box[d][0]))
+            out[tuple(dst)] = self.fill_value if chunk is None else chunk[tuple(src)]
+
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            list(executor.map(read, [tuple(x) for x in self._get_chunk_indices(box)]))
+        return out
+
+    def read_points(self, points):
+        """
+        The function `read_points` reads the values at a set of voxels, decoding only the chunks
+        that contain them.
+
+        :param points: The voxel coordinates (N, ndim)
+        :return: the value at each point.
+        """
+        points = np.asarray(points, np.int64).reshape(-1, self.ndim)
+        out = np.zeros(len(points), self.dtype.newbyteorder("="))
+        chunk_index, point_chunk = np.unique(
+            points // self.chunks, axis=0, return_inverse=True
+        )
+        point_chunk = point_chunk.ravel()
+        order = np.argsort(point_chunk, kind="stable")
+        start = np.searchsorted(point_chunk[order], np.arange(len(chunk_index) + 1))
+
+        def read(i):
+            index = order[start[i] : start[i + 1]]
+            chunk = self.read_chunk(tuple(chunk_index[i]))
+            if chunk is None:
+                out[index] = self.fill_value
+            else:
+                local = points[index] - chunk_index[i] * self.chunks
+                out[index] = chunk[tuple(local.T)]
+
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            list(executor.map(read, range(len(chunk_index))))
+        return out
+
+    def get_chunk_storage(self):
+        """
+        The function `get_chunk_storage` returns the stored size of each chunk, as
+        `get_chunk_storage_h5`.
+
+        :return: a tuple `(chunk_start_z, chunk_last_z, chunk_bytes)` of arrays with one entry per
+        stored chunk.
+        """
+        indices = self._get_chunk_indices([[0, s] for s in self.shape])
+        sizes = np.array(
+            [
+                os.path.getsize(x) if os.path.exists(x) else -1
+                for x in (self.get_chunk_path(tuple(i)) for i in indices)
+            ],
+            np.int64,
+        )
+        stored = sizes >= 0
+        chunk_start_z = indices[stored, 0] * self.chunks[0]
+        return chunk_start_z, chunk_start_z + self.chunks[0], sizes[stored]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        box = []
+        post = []
+        for k, s in zip(key, self.shape):
+            if isinstance(k, slice):
+                start, stop, step = k.indices(s)
+                box.append([start, max(start, stop)])
+                post.append(slice(None, None, step))
+            else:
+                k = int(k) + (s if int(k) < 0 else 0)
+                box.append([k, k + 1])
+                post.append(0)
+        return self.read_box(box)[tuple(post)]
+
+
+def open_chunked_array(filename, dataset_name=None, num_threads=None):
+    """
+    The function `open_chunked_array` opens a zarr or n5 array, given directly or as a dataset of a
+    container.
+
+    :param filename: The folder of the array or of its container
+    :param dataset_name: The path of the array in the container. If it is not provided and
+    `filename` is a container, the first array (in sorted order) is used
+    :param num_threads: The number of threads decoding the chunks
+    :return: a `ChunkedArray`.
+    """
+    path = filename if dataset_name is None else os.path.join(filename, dataset_name)
+    if dataset_name is None and not is_chunked_array(path):
+        for root, folders, _ in os.walk(filename):
+            folders.sort()
+            if is_chunked_array(root):
+                path = root
+                break
+    return ChunkedArray(path, num_threads)
+
+
+def write_zarr(path, data, chunks, compressor="zlib", level=1):
+    """
+    The function `write_zarr` writes an array to a zarr (v2) directory store, e.g., to convert a
+    volume or to benchmark the reader.
+
+    :param path: The folder of the array
+    :param data: The array
+    :param chunks: The chunk shape
+    :param compressor: "zlib", "gzip" or None
+    :param level: The compression level
+    """
+    os.makedirs(path, exist_ok=True)
+    data = np.ascontiguousarray(data)
+    meta = {
+        "zarr_format": 2,
+        "shape": list(data.shape),
+        "chunks": list(chunks),
+        "dtype": data.dtype.str,
+        "compressor": None if compressor is None else {"id": compressor, "level": level},
+        "fill_value": 0,
+        "order": "C",
+        "filters": None,
+    }
+    with open(os.path.join(path, ".zarray"), "w") as fid:
+        json.dump(meta, fid)
+    array = ChunkedArray(path)
+    for index in array._get_chunk_indices([[0, s] for s in data.shape]):
+        chunk = np.zeros(chunks, data.dtype)
+        box = tuple(slice(i * c, (i + 1) * c) for i, c in zip(index, chunks))
+        block = data[box]
+        chunk[tuple(slice(0, x) for x in block.shape)] = block
+        buffer = chunk.tobytes()
+        if compressor == "zlib":
+            buffer = zlib.compress(buffer, level)
+        elif compressor == "gzip":
+            compress = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            buffer = compress.compress(buffer) + compress.flush()
+        with open(array.get_chunk_path(tuple(index)), "wb") as fid:
+            fid.write(buffer)
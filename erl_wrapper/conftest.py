@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules import each other flat (`from data_io import ...`), as when run as scripts
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# command line scripts, not pytest tests
+collect_ignore = ["test_axonEM.py", "test_volume.py", "test_j1026.py"]
@@ -1,6 +1,6 @@
 import os, sys
+import zlib
 import pickle
-import h5py
 import numpy as np
 
 
@@ -14,11 +14,40 @@ def mkdir(fn, opt=""):
             os.mkdir(fn)
 
 
-def read_vol(filename, dataset_name=None, chunk_id=0, chunk_num=1):
+def get_volume_format(filename):
     """
-    The function `read_vol` reads a volume from a file, either in HDF5 or TIFF format.
+    The function `get_volume_format` finds the format of a volume from its file extension, or from
+    its metadata for zarr/n5 folders without extension.
 
-    :param filename: The name of the file to be read. It can be either a .h5 file or a .tif/.tiff file
+    :param filename: The name of the volume file or folder. A zarr/n5 array can be given by its
+    path inside the container, e.g., "pred.n5/volumes/seg"
+    :return: "h5", "tif", "zarr" or "n5".
+    """
+    parts = os.path.normpath(filename).split(os.sep)
+    for part in parts[::-1]:
+        extension = os.path.splitext(part)[1].lower()
+        if extension in [".zarr", ".n5"]:
+            return extension[1:]
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in [".h5", ".hdf5"]:
+        return "h5"
+    if extension in [".tif", ".tiff"]:
+        return "tif"
+    if os.path.isdir(filename):
+        if any(os.path.exists(os.path.join(filename, x)) for x in [".zarray", ".zgroup"]):
+            return "zarr"
+        if os.path.exists(os.path.join(filename, "attributes.json")):
+            return "n5"
+    raise ValueError("cannot recognize input file type:", filename)
+
+
+def read_vol(filename, dataset_name=None, chunk_id=0, chunk_num=1, z_range=None):
+    """
+    The function `read_vol` reads a volume from a file, either in HDF5 or TIFF format, or from a
+    zarr/n5 directory store.
+
+    :param filename: The name of the file to be read. It can be either a .h5 file or a .tif/.tiff file,
+    or a .zarr/.n5 folder
     :param dataset_name: The `dataset_name` parameter is used to specify the name of the dataset within
     the HDF5 file that you want to read. If the HDF5 file contains multiple datasets, you can use this
     parameter to specify which dataset you want to read. If `dataset_name` is not provided, the function
@@ -29,17 +58,36 @@ def read_vol(filename, dataset_name=None, chunk_id=0, chunk_num=1):
     the data is divided. It is used in conjunction with the `chunk_id` parameter to read a specific
     chunk of data from a file. By default, `chunk_num` is set to 1, indicating that, defaults to 1
     (optional)
-    :return: the result of either the `read_h5` function or the `volread` function, depending on the
+    :param z_range: The `z_range` parameter is an optional `[start_z, last_z)` pair of z-slices to
+    read. If given, it takes precedence over `chunk_id` and `chunk_num`
+    :return: the result of either the `read_h5` function or the zarr/n5/tif reader, depending on the
     file type of the input filename.
     """
-    if ".h5" in filename:
-        return read_h5(filename, dataset_name, chunk_id=chunk_id, chunk_num=chunk_num)
-    elif ".tif" in filename or ".tiff" in filename:
-        from imageio import volread
+    volume_format = get_volume_format(filename)
+    if volume_format == "h5":
+        return read_h5(
+            filename,
+            dataset_name,
+            chunk_id=chunk_id,
+            chunk_num=chunk_num,
+            z_range=z_range,
+        )
+    array = _open_array(filename, dataset_name)
+    if z_range is None:
+        num_z = int(np.ceil(array.shape[0] / float(chunk_num)))
+        z_range = [chunk_id * num_z, (chunk_id + 1) * num_z]
+    return array.read_box([z_range] + [[0, x] for x in array.shape[1:]])
 
-        return volread(filename)
-    else:
-        raise ValueError("cannot recognize input file type:", filename)
+
+def _open_array(filename, dataset_name=None):
+    # zarr/n5 arrays and tif stacks share the same reading interface
+    if get_volume_format(filename) == "tif":
+        from tiff_store import TiffStack
+
+        return TiffStack(filename)
+    from chunked_store import open_chunked_array
+
+    return open_chunked_array(filename, dataset_name)
 
 
 def read_pkl(filename):
@@ -78,7 +126,42 @@ def write_pkl(filename, content):
             pickle.dump(content, fid)
 
 
-def read_h5(filename, dataset_names=None, chunk_id=0, chunk_num=1):
+def write_h5(filename, data, dataset_names="main"):
+    """
+    The function `write_h5` writes one or several numpy arrays into an HDF5 file.
+
+    :param filename: The filename parameter is the name of the HDF5 file to be written
+    :param data: The `data` parameter is either a numpy array or a list of numpy arrays
+    :param dataset_names: The `dataset_names` parameter is the name of the dataset, or a list of names
+    with one entry for each array in `data`, defaults to "main"
+    """
+    import h5py
+
+    fid = h5py.File(filename, "w")
+    if isinstance(dataset_names, str):
+        data = [data]
+        dataset_names = [dataset_names]
+    for dataset_name, arr in zip(dataset_names, data):
+        fid.create_dataset(dataset_name, data=arr, compression="gzip")
+    fid.close()
+
+
+def write_vol(filename, data, dataset_names="main"):
+    """
+    The function `write_vol` writes a volume (or a list of arrays) into an HDF5 file.
+
+    :param filename: The name of the output file. Only .h5 files are supported
+    :param data: The `data` parameter is either a numpy array or a list of numpy arrays
+    :param dataset_names: The `dataset_names` parameter is the name of the dataset, or a list of names
+    with one entry for each array in `data`, defaults to "main"
+    """
+    if ".h5" in filename:
+        write_h5(filename, data, dataset_names)
+    else:
+        raise ValueError("cannot recognize output file type:", filename)
+
+
+def read_h5(filename, dataset_names=None, chunk_id=0, chunk_num=1, z_range=None):
     """
     The function `read_h5` reads data from an HDF5 file, either the entire dataset or a specified chunk,
     and returns the data as a numpy array or a list of numpy arrays.
@@ -95,27 +178,274 @@ def read_h5(filename, dataset_names=None, chunk_id=0, chunk_num=1):
     dataset into. This is useful when dealing with large datasets that cannot fit into memory all at
     once. By dividing the dataset into chunks, you can read and process smaller portions of the data at
     a time, defaults to 1 (optional)
+    :param z_range: The `z_range` parameter is an optional `[start_z, last_z)` pair of z-slices to
+    read. If given, it takes precedence over `chunk_id` and `chunk_num`
     :return: the dataset(s) from the specified HDF5 file. If only one dataset is specified, it returns
     that dataset as a numpy array. If multiple datasets are specified, it returns a list of numpy
     arrays, each corresponding to a dataset.
     """
+    import h5py
+
     fid = h5py.File(filename, "r")
     if dataset_names is None:
         dataset_names = fid.keys() if sys.version[0] == "2" else list(fid)
+    elif isinstance(dataset_names, str):
+        dataset_names = [dataset_names]
 
     out = [None] * len(dataset_names)
     for dataset_id, dataset_name in enumerate(dataset_names):
-        if chunk_num == 1:
-            out[dataset_id] = np.array(fid[dataset_name])
+        dataset = fid[dataset_name]
+        if dataset.ndim == 0:
+            out[dataset_id] = dataset[()]
+            continue
+        # h5py slicing already returns a new array: avoid another copy
+        if z_range is not None:
+            z0, z1 = z_range
         else:
-            num_z = int(np.ceil(fid[dataset_name].shape[0] / float(chunk_num)))
-            out[dataset_id] = np.array(
-                fid[dataset_name][chunk_id * num_z : (chunk_id + 1) * num_z]
-            )
+            num_z = int(np.ceil(dataset.shape[0] / float(chunk_num)))
+            z0, z1 = chunk_id * num_z, (chunk_id + 1) * num_z
+        out[dataset_id] = _read_dataset_box(
+            dataset, [[z0, z1]] + [[0, x] for x in dataset.shape[1:]]
+        )
     fid.close()
     return out[0] if len(out) == 1 else out
 
 
+# HDF5 filters decoded by read_chunks_direct_h5
+H5_FILTER_DEFLATE = 1
+H5_FILTER_SHUFFLE = 2
+H5_FILTER_FLETCHER32 = 3
+
+
+def get_direct_filters_h5(dataset):
+    """
+    The function `get_direct_filters_h5` returns the filter pipeline of a chunked HDF5 dataset if
+    `read_chunks_direct_h5` can decode it, i.e., only deflate (gzip), shuffle and fletcher32 filters,
+    with at least one compression filter and the shuffle (if any) first.
+
+    :param dataset: An open h5py dataset
+    :return: the list of filter codes in pipeline order, or None.
+    """
+    if dataset.chunks is None:
+        return None
+    plist = dataset.id.get_create_plist()
+    filters = [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+    supported = [H5_FILTER_DEFLATE, H5_FILTER_SHUFFLE, H5_FILTER_FLETCHER32]
+    if H5_FILTER_DEFLATE not in filters or any(x not in supported for x in filters):
+        return None
+    if H5_FILTER_SHUFFLE in filters[1:]:
+        return None
+    return filters
+
+
+def fletcher32_h5(data, block_size=512):
+    """
+    The function `fletcher32_h5` computes the fletcher32 checksum of the HDF5 filter: the big-endian
+    16-bit words are summed with end-around carry, as `H5_checksum_fletcher32`. The second sum (of
+    the running first sums) is computed by blocks of words, with exact float64 products.
+
+    :param data: The bytes of the chunk, without the stored checksum
+    :param block_size: The number of words of a block
+    :return: the checksum as an int.
+    """
+    data = np.frombuffer(data, np.uint8)
+    words = np.frombuffer(data[: len(data) // 2 * 2], ">u2")
+    if len(data) % 2 == 1:
+        # the last byte is the high byte of a word
+        words = np.append(words, np.uint16(data[-1]) << np.uint16(8))
+    num_words = len(words)
+    total1 = int(words.sum(dtype=np.int64))
+    if total1 == 0:
+        return 0
+    # total2 = sum of (num_words - i) * words[i], modulo 65535
+    num_blocks = num_words // block_size
+    blocks = words[: num_blocks * block_size].reshape(num_blocks, block_size).astype(np.float64)
+    inner = blocks @ np.arange(block_size, 0, -1, dtype=np.float64)
+    block_weights = (
+        num_words - (np.arange(num_blocks, dtype=np.int64) + 1) * block_size
+    ) % 65535
+    rest = words[num_blocks * block_size :].astype(np.int64)
+    total2 = (
+        int(inner.astype(np.int64).sum() % 65535)
+        + int((block_weights * blocks.sum(axis=1).astype(np.int64)).sum() % 65535)
+        + int((rest * np.arange(len(rest), 0, -1)).sum())
+    )
+    # the end-around carry keeps the non-zero sums in [1, 65535]
+    return (((total2 - 1) % 65535 + 1) << 16) | ((total1 - 1) % 65535 + 1)
+
+
+def read_chunks_direct_h5(dataset, box, filters, num_threads=None):
+    """
+    The function `read_chunks_direct_h5` reads a box of a compressed HDF5 dataset by fetching the raw
+    chunks with `read_direct_chunk` and decoding them in a thread pool (zlib releases the GIL). Each
+    chunk is decompressed once, then unshuffled (resp. copied) directly into its place in the output
+    array. The fletcher32 checksums are verified as h5py does.
+
+    :param dataset: An open h5py dataset
+    :param box: The `[start, last)` range of each dimension
+    :param filters: The filter pipeline of the dataset (see `get_direct_filters_h5`)
+    :param num_threads: The number of threads, defaults to the number of cpus (at most 8)
+    :return: the content of the box as a numpy array.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if num_threads is None:
+        num_threads = min(8, os.cpu_count() or 1)
+    box = [[max(0, x[0]), min(x[1], s)] for x, s in zip(box, dataset.shape)]
+    out = np.empty([max(0, x[1] - x[0]) for x in box], dataset.dtype)
+    if out.size == 0:
+        return out
+    chunks = np.array(dataset.chunks)
+    itemsize = dataset.dtype.itemsize
+    fill_value = dataset.fillvalue
+    ranges = [range(x[0] // c, -(-x[1] // c)) for x, c in zip(box, chunks)]
+    offsets = np.stack(
+        [x.ravel() for x in np.meshgrid(*ranges, indexing="ij")], axis=1
+    ) * chunks
+
+    def read(offset):
+        src = []
+        dst = []
+        for d in range(len(offset)):
+            low = max(box[d][0], offset[d])
+            high = min(box[d][1], offset[d] + chunks[d])
+            src.append(slice(low - offset[d], high - offset[d]))
+            dst.append(slice(low - box[d][0], high - box[d][0]))
+        src, dst = tuple(src), tuple(dst)
+        offset = tuple(int(x) for x in offset)
+        if dataset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+            # chunk not allocated
+            out[dst] = fill_value
+            return
+        filter_mask, data = dataset.id.read_direct_chunk(offset)
+        data = memoryview(data)
+        shuffled = False
+        # undo the filters in reverse order, skipping the ones not applied to this chunk
+        for i in range(len(filters) - 1, -1, -1):
+            if filter_mask & (1 << i):
+                continue
+            if filters[i] == H5_FILTER_FLETCHER32:
+                stored = int.from_bytes(data[-4:], "little")
+                data = data[:-4]
+                checksum = fletcher32_h5(data)
+                # older HDF5 versions stored the bytes of each half swapped
+                swapped = ((checksum & 0x00FF00FF) << 8) | ((checksum >> 8) & 0x00FF00FF)
+                if stored not in (checksum, swapped):
+                    raise OSError(
+                        f"fletcher32 checksum mismatch in chunk {offset} of {dataset.name}"
+                    )
+            elif filters[i] == H5_FILTER_DEFLATE:
+                data = zlib.decompress(data)
+            elif filters[i] == H5_FILTER_SHUFFLE and itemsize > 1:
+                # the shuffle is the first filter: undone while writing to the output
+                shuffled = True
+        target = out[dst]
+        if not shuffled:
+            target[...] = np.frombuffer(data, dataset.dtype).reshape(chunks)[src]
+            return
+        # the k-th bytes of all the items are stored together
+        planes = np.frombuffer(data, np.uint8).reshape((itemsize,) + tuple(chunks))
+        target_bytes = target.view(np.uint8).reshape(target.shape + (itemsize,))
+        for k in range(itemsize):
+            target_bytes[..., k] = planes[k][src]
+
+    with ThreadPoolExecutor(num_threads) as executor:
+        list(executor.map(read, offsets))
+    return out
+
+
+def _read_dataset_box(dataset, box):
+    # compressed chunks are decoded in parallel, other datasets are read by h5py
+    filters = get_direct_filters_h5(dataset)
+    if filters is not None:
+        return read_chunks_direct_h5(dataset, box, filters)
+    return dataset[tuple(slice(x[0], x[1]) for x in box)]
+
+
+def read_box_h5(filename, box, dataset_name=None):
+    """
+    The function `read_box_h5` reads a 3D box of an HDF5 dataset.
+
+    :param filename: The name of the HDF5 file
+    :param box: The `[start, last)` range of each dimension, e.g., `[[z0, z1], [y0, y1], [x0, x1]]`
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :return: the content of the box as a numpy array.
+    """
+    import h5py
+
+    with h5py.File(filename, "r") as fid:
+        if dataset_name is None:
+            dataset_name = list(fid)[0]
+        return _read_dataset_box(fid[dataset_name], box)
+
+
+def read_points_h5(filename, points, dataset_name=None):
+    """
+    The function `read_points_h5` reads the values of an HDF5 dataset at sparse points. The points
+    are grouped by storage chunk, so that only the chunks containing points are read (and each of
+    them once). Contiguous datasets are read by z-slices.
+
+    :param filename: The name of the HDF5 file
+    :param points: The voxel positions (N, 3)
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :return: the value at each point (N).
+    """
+    import h5py
+
+    points = np.asarray(points, np.int64).reshape(-1, 3)
+    with h5py.File(filename, "r") as fid:
+        if dataset_name is None:
+            dataset_name = list(fid)[0]
+        dataset = fid[dataset_name]
+        chunks = np.array(
+            (1,) + dataset.shape[1:] if dataset.chunks is None else dataset.chunks
+        )
+        out = np.zeros(len(points), dataset.dtype)
+        if len(points) == 0:
+            return out
+        grid = tuple(-(-np.array(dataset.shape) // chunks))
+        chunk_id = np.ravel_multi_index(tuple((points // chunks).T), grid)
+        order = np.argsort(chunk_id, kind="stable")
+        chunk_ids, chunk_start = np.unique(chunk_id[order], return_index=True)
+        chunk_start = np.append(chunk_start, len(points))
+        for i, cid in enumerate(chunk_ids):
+            start = np.array(np.unravel_index(cid, grid)) * chunks
+            data = dataset[tuple(slice(x, x + c) for x, c in zip(start, chunks))]
+            index = order[chunk_start[i] : chunk_start[i + 1]]
+            pts = points[index] - start
+            out[index] = data[pts[:, 0], pts[:, 1], pts[:, 2]]
+    return out
+
+
+def read_box(filename, box, dataset_name=None):
+    """
+    The function `read_box` reads a 3D box of an HDF5 dataset, a zarr/n5 array or a tif stack.
+
+    :param filename: The name of the HDF5 or tif file, or of the zarr/n5 folder
+    :param box: The `[start, last)` range of each dimension, e.g., `[[z0, z1], [y0, y1], [x0, x1]]`
+    :param dataset_name: The name of the dataset (optional)
+    :return: the content of the box as a numpy array.
+    """
+    if get_volume_format(filename) == "h5":
+        return read_box_h5(filename, box, dataset_name)
+    return _open_array(filename, dataset_name).read_box(box)
+
+
+def read_points(filename, points, dataset_name=None):
+    """
+    The function `read_points` reads the values of an HDF5 dataset, a zarr/n5 array or a tif stack
+    at sparse points, reading each chunk (page) containing points once.
+
+    :param filename: The name of the HDF5 or tif file, or of the zarr/n5 folder
+    :param points: The voxel positions (N, 3)
+    :param dataset_name: The name of the dataset (optional)
+    :return: the value at each point (N).
+    """
+    if get_volume_format(filename) == "h5":
+        return read_points_h5(filename, points, dataset_name)
+    return _open_array(filename, dataset_name).read_points(points)
+
+
 def get_volume_size_h5(filename, dataset_name=None):
     """
     The function `get_volume_size_h5` returns the size of a dataset in an HDF5 file, or the size of the
@@ -127,6 +457,8 @@ def get_volume_size_h5(filename, dataset_name=None):
     dataset in the file and return its shape as the volume size
     :return: the size of the volume as a list.
     """
+    import h5py
+
     volume_size = []
     fid = h5py.File(filename, "r")
     if dataset_name is None:
@@ -137,6 +469,284 @@ def get_volume_size_h5(filename, dataset_name=None):
     return volume_size
 
 
+def get_volume_info(filename, dataset_name=None):
+    """
+    The function `get_volume_info` returns the shape, data type and storage chunk shape of a volume
+    without reading its content.
+
+    :param filename: The name of the volume file (.h5 or .tif) or zarr/n5 folder
+    :param dataset_name: The name of the dataset within the HDF5 file. If it is not provided, the first
+    dataset in the file is used
+    :return: a tuple `(shape, dtype, chunks)`. `chunks` is None for contiguous datasets, one page for
+    tif stacks.
+    """
+    if get_volume_format(filename) != "h5":
+        array = _open_array(filename, dataset_name)
+        return array.shape, array.dtype.newbyteorder("="), array.chunks
+    import h5py
+
+    with h5py.File(filename, "r") as fid:
+        if dataset_name is None:
+            dataset_name = list(fid)[0]
+        dataset = fid[dataset_name]
+        return tuple(dataset.shape), dataset.dtype, dataset.chunks
+
+
+def get_pyramid_h5(filename):
+    """
+    The function `get_pyramid_h5` lists the scales of a multiscale HDF5 file, i.e., one 3D dataset
+    (possibly in its own group) per scale. The downsampling factor of a scale is read from its
+    "downsample" attribute (zyx order) if present, else from its shape relative to the largest scale.
+
+    :param filename: The name of the HDF5 file
+    :return: a list of `(dataset_name, factor)` pairs sorted from the finest to the coarsest scale,
+    with `factor` the zyx downsampling factor as an int array.
+    """
+    import h5py
+
+    scales = []
+    with h5py.File(filename, "r") as fid:
+
+        def add_scale(name, obj):
+            if isinstance(obj, h5py.Dataset) and obj.ndim == 3:
+                scales.append((name, np.array(obj.shape), obj.attrs.get("downsample")))
+
+        fid.visititems(add_scale)
+    if len(scales) == 0:
+        return []
+    full_shape = np.max([x[1] for x in scales], axis=0)
+    pyramid = []
+    for name, shape, factor in scales:
+        if factor is None:
+            factor = np.round(full_shape / np.maximum(shape, 1))
+        pyramid.append((name, np.asarray(factor).astype(np.int64)))
+    return sorted(pyramid, key=lambda x: (int(np.prod(x[1])), x[0]))
+
+
+def select_pyramid_scale(pyramid, node_spacing):
+    """
+    The function `select_pyramid_scale` chooses the coarsest scale of a pyramid that still resolves
+    the spacing of the gt nodes.
+
+    :param pyramid: The scales of the pyramid (see `get_pyramid_h5`)
+    :param node_spacing: The spacing of the gt nodes in voxels of the finest scale (zyx order or a
+    single value)
+    :return: the `(dataset_name, factor)` of the chosen scale (the finest if none is coarse enough).
+    """
+    node_spacing = np.broadcast_to(np.asarray(node_spacing, np.float64), (3,))
+    selected = pyramid[0]
+    for name, factor in pyramid[1:]:
+        if np.all(factor <= node_spacing) and np.prod(factor) > np.prod(selected[1]):
+            selected = (name, factor)
+    return selected
+
+
+def get_chunk_storage_h5(filename, dataset_name=None):
+    """
+    The function `get_chunk_storage_h5` returns the stored (compressed) size of each chunk of an HDF5
+    dataset, to account for the bytes read from disk per z-slab.
+
+    :param filename: The name of the HDF5 file
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :return: a tuple `(chunk_start_z, chunk_last_z, chunk_bytes)` of arrays with one entry per
+    stored chunk. A contiguous dataset counts as a single chunk.
+    """
+    import h5py
+
+    with h5py.File(filename, "r") as fid:
+        if dataset_name is None:
+            dataset_name = list(fid)[0]
+        dataset = fid[dataset_name]
+        if dataset.chunks is None:
+            return (
+                np.array([0]),
+                np.array([dataset.shape[0]]),
+                np.array([dataset.id.get_storage_size()]),
+            )
+        num_chunk = dataset.id.get_num_chunks()
+        chunk_start_z = np.zeros(num_chunk, np.int64)
+        chunk_bytes = np.zeros(num_chunk, np.int64)
+        for chunk_id in range(num_chunk):
+            info = dataset.id.get_chunk_info(chunk_id)
+            chunk_start_z[chunk_id] = info.chunk_offset[0]
+            chunk_bytes[chunk_id] = info.size
+        return chunk_start_z, chunk_start_z + dataset.chunks[0], chunk_bytes
+
+
+def get_chunk_storage(filename, dataset_name=None):
+    """
+    The function `get_chunk_storage` returns the stored size of each chunk of an HDF5 dataset, a
+    zarr/n5 array or a tif stack (one chunk per page, see `get_chunk_storage_h5`).
+    """
+    if get_volume_format(filename) == "h5":
+        return get_chunk_storage_h5(filename, dataset_name)
+    return _open_array(filename, dataset_name).get_chunk_storage()
+
+
+def get_completed_z_ranges(filename, dataset_name=None):
+    """
+    The function `get_completed_z_ranges` finds the z-ranges of a volume that is still being written
+    slab by slab, from the storage chunks already allocated. A row of chunks (along z) is complete if
+    all its chunks are stored and the writer has started the next row (or it is the last row), so
+    that a row written in several pieces is not read before its last piece.
+
+    :param filename: The name of the HDF5 file or zarr/n5 folder
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :return: a list of `[start_z, last_z)` pairs of the complete z-ranges. A contiguous HDF5 dataset
+    is allocated at once, so none of its z-ranges is known to be complete.
+    """
+    shape, _, chunks = get_volume_info(filename, dataset_name)
+    if chunks is None:
+        return []
+    chunk_start_z, _, _ = get_chunk_storage(filename, dataset_name)
+    num_rows = -(-shape[0] // chunks[0])
+    row_chunks = int(np.prod([-(-s // c) for s, c in zip(shape[1:], chunks[1:])]))
+    stored = np.bincount(
+        np.asarray(chunk_start_z, np.int64) // chunks[0], minlength=num_rows
+    )[:num_rows]
+    complete = (stored == row_chunks) & np.append(stored[1:] > 0, True)
+    # runs of complete rows
+    edges = np.diff(np.concatenate([[0], complete.astype(np.int8), [0]]))
+    return [
+        [int(start) * chunks[0], min(int(last) * chunks[0], shape[0])]
+        for start, last in zip(np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0])
+    ]
+
+
+def iter_raw_chunks_h5(filename, dataset_name=None, slab_bytes=2**26):
+    """
+    The function `iter_raw_chunks_h5` iterates over the stored (still compressed) chunks of an HDF5
+    dataset without decompressing them.
+
+    :param filename: The name of the HDF5 file
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :param slab_bytes: The maximum number of bytes read at once from a contiguous dataset
+    :return: a generator of `(chunk_offset, filter_mask, raw_bytes)` tuples. Contiguous datasets are
+    yielded as a single "chunk" at offset (0, ..., 0), in consecutive pieces of decompressed bytes
+    (z-slabs of at most `slab_bytes`, or one plane), so that hashing them does not load the volume.
+    """
+    import h5py
+
+    with h5py.File(filename, "r") as fid:
+        if dataset_name is None:
+            dataset_name = list(fid)[0]
+        dataset = fid[dataset_name]
+        if dataset.chunks is None:
+            if dataset.ndim == 0:
+                yield (), 0, dataset[()].tobytes()
+                return
+            plane_bytes = int(np.prod(dataset.shape[1:])) * dataset.dtype.itemsize
+            step = max(1, slab_bytes // max(plane_bytes, 1))
+            for z in range(0, dataset.shape[0], step):
+                yield (0,) * dataset.ndim, 0, dataset[z : z + step].tobytes()
+            return
+        for chunk_id in range(dataset.id.get_num_chunks()):
+            offset = dataset.id.get_chunk_info(chunk_id).chunk_offset
+            filter_mask, raw_bytes = dataset.id.read_direct_chunk(offset)
+            yield offset, filter_mask, raw_bytes
+
+
+def _read_cgroup_value(filename):
+    # return None if the file does not exist or the value is unlimited
+    try:
+        with open(filename, "r") as fid:
+            value = fid.read().strip()
+    except OSError:
+        return None
+    if not value.isdigit():
+        return None
+    value = int(value)
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    return value if value < 2**60 else None
+
+
+def get_memory_available():
+    """
+    The function `get_memory_available` returns the number of bytes that can still be allocated by the
+    current process. Both the system free memory and the memory limit of the container (cgroup v1 or
+    v2) are taken into account.
+
+    :return: the available memory in bytes, or None if it cannot be determined on this platform.
+    """
+    available = []
+    try:
+        with open("/proc/meminfo", "r") as fid:
+            for line in fid:
+                if line.startswith("MemAvailable:"):
+                    available.append(int(line.split()[1]) * 1024)
+                    break
+    except OSError:
+        pass
+
+    for limit_file, usage_file in [
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        (
+            "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+            "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        ),
+    ]:
+        limit = _read_cgroup_value(limit_file)
+        if limit is not None:
+            usage = _read_cgroup_value(usage_file) or 0
+            available.append(max(limit - usage, 0))
+            break
+    return min(available) if len(available) > 0 else None
+
+
+def parse_memory_size(size):
+    """
+    The function `parse_memory_size` converts a human readable memory size into bytes.
+
+    :param size: either a number of bytes or a string such as "512M", "2.5G" or "1T"
+    :return: the size in bytes as an integer.
+    """
+    if not isinstance(size, str):
+        return int(size)
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    size = size.strip().upper().rstrip("B")
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def plan_slabs(num_z, plane_bytes, memory_budget=None, chunk_z=1):
+    """
+    The function `plan_slabs` splits a volume along z into the fewest slabs whose working memory fits
+    into the memory budget.
+
+    :param num_z: The number of z-slices of the volume
+    :param plane_bytes: The number of bytes needed to process one z-slice
+    :param memory_budget: The maximum number of bytes for one slab. It is further capped by the
+    currently available memory. If None, only the available memory is used
+    :param chunk_z: The z-size of the storage chunks. Slab boundaries are aligned to it whenever a
+    slab can hold at least one chunk, so that no chunk is decompressed twice, defaults to 1
+    :return: a list of `[start_z, last_z)` pairs covering the volume.
+    """
+    available = get_memory_available()
+    if memory_budget is None:
+        memory_budget = available
+    elif available is not None:
+        memory_budget = min(memory_budget, available)
+    if memory_budget is None:
+        max_z = num_z
+    else:
+        max_z = int(memory_budget // max(plane_bytes, 1))
+    max_z = min(max(max_z, 1), num_z)
+
+    chunk_z = max(int(chunk_z or 1), 1)
+    if max_z >= chunk_z:
+        max_z = max_z // chunk_z * chunk_z
+    else:
+        # even one storage chunk does not fit: fall back to plain slices
+        chunk_z = 1
+
+    # balance the slab sizes for the same number of reads
+    slab_num = int(np.ceil(num_z / float(max_z)))
+    slab_z = int(np.ceil(num_z / float(slab_num)))
+    slab_z = min(int(np.ceil(slab_z / float(chunk_z))) * chunk_z, max_z)
+    return [[z, min(z + slab_z, num_z)] for z in range(0, num_z, slab_z)]
+
+
 def pts_convertor(pts, factor=10000):
     if pts.shape[1] == 3:
         # Nx3 -> N
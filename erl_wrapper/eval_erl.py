@@ -1,6 +1,22 @@
 import os
+import time
 import numpy as np
-from data_io import read_vol, write_vol, mkdir
+from data_io import (
+    read_vol,
+    write_vol,
+    mkdir,
+    get_volume_info,
+    get_chunk_storage,
+    get_volume_format,
+    get_pyramid_h5,
+    select_pyramid_scale,
+    plan_slabs,
+)
+from mask_index import MaskIndex
+from relabel import SegmentRelabel, count_pairs, fits_data_type
+from roi import SkeletonIndex, get_node_physical_position
+from networkx_lite import NetworkXGraphLite, get_graph_arrays
+from profiling import profile_stage, profile_event, is_tracing
 
 # step 1: compute node_id-segment lookup table from predicted segmemtation and node positions
 # step 2: compute the ERL from the lookup table and the gt graph
@@ -33,7 +49,7 @@ def compute_segment_lut_tile(
                     write_vol(sn, [ind, val], ["ind", "val"])
 
 
-def compute_segment_lut_tile_combine(zran, yran, xran, output_path_format)
+def compute_segment_lut_tile_combine(zran, yran, xran, output_path_format):
     out = None
     for z in zran:
         for y in yran:
@@ -45,7 +61,18 @@ def compute_segment_lut_tile_combine(zran, yran, xran, output_path_format)
     return out
 
 def compute_segment_lut(
-    segment, node_position, mask=None, chunk_num=1, data_type=np.uint32
+    segment,
+    node_position,
+    mask=None,
+    chunk_num=1,
+    data_type=np.uint32,
+    memory_budget=None,
+    profiler=None,
+    node_layout=None,
+    dataset_name=None,
+    node_spacing=None,
+    mask_at_scale=False,
+    relabel=None,
 ):
     """
     The function `compute_node_segment_lut_low_mem` is a low memory version of a lookup table
@@ -55,60 +82,319 @@ def compute_segment_lut(
     is (N, 3), where N is the number of nodes and each row represents the (z, y, x) coordinates of a
     node
     :param segment: either a 3D volume or a string representing the
-    name of a file containing segment data.
+    name of a file containing segment data (.h5 or .tif file, or zarr/n5 folder).
+    :param mask: either a 3D volume, a string representing the name of a file containing the mask of
+    voxels that do not belong to any gt skeleton, or its precomputed `MaskIndex`. With a `MaskIndex`,
+    the mask volume is not read
     :param chunk_num: The parameter `chunk_num` is the number of chunks into which the volume is divided
     for reading. It is used in the `read_vol` function to specify which chunk to read, defaults to 1
     (optional)
     :param data_type: The parameter `data_type` is the data type of the array used to store the node segment
     lookup table. In this case, it is set to `np.uint32`, which means the array will store unsigned
-    32-bit integers
-    :return: a list of numpy arrays, where each array represents the node segment lookup table for a
-    specific segment.
+    32-bit integers. If the segment ids do not fit into it (e.g., uint64 ids), they are relabeled
+    to dense ids instead of being truncated
+    :param memory_budget: The maximum number of bytes used to hold one slab of the volume(s). If given,
+    `chunk_num` is ignored and the slab boundaries are planned from the data type, shape and storage
+    chunks of the segment and mask volumes, and the currently available memory (optional)
+    :param profiler: a `StageProfiler` recording the resources used by each stage, or a `Tracer`
+    also emitting the bytes read, decompressed and gathered for each slab (optional)
+    :param node_layout: The `NodeLayout` of nodes sorted by z-slice (see node_layout.py). Each slab
+    then looks up a contiguous range of nodes instead of scanning all of them (optional)
+    :param dataset_name: The dataset of the segment file to read. For a multiscale file (one dataset
+    per scale, see `get_pyramid_h5`), it defaults to the scale chosen from `node_spacing`. Without
+    `node_spacing`, the file is not treated as a pyramid and the first dataset is read (optional)
+    :param node_spacing: The spacing of the gt nodes in voxels, zyx order or a single value (see
+    `get_node_spacing`). If given and the segment file is multiscale, the nodes are looked up in the
+    coarsest scale that still resolves this spacing, at their position divided by its downsampling
+    factor (optional)
+    :param mask_at_scale: If True, the mask histogram is computed at the chosen scale from the mask
+    subsampled to it, with the voxel counts multiplied by the downsampling factor. Otherwise, it is
+    computed at the finest scale
+    :param relabel: a `SegmentRelabel` mapping the segment ids to dense ids of its data type, updated
+    with the ids found at the nodes, e.g., to map the ids of the merge stats back with its inverse.
+    If None, a new one is used if the segment ids do not fit into `data_type` (optional)
+    :return: the node segment lookup table and the segment histogram of the mask voxels, as a pair of
+    arrays `(segment_ids, voxel_counts)` (None if no mask is given).
     """
     if not isinstance(segment, str):
+        if relabel is None and not fits_data_type(segment.dtype, data_type):
+            relabel = SegmentRelabel(data_type)
         node_lut = segment[
             node_position[:, 0], node_position[:, 1], node_position[:, 2]
         ]
-        mask_id = []
-        if mask is not None:
+        if relabel is not None:
+            node_lut = relabel.update(node_lut)
+        mask_id = None
+        if isinstance(mask, MaskIndex):
+            mask_id = np.unique(mask.gather(segment), return_counts=True)
+        elif mask is not None:
             if isinstance(mask, str):
                 mask = read_vol(mask)
-            mask_id = segment[mask > 0]
+            mask_id = np.unique(segment[mask > 0], return_counts=True)
+        if mask_id is not None and relabel is not None:
+            mask_id = relabel_histogram(relabel, mask_id, node_lut)
     else:
-        assert ".h5" in segment
-        node_lut = np.zeros(node_position.shape[0], data_type)
-        mask_id = [[]] * chunk_num
-        start_z = 0
-        for chunk_id in range(chunk_num):
-            seg = read_vol(segment, None, chunk_id, chunk_num)
-            last_z = start_z + seg.shape[0]
-            ind = (node_position[:, 0] >= start_z) * (node_position[:, 0] < last_z)
-            pts = node_position[ind]
-            node_lut[ind] = seg[pts[:, 0] - start_z, pts[:, 1], pts[:, 2]]
-            if mask is not None:
-                if isinstance(mask, str):
-                    mask_z = read_vol(mask, None, chunk_id, chunk_num)
-                else:
-                    mask_z = mask[start_z:last_z]
-                mask_id[chunk_id] = seg[mask_z > 0]
-            start_z = last_z
+        volume_format = get_volume_format(segment)
+        assert volume_format in ["h5", "tif", "zarr", "n5"]
+        factor = np.ones(3, np.int64)
+        if dataset_name is None and volume_format == "h5" and node_spacing is not None:
+            # only look for a pyramid if asked, a file with several datasets is read as before
+            pyramid = get_pyramid_h5(segment)
+            if len(pyramid) > 1:
+                dataset_name, factor = select_pyramid_scale(pyramid, node_spacing)
+        if relabel is None and not fits_data_type(
+            get_volume_info(segment, dataset_name)[1], data_type
+        ):
+            relabel = SegmentRelabel(data_type)
+        if np.any(factor > 1):
+            # look up the nodes at a coarser scale
+            node_lut, mask_id = _compute_segment_lut_file(
+                segment,
+                dataset_name,
+                node_position // factor,
+                mask if mask_at_scale else None,
+                chunk_num,
+                data_type,
+                memory_budget,
+                profiler,
+                None if node_layout is None else node_layout.downsample(int(factor[0])),
+                mask_factor=factor,
+                relabel=relabel,
+            )
+            if mask is not None and mask_at_scale:
+                mask_id = [(x[0], x[1] * int(np.prod(factor))) for x in mask_id]
+            elif mask is not None:
+                # mask histogram at the finest scale
+                _, mask_id = _compute_segment_lut_file(
+                    segment,
+                    pyramid[0][0],
+                    node_position[:0],
+                    mask,
+                    chunk_num,
+                    data_type,
+                    memory_budget,
+                    profiler,
+                )
+        else:
+            node_lut, mask_id = _compute_segment_lut_file(
+                segment,
+                dataset_name,
+                node_position,
+                mask,
+                chunk_num,
+                data_type,
+                memory_budget,
+                profiler,
+                node_layout,
+                relabel=relabel,
+            )
         if mask is not None:
-            # remove irrelevant seg ids (not used by nodes)
-            node_lut_unique = np.unique(node_lut)
-            for chunk_id in range(chunk_num):
-                mask_id[chunk_id] = mask_id[chunk_id][
-                    np.in1d(mask_id[chunk_id], node_lut_unique)
-                ]
-        mask_id = np.concatenate(mask_id)
+            with profile_stage(profiler, "merge_mask_histogram"):
+                mask_id = merge_segment_histograms(mask_id)
+                if relabel is not None:
+                    mask_id = relabel_histogram(relabel, mask_id, node_lut)
+                else:
+                    # remove irrelevant seg ids (not used by nodes)
+                    relevant = np.isin(mask_id[0], node_lut)
+                    mask_id = (mask_id[0][relevant], mask_id[1][relevant])
     return node_lut, mask_id
 
 
+def relabel_histogram(relabel, histogram, node_lut):
+    """
+    The function `relabel_histogram` maps the segment ids of a histogram to the dense ids of a
+    `SegmentRelabel`, keeping only the segments used by nodes.
+
+    :param relabel: The `SegmentRelabel` of the node segment lookup table
+    :param histogram: a pair of arrays `(segment_ids, voxel_counts)` with the original segment ids
+    :param node_lut: The node segment lookup table (dense ids)
+    :return: a pair of arrays `(labels, voxel_counts)`.
+    """
+    labels, found = relabel.lookup(histogram[0])
+    relevant = found & np.isin(labels, node_lut)
+    return labels[relevant], histogram[1][relevant]
+
+
+def _subsample_mask(mask_z, factor, shape):
+    # nearest subsampling of a mask slab to the shape of a slab of a coarser scale
+    mask_z = mask_z[:: factor[0], :: factor[1], :: factor[2]]
+    out = np.zeros(shape, bool)
+    overlap = tuple(slice(0, min(a, b)) for a, b in zip(mask_z.shape, shape))
+    out[overlap] = mask_z[overlap] > 0
+    return out
+
+
+def _compute_segment_lut_file(
+    segment,
+    dataset_name,
+    node_position,
+    mask,
+    chunk_num,
+    data_type,
+    memory_budget,
+    profiler,
+    node_layout=None,
+    mask_factor=None,
+    relabel=None,
+):
+    """
+    The function `_compute_segment_lut_file` reads a segment dataset by z-slabs for
+    `compute_segment_lut`.
+
+    :param mask_factor: The downsampling factor of the segment dataset (zyx order). If given, the
+    mask (at the finest scale) is subsampled to the segment dataset
+    :param relabel: The `SegmentRelabel` updated with the segment ids of the nodes (optional)
+    :return: the node segment lookup table and the segment histograms of the mask voxels of each
+    slab (None if no mask is given).
+    """
+    slabs = plan_segment_lut_slabs(
+        segment, mask, chunk_num, memory_budget, dataset_name, mask_factor
+    )
+    node_lut = np.zeros(node_position.shape[0], data_type)
+    mask_id = [None] * len(slabs)
+    mask_z_factor = 1 if mask_factor is None else int(mask_factor[0])
+    if is_tracing(profiler):
+        chunk_storage = [(get_chunk_storage(segment, dataset_name), 1)]
+        if isinstance(mask, str):
+            chunk_storage.append((get_chunk_storage(mask), mask_z_factor))
+    for slab_id, (start_z, last_z) in enumerate(slabs):
+        with profile_stage(profiler, "read_segment"):
+            seg = read_vol(segment, dataset_name, z_range=[start_z, last_z])
+        with profile_stage(profiler, "node_lookup"):
+            if node_layout is not None:
+                ind = node_layout.get_node_range(start_z, last_z)
+            else:
+                ind = (node_position[:, 0] >= start_z) * (node_position[:, 0] < last_z)
+            pts = node_position[ind]
+            if relabel is not None:
+                node_lut[ind] = relabel.update(seg[pts[:, 0] - start_z, pts[:, 1], pts[:, 2]])
+            else:
+                node_lut[ind] = seg[pts[:, 0] - start_z, pts[:, 1], pts[:, 2]]
+        if isinstance(mask, MaskIndex) and mask_factor is None:
+            with profile_stage(profiler, "mask_histogram"):
+                mask_id[slab_id] = np.unique(
+                    mask.gather(seg, start_z), return_counts=True
+                )
+        elif mask is not None:
+            with profile_stage(profiler, "read_mask"):
+                mask_range = [start_z * mask_z_factor, last_z * mask_z_factor]
+                if isinstance(mask, MaskIndex):
+                    mask_z = mask.decode(*mask_range)
+                elif isinstance(mask, str):
+                    mask_z = read_vol(mask, None, z_range=mask_range)
+                else:
+                    mask_z = mask[mask_range[0] : mask_range[1]]
+                if mask_factor is not None:
+                    mask_z = _subsample_mask(mask_z, mask_factor, seg.shape)
+            with profile_stage(profiler, "mask_histogram"):
+                # reduce to a histogram right away: memory stays bounded by the slab
+                mask_id[slab_id] = np.unique(seg[mask_z > 0], return_counts=True)
+        if is_tracing(profiler):
+            bytes_read = sum(
+                x[2][(x[0] < last_z * z_factor) * (x[1] > start_z * z_factor)].sum()
+                for x, z_factor in chunk_storage
+            )
+            bytes_decompressed = seg.nbytes
+            bytes_gathered = len(pts) * seg.itemsize
+            if isinstance(mask, MaskIndex) and mask_factor is None:
+                bytes_gathered += mask.get_num_voxels(start_z, last_z) * seg.itemsize
+            elif mask is not None:
+                bytes_decompressed += mask_z.nbytes
+                bytes_gathered += int(mask_id[slab_id][1].sum()) * seg.itemsize
+            profile_event(
+                profiler,
+                "slab",
+                start_z=start_z,
+                last_z=last_z,
+                num_nodes=len(pts),
+                bytes_read=bytes_read,
+                bytes_decompressed=bytes_decompressed,
+                bytes_gathered=bytes_gathered,
+            )
+        mask_z = None
+        del seg
+    return node_lut, (mask_id if mask is not None else None)
+
+
+def plan_segment_lut_slabs(
+    segment, mask=None, chunk_num=1, memory_budget=None, dataset_name=None, mask_factor=None
+):
+    """
+    The function `plan_segment_lut_slabs` computes the z-slab boundaries used by
+    `compute_segment_lut` to read the segment (and mask) volumes.
+
+    :param segment: The name of the HDF5 or tif file (or zarr/n5 folder) containing the segment data
+    :param mask: None, a 3D volume, the name of the HDF5 file containing the mask or a `MaskIndex`
+    :param chunk_num: The number of equally sized slabs, used if `memory_budget` is None
+    :param memory_budget: The maximum number of bytes used to hold one slab (optional)
+    :param dataset_name: The dataset of the segment file (optional)
+    :param mask_factor: The downsampling factor of the segment dataset relative to the mask (optional)
+    :return: a list of `[start_z, last_z)` pairs covering the volume.
+    """
+    shape, dtype, chunks = get_volume_info(segment, dataset_name)
+    if memory_budget is None:
+        num_z = int(np.ceil(shape[0] / float(chunk_num)))
+        return [[z, min(z + num_z, shape[0])] for z in range(0, shape[0], num_z)]
+
+    # bytes per voxel: the segment slab, the sorted copy of the segment ids under the mask
+    # and their gathered copy
+    voxel_bytes = dtype.itemsize
+    chunk_z = chunks[0] if chunks is not None else 1
+    plane_size = int(np.prod(shape[1:]))
+    if mask is not None and mask_factor is not None:
+        # the mask slab at the finest scale, its subsampled copy and the segment ids under it
+        if isinstance(mask, str):
+            mask_itemsize = get_volume_info(mask)[1].itemsize
+        else:
+            mask_itemsize = getattr(mask, "dtype", np.dtype(bool)).itemsize
+        plane_bytes = plane_size * (
+            3 * voxel_bytes + 1 + mask_itemsize * int(np.prod(mask_factor))
+        )
+        return plan_slabs(shape[0], plane_bytes, memory_budget, chunk_z)
+    if isinstance(mask, MaskIndex):
+        # the flat voxel offsets, the gathered segment ids and their sorted copy
+        plane_bytes = voxel_bytes * plane_size + mask.get_max_plane_voxels() * (
+            8 + 2 * dtype.itemsize
+        )
+        return plan_slabs(shape[0], plane_bytes, memory_budget, chunk_z)
+    if mask is not None:
+        voxel_bytes += 2 * dtype.itemsize + 1
+        if isinstance(mask, str):
+            _, mask_dtype, mask_chunks = get_volume_info(mask)
+            voxel_bytes += mask_dtype.itemsize
+            if mask_chunks is not None:
+                chunk_z = np.lcm(chunk_z, mask_chunks[0])
+                if chunk_z * plane_size * voxel_bytes > memory_budget:
+                    chunk_z = chunks[0] if chunks is not None else 1
+    plane_bytes = voxel_bytes * plane_size
+    return plan_slabs(shape[0], plane_bytes, memory_budget, chunk_z)
+
+
+def merge_segment_histograms(histograms):
+    """
+    The function `merge_segment_histograms` sums up a list of segment histograms.
+
+    :param histograms: a list of `(segment_ids, voxel_counts)` pairs
+    :return: a pair of arrays `(segment_ids, voxel_counts)` with unique segment ids.
+    """
+    segment_ids = np.concatenate([x[0] for x in histograms])
+    counts = np.concatenate([x[1] for x in histograms])
+    segment_ids, index = np.unique(segment_ids, return_inverse=True)
+    return segment_ids, np.bincount(index.ravel(), weights=counts).astype(np.int64)
+
+
 def compute_erl(
     gt_graph,
     node_segment_lut,
     mask_segment_id=None,
     merge_threshold=0,
     erl_intervals=None,
+    profiler=None,
+    roi=None,
+    gt_res=None,
+    skeleton_samples=None,
+    num_bootstrap=None,
+    skeleton_chains=None,
 ):
     """
     The function `compute_erl` calculates the expected run length (ERL) scores for a given ground truth
@@ -118,9 +404,56 @@ def compute_erl(
     typically represented as a networkx graph
     :param node_segment_lut: A list of dictionaries where each dictionary represents a mapping between
     node IDs and segment IDs. Each dictionary corresponds to a different segment of the graph
-    :param mask_segment: segment ids that have false merges with non-background segments
-    :return: a list of scores.
+    :param mask_segment: segment ids that have false merges with non-background segments, either as
+    an array of ids (one per mask voxel) or as a histogram `(segment_ids, voxel_counts)`
+    :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+    :param roi: The `[start, last)` voxel range of each dimension (zyx order) to restrict the
+    evaluation to. The gt graph is cropped to the box, with the edges crossing its boundary clipped.
+    The new boundary nodes take the segment of their edge end inside the box (optional)
+    :param gt_res: The voxel resolution (zyx order), or a `SkeletonIndex` of the gt graph. Required
+    if `roi` is given
+    :param skeleton_samples: The ids of skeletons sampled by `sample_skeletons`. If given, the ERL is
+    estimated from these skeletons only (see `approximate_run_length`) (optional)
+    :param num_bootstrap: The number of bootstrap resamples of the skeletons. If given, the
+    confidence intervals of all scores are computed as well (optional)
+    :param skeleton_chains: The `SkeletonChains` of the gt graph (chains.py). If given (and the
+    evaluation is neither restricted to `roi` nor sampled), the edges are scored by runs of nodes
+    of the same segment (see `chain_run_length`) (optional)
+    :return: a list of scores, or a dictionary of estimates if `skeleton_samples` is given. With
+    `num_bootstrap` (and without `skeleton_samples`), a pair `(scores, skeleton_stats)` where
+    `skeleton_stats` holds the per-skeleton lengths and run lengths and the confidence intervals
+    ("erl_ci").
     """
+    if roi is not None:
+        with profile_stage(profiler, "crop_roi"):
+            skeleton_index = (
+                gt_res if isinstance(gt_res, SkeletonIndex) else SkeletonIndex(gt_graph, gt_res)
+            )
+            roi_graph, _, source_node = skeleton_index.crop(roi)
+        return expected_run_length(
+            skeletons=roi_graph,
+            skeleton_id_attribute="skeleton_id",
+            edge_length_attribute=roi_graph.edge_attribute,
+            node_segment_lut=np.asarray(node_segment_lut)[source_node],
+            mask_segment_id=mask_segment_id,
+            merge_threshold=merge_threshold,
+            erl_intervals=erl_intervals,
+            skeleton_lengths=skeleton_index.get_skeleton_lengths(roi_graph),
+            profiler=profiler,
+            num_bootstrap=num_bootstrap,
+        )
+
+    if skeleton_chains is not None and skeleton_chains.exact and skeleton_samples is None:
+        return chain_run_length(
+            gt_graph,
+            skeleton_chains,
+            node_segment_lut,
+            mask_segment_id,
+            merge_threshold,
+            erl_intervals,
+            profiler,
+            num_bootstrap,
+        )
 
     return expected_run_length(
         skeletons=gt_graph,
@@ -131,6 +464,9 @@ def compute_erl(
         merge_threshold=merge_threshold,
         erl_intervals=erl_intervals,
         skeleton_position_attributes=["z", "y", "x"],
+        profiler=profiler,
+        skeleton_samples=skeleton_samples,
+        num_bootstrap=num_bootstrap,
     )
 
 
@@ -146,6 +482,11 @@ def expected_run_length(
     skeleton_lengths=None,
     skeleton_position_attributes=None,
     return_merge_split_stats=False,
+    profiler=None,
+    skeleton_samples=None,
+    num_bootstrap=None,
+    confidence=0.95,
+    return_skeleton_stats=False,
 ):
     """Compute the expected run-length on skeletons, given a segmentation in
     the form of a node -> segment lookup table.
@@ -197,7 +538,52 @@ def expected_run_length(
 
             The split stats are a dictionary mapping skeleton IDs to pairs of
             segment IDs, one pair for each split along the skeleton edges.
+
+        profiler (optional):
+
+            A ``StageProfiler`` recording the resources used by each stage,
+            or a ``Tracer`` also emitting the number of nodes and edges
+            processed per second.
+
+        skeleton_samples (optional):
+
+            The ids of skeletons sampled with probability proportional to
+            their length (see ``sample_skeletons``). If given, only these
+            skeletons are scored and a dictionary of estimates with bootstrap
+            confidence intervals is returned (see
+            ``approximate_run_length``).
+
+        num_bootstrap, confidence (optional):
+
+            The number of bootstrap resamples of the skeletons and the level
+            of the confidence intervals. In the approximate mode, defaults to
+            1000 resamples. Otherwise, confidence intervals are only computed
+            if ``num_bootstrap`` is given, and returned with the skeleton
+            stats.
+
+        return_skeleton_stats (optional):
+
+            If ``True`` (or if ``num_bootstrap`` is given), also return a
+            dictionary with the arrays ``skeleton_ids``, ``skeleton_lengths``
+            and ``skeleton_erls`` and, with ``num_bootstrap``, the confidence
+            intervals ``erl_ci`` (see ``bootstrap_run_length``), i.e.,
+            ``(run_length, [merge_split_stats,] skeleton_stats)``.
     """
+    if skeleton_samples is not None:
+        with profile_stage(profiler, "approximate_run_length"):
+            return approximate_run_length(
+                skeletons,
+                skeleton_id_attribute,
+                edge_length_attribute,
+                node_segment_lut,
+                skeleton_samples,
+                mask_segment_id,
+                merge_threshold,
+                skeleton_position_attributes,
+                1000 if num_bootstrap is None else num_bootstrap,
+                confidence,
+            )
+
     if skeleton_position_attributes is not None:
         if skeleton_lengths is not None:
             raise ValueError(
@@ -205,67 +591,485 @@ def expected_run_length(
                 "should not be given"
             )
 
-        skeleton_lengths = get_skeleton_lengths(
+        with profile_stage(profiler, "skeleton_lengths"):
+            start_time = time.perf_counter()
+            skeleton_lengths = get_skeleton_lengths(
+                skeletons,
+                skeleton_position_attributes,
+                skeleton_id_attribute,
+                store_edge_length=edge_length_attribute,
+            )
+            length_time = time.perf_counter() - start_time
+
+    with profile_stage(profiler, "evaluate_skeletons"):
+        start_time = time.perf_counter()
+        res = evaluate_skeletons(
             skeletons,
-            skeleton_position_attributes,
             skeleton_id_attribute,
-            store_edge_length=edge_length_attribute,
+            node_segment_lut,
+            mask_segment_id,
+            merge_threshold,
+            return_merge_split_stats=return_merge_split_stats,
         )
+        evaluate_time = time.perf_counter() - start_time
 
-    res = evaluate_skeletons(
-        skeletons,
-        skeleton_id_attribute,
-        node_segment_lut,
-        mask_segment_id,
-        merge_threshold,
-        return_merge_split_stats=return_merge_split_stats,
-    )
+    if is_tracing(profiler):
+        skeleton_scores = res[0] if return_merge_split_stats else res
+        num_nodes = len(node_segment_lut)
+        num_edges = sum(
+            x.ommitted + x.split + x.merged + x.correct for x in skeleton_scores.values()
+        )
+        if skeleton_position_attributes is not None:
+            profile_event(
+                profiler,
+                "skeleton_lengths",
+                num_edges=num_edges,
+                edges_per_second=num_edges / max(length_time, 1e-9),
+            )
+        profile_event(
+            profiler,
+            "evaluate_skeletons",
+            num_nodes=num_nodes,
+            num_edges=num_edges,
+            nodes_per_second=num_nodes / max(evaluate_time, 1e-9),
+            edges_per_second=num_edges / max(evaluate_time, 1e-9),
+        )
 
     if return_merge_split_stats:
         skeleton_scores, merge_split_stats = res
     else:
         skeleton_scores = res
 
-    skeleton_erls = {}
-    for skeleton_id, scores in skeleton_scores.items():
-        skeleton_length = skeleton_lengths[skeleton_id]
-        skeleton_erl = 0
-        correct_edges_length = 0
-        for segment_id, correct_edges in scores.correct_edges.items():
-            correct_edges_length = np.sum(
-                [skeletons.edges[e][edge_length_attribute] for e in correct_edges]
-            )
-
-            skeleton_erl += correct_edges_length * (
-                correct_edges_length / skeleton_length
-            )
-        skeleton_erls[skeleton_id] = skeleton_erl
-
-    skeleton_lengths = np.array(list(skeleton_lengths.values()))
-    skeleton_erls = np.array(list(skeleton_erls.values()))
-    erl_weighted = skeleton_lengths * skeleton_erls
-    skel_weighted = skeleton_lengths * skeleton_lengths
-    skeleton_length_all = skeleton_lengths.sum()
-    erl_all = (erl_weighted / skeleton_length_all).sum()
-    skel_all = (skel_weighted / skeleton_length_all).sum()
-
-    if erl_intervals is not None:
-        erl = np.zeros([len(erl_intervals), 2])
-        erl[0] = [erl_all, skel_all]
-        for i in range(1, len(erl_intervals)):
-            skeleton_index = (skeleton_lengths >= erl_intervals[i - 1]) * (
-                skeleton_lengths < erl_intervals[i]
-            )
-            selected_length = skeleton_lengths[skeleton_index].sum()
-            erl[i, 0] = sum(erl_weighted[skeleton_index] / selected_length)
-            erl[i, 1] = sum(skel_weighted[skeleton_index] / selected_length)
-    else:
-        erl = [erl_all, skel_all]
+    with profile_stage(profiler, "run_length"):
+        # float64 sums in the order of `score_skeleton_edges`, so that all the evaluation paths
+        # give the same scores: the edge lengths of each segment are summed one after the other
+        # (cumsum, as np.bincount), then their squares by increasing segment id
+        skeleton_erls = {}
+        for skeleton_id, scores in skeleton_scores.items():
+            skeleton_length = skeleton_lengths[skeleton_id]
+            skeleton_erl = np.float64(0)
+            for segment_id in sorted(scores.correct_edges):
+                correct_edges_length = np.cumsum(
+                    [
+                        skeletons.edges[e][edge_length_attribute]
+                        for e in scores.correct_edges[segment_id]
+                    ],
+                    dtype=np.float64,
+                )[-1]
+
+                skeleton_erl += correct_edges_length * correct_edges_length
+            skeleton_erls[skeleton_id] = skeleton_erl / max(skeleton_length, 1e-12)
+
+    # pair the lengths and the run lengths by skeleton id, sorted as in the vectorized paths
+    skeleton_ids = np.array(sorted(skeleton_erls))
+    skeleton_lengths = np.array(
+        [skeleton_lengths[x] for x in skeleton_ids.tolist()], np.float64
+    )
+    skeleton_erls = np.array([skeleton_erls[x] for x in skeleton_ids.tolist()], np.float64)
+    erl = aggregate_run_length(skeleton_lengths, skeleton_erls, erl_intervals)
 
+    out = [erl]
     if return_merge_split_stats:
-        return erl, merge_split_stats
+        out.append(merge_split_stats)
+    if return_skeleton_stats or num_bootstrap is not None:
+        skeleton_stats = {
+            "skeleton_ids": skeleton_ids,
+            "skeleton_lengths": skeleton_lengths,
+            "skeleton_erls": skeleton_erls,
+        }
+        if num_bootstrap is not None:
+            with profile_stage(profiler, "bootstrap"):
+                skeleton_stats["erl_ci"] = bootstrap_run_length(
+                    skeleton_lengths,
+                    skeleton_erls,
+                    erl_intervals,
+                    num_bootstrap,
+                    confidence,
+                )
+        out.append(skeleton_stats)
+    return out[0] if len(out) == 1 else tuple(out)
+
+
+def get_interval_sums(skeleton_lengths, skeleton_erls, erl_intervals):
+    """
+    The function `get_interval_sums` assigns each skeleton to its length interval and builds the
+    matrix summing the weighted skeleton statistics of each interval.
+
+    :param skeleton_lengths: The length of each skeleton (K)
+    :param skeleton_erls: The expected run length of each skeleton (K)
+    :param erl_intervals: The boundaries of the skeleton length intervals, or None
+    :return: a matrix (K, 3 * num_rows) such that `weights @ matrix` sums, for each row (all
+    skeletons, then each interval), the length, the length-weighted run length and the squared
+    length of the skeletons (weighted by `weights`).
+    """
+    skeleton_lengths = np.asarray(skeleton_lengths, np.float64)
+    statistics = np.stack(
+        [
+            skeleton_lengths,
+            skeleton_lengths * np.asarray(skeleton_erls, np.float64),
+            skeleton_lengths * skeleton_lengths,
+        ],
+        axis=1,
+    )
+    num_rows = 1 if erl_intervals is None else len(erl_intervals)
+    # row i > 0: lengths within [erl_intervals[i - 1], erl_intervals[i])
+    rows = (
+        np.zeros(len(skeleton_lengths), np.int64)
+        if erl_intervals is None
+        else np.digitize(skeleton_lengths, erl_intervals)
+    )
+    matrix = np.zeros([len(skeleton_lengths), 3, num_rows])
+    valid = (rows > 0) & (rows < num_rows)
+    matrix[np.nonzero(valid)[0], :, rows[valid]] = statistics[valid]
+    matrix[:, :, 0] = statistics
+    return matrix.reshape(len(skeleton_lengths), 3 * num_rows)
+
+
+def _divide_interval_sums(sums):
+    # [..., 3 * num_rows] sums -> [..., num_rows, 2] (erl, gt erl), 0 for empty intervals
+    sums = sums.reshape(sums.shape[:-1] + (3, -1))
+    length = sums[..., 0, :, None]
+    return np.divide(
+        np.stack([sums[..., 1, :], sums[..., 2, :]], axis=-1),
+        length,
+        out=np.zeros(length.shape[:-1] + (2,)),
+        where=length > 0,
+    )
+
+
+def aggregate_run_length(skeleton_lengths, skeleton_erls, erl_intervals=None):
+    """
+    The function `aggregate_run_length` combines the per-skeleton run lengths into the expected run
+    length of the whole dataset (and of each length interval) in one pass.
+
+    :param skeleton_lengths: The length of each skeleton
+    :param skeleton_erls: The expected run length of each skeleton
+    :param erl_intervals: The boundaries of the skeleton length intervals (optional)
+    :return: `[erl, gt_erl]`, or one such row for all skeletons and for each interval if
+    `erl_intervals` is given.
+    """
+    if erl_intervals is not None and len(erl_intervals) == 0:
+        erl_intervals = None
+    matrix = get_interval_sums(skeleton_lengths, skeleton_erls, erl_intervals)
+    erl = _divide_interval_sums(matrix.sum(axis=0))
+    return list(erl[0]) if erl_intervals is None else erl
+
+
+def bootstrap_run_length(
+    skeleton_lengths,
+    skeleton_erls,
+    erl_intervals=None,
+    num_bootstrap=1000,
+    confidence=0.95,
+    seed=0,
+):
+    """
+    The function `bootstrap_run_length` computes percentile bootstrap confidence intervals of the
+    expected run length of all skeletons and of each length interval. The skeletons are resampled
+    as a matrix of multinomial counts, in batches, so that all intervals come from the same matrix
+    product.
+
+    :param skeleton_lengths: The length of each skeleton
+    :param skeleton_erls: The expected run length of each skeleton
+    :param erl_intervals: The boundaries of the skeleton length intervals (optional)
+    :param num_bootstrap: The number of bootstrap resamples
+    :param confidence: The confidence level of the intervals
+    :param seed: The seed of the random generator
+    :return: an array (2, 2) with the `[low, high]` bounds of the erl and the gt erl, or one such
+    array for all skeletons and for each interval (num_rows, 2, 2) if `erl_intervals` is given.
+    """
+    if erl_intervals is not None and len(erl_intervals) == 0:
+        erl_intervals = None
+    matrix = get_interval_sums(skeleton_lengths, skeleton_erls, erl_intervals)
+    num_skeleton = len(matrix)
+    rng = np.random.RandomState(seed)
+    # bound the count matrix to a few million entries
+    batch = max(1, 2**22 // max(num_skeleton, 1))
+    erls = []
+    for i in range(0, num_bootstrap, batch):
+        counts = rng.multinomial(
+            num_skeleton,
+            np.full(num_skeleton, 1.0 / num_skeleton),
+            size=min(batch, num_bootstrap - i),
+        )
+        erls.append(_divide_interval_sums(counts @ matrix))
+    alpha = (1 - confidence) / 2
+    # [low/high, row, erl/gt] -> [row, erl/gt, low/high]
+    interval = np.quantile(np.concatenate(erls), [alpha, 1 - alpha], axis=0).transpose(
+        1, 2, 0
+    )
+    return interval[0] if erl_intervals is None else interval
+
+
+def _get_skeleton_lengths_lite(
+    skeletons,
+    skeleton_position_attributes,
+    skeleton_id_attribute,
+    store_edge_length=None,
+):
+    # `get_skeleton_lengths` on the node columns of a lite graph: the same float32 edge lengths,
+    # summed per skeleton in float64 in the same edge order
+    node_skeleton, edges, _ = get_graph_arrays(
+        skeletons, skeleton_id_attribute, skeletons.edge_attribute
+    )
+    position = np.stack(
+        [skeletons.nodes.column(d) for d in skeleton_position_attributes], axis=1
+    ).astype(np.float32)
+    edge_length = np.linalg.norm(position[edges[:, 0]] - position[edges[:, 1]], axis=1)
+    if store_edge_length:
+        assert store_edge_length == skeletons.edge_attribute
+        skeletons.set_edge_values(edges, edge_length)
+
+    edge_skeleton = node_skeleton[edges[:, 0]]
+    skeleton_ids, first_edge, edge_index = np.unique(
+        edge_skeleton, return_index=True, return_inverse=True
+    )
+    lengths = np.bincount(edge_index.ravel(), edge_length, len(skeleton_ids))
+    # in the order of their first edge, as the loop over the edges
+    return {
+        skeleton_ids[i]: lengths[i] for i in np.argsort(first_edge, kind="stable")
+    }
+
+
+def get_graph_edge_lengths(
+    skeletons,
+    skeleton_id_attribute,
+    edge_length_attribute,
+    skeleton_position_attributes=None,
+):
+    """
+    The function `get_graph_edge_lengths` is a vectorized version of `get_skeleton_lengths` that
+    returns the graph as arrays.
+
+    :param skeletons: A networkx-like graph
+    :param skeleton_id_attribute: The name of the node attribute containing the skeleton ID
+    :param edge_length_attribute: The name of the edge attribute for the length of an edge, used if
+    `skeleton_position_attributes` is not given
+    :param skeleton_position_attributes: The names of the node attributes for the spatial
+    coordinates. If given, the edge lengths are computed from the node positions
+    :return: the skeleton id of each node (N), the node indices of each edge (E, 2) and the length of
+    each edge (E).
+    """
+    node_skeleton, edges, edge_length = get_graph_arrays(
+        skeletons, skeleton_id_attribute, edge_length_attribute
+    )
+    if skeleton_position_attributes is not None:
+        position = get_node_physical_position(
+            skeletons, skeleton_position_attributes
+        ).astype(np.float32)
+        edge_length = np.linalg.norm(
+            position[edges[:, 0]] - position[edges[:, 1]], axis=1
+        )
+    return node_skeleton, edges, edge_length
+
+
+def get_node_spacing(
+    skeletons, gt_res, quantile=0.5, skeleton_position_attributes=["z", "y", "x"]
+):
+    """
+    The function `get_node_spacing` estimates the spacing of the nodes along the skeletons in voxels,
+    to choose the scale of a multiscale prediction (see `compute_segment_lut`).
+
+    :param skeletons: A networkx-like graph, with the node positions in physical unit
+    :param gt_res: The voxel resolution (zyx order)
+    :param quantile: The quantile of the edge lengths taken as the spacing
+    :param skeleton_position_attributes: The names of the node attributes for the zyx coordinates
+    :return: the spacing along each axis in voxels (zyx order).
+    """
+    _, _, edge_length = get_graph_edge_lengths(
+        skeletons, "skeleton_id", "length", skeleton_position_attributes
+    )
+    if len(edge_length) == 0:
+        return np.ones(3)
+    return np.quantile(edge_length, quantile) / np.asarray(gt_res, np.float64)
+
+
+def sample_skeletons(skeleton_ids, skeleton_lengths, num_samples, seed=0):
+    """
+    The function `sample_skeletons` samples skeletons with replacement, with probability proportional
+    to their length. The mean ERL of the sampled skeletons is then an unbiased estimate of the
+    (length-weighted) ERL. With the same seed, different predictions are scored on the same skeletons.
+
+    :param skeleton_ids: The id of each skeleton
+    :param skeleton_lengths: The length of each skeleton
+    :param num_samples: The number of samples
+    :param seed: The seed of the random generator
+    :return: the sampled skeleton ids (with repetitions).
+    """
+    skeleton_lengths = np.asarray(skeleton_lengths, np.float64)
+    rng = np.random.RandomState(seed)
+    return rng.choice(
+        np.asarray(skeleton_ids),
+        num_samples,
+        p=skeleton_lengths / skeleton_lengths.sum(),
+    )
+
+
+def bootstrap_confidence_interval(values, num_bootstrap=1000, confidence=0.95, seed=0):
+    """
+    The function `bootstrap_confidence_interval` computes the percentile bootstrap confidence
+    interval of the mean of a sample. The resamples are drawn as a matrix, in batches.
+
+    :param values: The sample
+    :param num_bootstrap: The number of bootstrap resamples
+    :param confidence: The confidence level of the interval
+    :param seed: The seed of the random generator
+    :return: the lower and upper bounds of the interval.
+    """
+    values = np.asarray(values, np.float64)
+    rng = np.random.RandomState(seed)
+    # bound the resample matrix to a few million entries
+    batch = max(1, 2**22 // max(len(values), 1))
+    means = np.zeros(num_bootstrap)
+    for i in range(0, num_bootstrap, batch):
+        index = rng.randint(0, len(values), (min(batch, num_bootstrap - i), len(values)))
+        means[i : i + len(index)] = values[index].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, [alpha, 1 - alpha])
+
+
+def approximate_run_length(
+    skeletons,
+    skeleton_id_attribute,
+    edge_length_attribute,
+    node_segment_lut,
+    skeleton_samples,
+    mask_segment_id=None,
+    merge_threshold=0,
+    skeleton_position_attributes=None,
+    num_bootstrap=1000,
+    confidence=0.95,
+):
+    """
+    The function `approximate_run_length` estimates the expected run length from length-weighted
+    samples of skeletons. Only the nodes of the sampled skeletons need a segment in
+    `node_segment_lut`.
+
+    The false merges are only detected among the sampled skeletons (and with the mask, if given):
+    merges with skeletons that are not sampled are missed, so that the estimate is optimistic when
+    the prediction has many false merges.
+
+    :param skeletons: A networkx-like graph
+    :param skeleton_id_attribute: The name of the node attribute containing the skeleton ID
+    :param edge_length_attribute: The name of the edge attribute for the length of an edge
+    :param node_segment_lut: The segment id of each node (at least for the sampled skeletons)
+    :param skeleton_samples: The sampled skeleton ids (see `sample_skeletons`)
+    :param mask_segment_id: The segment histogram of the mask voxels (optional)
+    :param merge_threshold: The minimum number of nodes (resp. mask voxels) of a false merge
+    :param skeleton_position_attributes: The names of the node attributes for the spatial
+    coordinates. If given, the edge lengths are computed from the node positions
+    :param num_bootstrap: The number of bootstrap resamples
+    :param confidence: The confidence level of the intervals
+    :return: a dictionary with the estimated ERL ("erl") and gt ERL ("gt_erl"), their confidence
+    intervals ("erl_ci", "gt_erl_ci") and the number of samples ("num_samples").
+    """
+    node_skeleton, edges, edge_length = get_graph_edge_lengths(
+        skeletons,
+        skeleton_id_attribute,
+        edge_length_attribute,
+        skeleton_position_attributes,
+    )
+    skeleton_ids, sample_index = np.unique(skeleton_samples, return_inverse=True)
+    node_segment_lut = np.asarray(node_segment_lut)
+    nodes = np.isin(node_skeleton, skeleton_ids)
+    skeleton_segment, count = np.unique(
+        np.stack([node_skeleton[nodes], node_segment_lut[nodes]], axis=1),
+        axis=0,
+        return_counts=True,
+    )
+    merging_segments = find_merging_segments(
+        skeleton_segment, count, mask_segment_id, merge_threshold
+    )
+    edge_skeleton = node_skeleton[edges[:, 0]]
+    edge_mask = np.isin(edge_skeleton, skeleton_ids)
+    scores = score_skeleton_edges(
+        skeleton_ids,
+        edge_skeleton[edge_mask],
+        edges[edge_mask],
+        edge_length[edge_mask],
+        node_segment_lut,
+        merging_segments,
+    )
+    sample_erls = scores["erl"][sample_index.ravel()]
+    sample_lengths = scores["length"][sample_index.ravel()]
+    return {
+        "erl": float(sample_erls.mean()),
+        "erl_ci": bootstrap_confidence_interval(
+            sample_erls, num_bootstrap, confidence
+        ).tolist(),
+        "gt_erl": float(sample_lengths.mean()),
+        "gt_erl_ci": bootstrap_confidence_interval(
+            sample_lengths, num_bootstrap, confidence
+        ).tolist(),
+        "num_samples": len(sample_erls),
+    }
+
+
+def chain_run_length(
+    gt_graph,
+    skeleton_chains,
+    node_segment_lut,
+    mask_segment_id=None,
+    merge_threshold=0,
+    erl_intervals=None,
+    profiler=None,
+    num_bootstrap=None,
+    confidence=0.95,
+):
+    """
+    The function `chain_run_length` computes the expected run length from the skeleton chains of the
+    gt graph: the edges are scored by runs of nodes of the same segment along the chains, with the
+    same scores as the edge by edge `score_skeleton_edges` (see chains.py).
+
+    :param gt_graph: The ground truth graph
+    :param skeleton_chains: The `SkeletonChains` of the gt graph
+    :param node_segment_lut: The segment id of each node
+    :param mask_segment_id: segment ids of the mask voxels, either as an array of ids or as a
+    histogram `(segment_ids, voxel_counts)` (optional)
+    :param merge_threshold: The minimum number of nodes (resp. mask voxels) of a false merge
+    :param erl_intervals: The boundaries of the skeleton length intervals (optional)
+    :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+    :param num_bootstrap, confidence: The number of bootstrap resamples of the skeletons and the
+    level of the confidence intervals (optional)
+    :return: the scores, and the skeleton stats (see `expected_run_length`) if `num_bootstrap` is
+    given.
+    """
+    if isinstance(gt_graph, NetworkXGraphLite):
+        node_skeleton = gt_graph.nodes.column("skeleton_id")
     else:
+        node_skeleton = np.array([data["skeleton_id"] for _, data in gt_graph.nodes(data=True)])
+    node_segment_lut = np.asarray(node_segment_lut)
+    with profile_stage(profiler, "merging_segments"):
+        merging_segments = find_merging_segments(
+            *count_pairs(
+                np.stack([node_skeleton, node_segment_lut[: len(node_skeleton)]], axis=1)
+            ),
+            mask_segment_id,
+            merge_threshold,
+        )
+    with profile_stage(profiler, "score_skeleton_chains"):
+        skeleton_ids = np.unique(node_skeleton)
+        scores = skeleton_chains.score(node_segment_lut, merging_segments, skeleton_ids)
+    profile_event(
+        profiler,
+        "score_skeleton_chains",
+        num_chains=len(skeleton_chains.skeleton),
+        num_chain_nodes=len(skeleton_chains.nodes),
+    )
+
+    erl = aggregate_run_length(scores["length"], scores["erl"], erl_intervals)
+    if num_bootstrap is None:
         return erl
+    skeleton_stats = {
+        "skeleton_ids": skeleton_ids,
+        "skeleton_lengths": scores["length"],
+        "skeleton_erls": scores["erl"],
+    }
+    with profile_stage(profiler, "bootstrap"):
+        skeleton_stats["erl_ci"] = bootstrap_run_length(
+            scores["length"], scores["erl"], erl_intervals, num_bootstrap, confidence
+        )
+    return erl, skeleton_stats
 
 
 def get_skeleton_lengths(
@@ -296,6 +1100,14 @@ def get_skeleton_lengths(
             If given, stores the length of an edge in this edge attribute.
     """
 
+    if isinstance(skeletons, NetworkXGraphLite):
+        return _get_skeleton_lengths_lite(
+            skeletons,
+            skeleton_position_attributes,
+            skeleton_id_attribute,
+            store_edge_length,
+        )
+
     node_positions = {
         node: np.array(
             [skeletons.nodes[node][d] for d in skeleton_position_attributes],
@@ -309,7 +1121,7 @@ def get_skeleton_lengths(
         skeleton_id = skeletons.nodes[u][skeleton_id_attribute]
 
         if skeleton_id not in skeleton_lengths:
-            skeleton_lengths[skeleton_id] = 0
+            skeleton_lengths[skeleton_id] = np.float64(0)
 
         pos_u = node_positions[u]
         pos_v = node_positions[v]
@@ -318,11 +1130,98 @@ def get_skeleton_lengths(
 
         if store_edge_length:
             data[store_edge_length] = length
-        skeleton_lengths[skeleton_id] += length
+        # float32 edge lengths, summed in float64 as in the vectorized paths
+        skeleton_lengths[skeleton_id] += np.float64(length)
 
     return skeleton_lengths
 
 
+def find_merging_segments(skeleton_segment, count, mask_segment_id, merge_threshold):
+    """
+    The function `find_merging_segments` finds the segments that merge several skeletons, or a
+    skeleton with the background.
+
+    :param skeleton_segment: The unique (skeleton, segment) pairs of the nodes
+    :param count: The number of nodes of each pair
+    :param mask_segment_id: segment ids of the mask voxels, either as an array of ids or as a
+    histogram `(segment_ids, voxel_counts)` (or None)
+    :param merge_threshold: The minimum number of nodes (resp. mask voxels) for a pair to count
+    :return: the sorted array of merging segments.
+    """
+    ### find segments that cover more than one gt skeleton
+    # AxonEM paper: only count the pairs that have intersections
+    # more than merge_threshold amount of voxels
+    skeleton_segment_big = skeleton_segment[count >= merge_threshold]
+    # number of times that a segment was mapped to a skeleton
+    segments, num_segment_skeletons = np.unique(
+        skeleton_segment_big[:, 1], return_counts=True
+    )
+    # all segments that merge at least two skeletons
+    merging_segments = segments[num_segment_skeletons > 1]
+
+    if mask_segment_id is not None:
+        if isinstance(mask_segment_id, tuple):
+            mask_id, mask_count = mask_segment_id
+        else:
+            mask_id, mask_count = np.unique(mask_segment_id, return_counts=True)
+        merging_segments = np.unique(
+            np.concatenate([merging_segments, mask_id[mask_count > merge_threshold]])
+        )
+    return merging_segments
+
+
+def score_skeleton_edges(
+    skeleton_ids, edge_skeleton, edges, edge_length, node_segment_lut, merging_segments
+):
+    """
+    The function `score_skeleton_edges` is a vectorized version of `evaluate_skeletons` followed by
+    the per-skeleton run length of `expected_run_length`, for the given skeletons.
+
+    :param skeleton_ids: The sorted ids of the skeletons to score
+    :param edge_skeleton: The skeleton id of each edge (only edges of `skeleton_ids`)
+    :param edges: The node indices of each edge (E, 2)
+    :param edge_length: The length of each edge (E)
+    :param node_segment_lut: The segment id of each node
+    :param merging_segments: The sorted array of merging segments
+    :return: a dictionary of arrays aligned with `skeleton_ids`: "length", "erl", "ommitted",
+    "split", "merged" and "correct".
+    """
+    num_skeleton = len(skeleton_ids)
+    skeleton_index = np.searchsorted(skeleton_ids, edge_skeleton)
+    segment_u = node_segment_lut[edges[:, 0]]
+    segment_v = node_segment_lut[edges[:, 1]]
+    ommitted = (segment_u == 0) | (segment_v == 0)
+    split = ~ommitted & (segment_u != segment_v)
+    # an edge on a merging segment is merged: its skeleton is one of the merged skeletons
+    merged = ~ommitted & ~split & np.isin(segment_u, merging_segments)
+    correct = ~(ommitted | split | merged)
+
+    scores = {
+        "length": np.bincount(skeleton_index, edge_length, minlength=num_skeleton)
+    }
+    for name, edge_mask in zip(
+        ["ommitted", "split", "merged", "correct"], [ommitted, split, merged, correct]
+    ):
+        scores[name] = np.bincount(skeleton_index[edge_mask], minlength=num_skeleton)
+
+    # run length of each (skeleton, segment) pair of correct edges
+    pairs, pair_index = np.unique(
+        np.stack(
+            [skeleton_index[correct].astype(np.uint64), segment_u[correct].astype(np.uint64)],
+            axis=1,
+        ),
+        axis=0,
+        return_inverse=True,
+    )
+    pair_length = np.bincount(
+        pair_index.ravel(), edge_length[correct], minlength=len(pairs)
+    )
+    scores["erl"] = np.bincount(
+        pairs[:, 0].astype(np.int64), pair_length**2, minlength=num_skeleton
+    ) / np.maximum(scores["length"], 1e-12)
+    return scores
+
+
 class SkeletonScores:
     def __init__(self):
         self.ommitted = 0
@@ -344,34 +1243,26 @@ def evaluate_skeletons(
     # counted as wrong)
 
     # pairs of (skeleton, segment), one for each node
-    skeleton_segment_all = np.array(
-        [
-            [data[skeleton_id_attribute], node_segment_lut[n]]
-            for n, data in skeletons.nodes(data=True)
-        ]
-    )
+    if isinstance(skeletons, NetworkXGraphLite):
+        node_skeleton = skeletons.nodes.column(skeleton_id_attribute)
+        skeleton_segment_all = np.stack(
+            [node_skeleton, np.asarray(node_segment_lut)[: len(node_skeleton)]], axis=1
+        )
+    else:
+        node_skeleton = {
+            n: data[skeleton_id_attribute] for n, data in skeletons.nodes(data=True)
+        }
+        skeleton_segment_all = np.array(
+            [[node_skeleton[n], node_segment_lut[n]] for n in skeletons.nodes()]
+        )
 
     # unique pairs of (skeleton, segment)
     skeleton_segment, count = np.unique(
         skeleton_segment_all, axis=0, return_counts=True
     )
-
-    ### find segments that cover more than one gt skeleton
-    # AxonEM paper: only count the pairs that have intersections
-    # more than merge_threshold amount of voxels
-    skeleton_segment_big = skeleton_segment[count >= merge_threshold]
-    # number of times that a segment was mapped to a skeleton
-    segments, num_segment_skeletons = np.unique(
-        skeleton_segment_big[:, 1], return_counts=True
+    merging_segments = find_merging_segments(
+        skeleton_segment, count, mask_segment_id, merge_threshold
     )
-    # all segments that merge at least two skeletons
-    merging_segments = segments[num_segment_skeletons > 1]
-
-    if mask_segment_id is not None:
-        mask_id, mask_count = np.unique(mask_segment_id, return_counts=True)
-        merging_segments = np.unique(
-            np.concatenate([merging_segments, mask_id[mask_count > merge_threshold]])
-        )
 
     merging_segments_mask = np.isin(skeleton_segment[:, 1], merging_segments)
     merged_skeletons = skeleton_segment[:, 0][merging_segments_mask]
@@ -401,7 +1292,7 @@ def evaluate_skeletons(
     skeleton_scores = {}
 
     for u, v in skeletons.edges():
-        skeleton_id = skeletons.nodes[u][skeleton_id_attribute]
+        skeleton_id = node_skeleton[u]
         segment_u = node_segment_lut[u]
         segment_v = node_segment_lut[v]
 
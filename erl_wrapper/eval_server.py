@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import json
+import socket
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from data_io import parse_memory_size
+from lut_cache import LutCache
+from eval_erl import compute_segment_lut, expected_run_length, get_skeleton_lengths
+from shared_graph import SharedGraphBlocks, SharedNetworkXGraphLite
+from test_axonEM import load_gt_stats, get_node_position
+
+# long-running evaluation service: the gt bundles are loaded (and their skeleton lengths
+# computed) once, submissions are queued and evaluated by a bounded pool of workers
+# protocol: one json request per line, one json response per line
+# request: {"gt": "human", "seg_path": "pred.h5", "merge_threshold": 50, "erl_intervals": null}
+# response: {"erl": [...]} or {"error": "..."}
+# with worker processes (-wp), the gt graphs are published once in shared memory and attached by
+# every worker instead of being copied into each of them
+#
+# python eval_server.py -g human:gt_human_32nm_skel_stats.p:gt_human_32nm_mask.h5 -u /tmp/erl.sock
+
+
+class ERLServer:
+    # The ERLServer class keeps the gt graphs resident and evaluates submissions.
+    def __init__(
+        self,
+        gt_bundles,
+        num_workers=2,
+        memory_budget=None,
+        queue_size=16,
+        lut_cache=None,
+        use_processes=False,
+    ):
+        """
+        :param gt_bundles: A dictionary mapping gt names to `(gt_stats_path, gt_mask_path)`
+        :param num_workers: The number of submissions evaluated in parallel
+        :param memory_budget: The memory budget of each worker to read the prediction (optional)
+        :param queue_size: The maximum number of waiting submissions
+        :param lut_cache: a `LutCache` to skip reading predictions that were already evaluated
+        (optional)
+        :param use_processes: Evaluate in worker processes sharing the gt graphs, instead of threads
+        """
+        self.num_workers = num_workers
+        self.use_processes = use_processes
+        self.memory_budget = memory_budget
+        self.lut_cache = lut_cache
+        self.queue_size = queue_size
+        self.gt = {}
+        for name, (gt_stats_path, gt_mask_path) in gt_bundles.items():
+            self.load_gt(name, gt_stats_path, gt_mask_path)
+        self._executor = None
+        self._queue = None
+        self._shared = []
+
+    def load_gt(self, name, gt_stats_path, gt_mask_path=None):
+        """
+        The function `load_gt` loads a gt bundle and precomputes its edge and skeleton lengths.
+        """
+        print(f"Load gt {name}")
+        gt_graph, gt_res, gt_mask, node_layout = load_gt_stats(
+            gt_stats_path, gt_mask_path, return_node_layout=True
+        )
+        skeleton_lengths = get_skeleton_lengths(
+            gt_graph, ["z", "y", "x"], "skeleton_id", store_edge_length="length"
+        )
+        self.gt[name] = {
+            "stats_path": gt_stats_path,
+            "graph": gt_graph,
+            "node_position": get_node_position(gt_graph, gt_res),
+            "mask": gt_mask,
+            "node_layout": node_layout,
+            "skeleton_lengths": skeleton_lengths,
+        }
+
+    def evaluate(self, request):
+        """
+        The function `evaluate` evaluates one submission synchronously. It is also used as the
+        in-process stand-in of the client.
+
+        :param request: A dictionary with the gt name ("gt"), the path to the prediction
+        ("seg_path") and optionally "merge_threshold" and "erl_intervals"
+        :return: a dictionary with the scores ("erl") or the error message ("error").
+        """
+        try:
+            gt = self.gt[request["gt"]]
+            cached = None
+            if self.lut_cache is not None:
+                cache_key = self.lut_cache.get_key(
+                    request["seg_path"],
+                    gt["stats_path"],
+                    gt["mask"] if isinstance(gt["mask"], str) else None,
+                )
+                cached = self.lut_cache.get(cache_key)
+            if cached is not None:
+                node_segment_lut, mask_segment_id = cached
+            else:
+                node_segment_lut, mask_segment_id = compute_segment_lut(
+                    request["seg_path"],
+                    gt["node_position"],
+                    gt["mask"],
+                    memory_budget=self.memory_budget,
+                    node_layout=gt["node_layout"],
+                )
+                if self.lut_cache is not None:
+                    self.lut_cache.put(cache_key, node_segment_lut, mask_segment_id)
+            erl = expected_run_length(
+                gt["graph"],
+                "skeleton_id",
+                "length",
+                node_segment_lut,
+                mask_segment_id,
+                request.get("merge_threshold", 0),
+                request.get("erl_intervals"),
+                skeleton_lengths=gt["skeleton_lengths"],
+            )
+            return {"erl": np.asarray(erl).tolist()}
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def _start_processes(self):
+        """
+        The function `_start_processes` publishes the gt graphs and node positions in shared memory
+        and starts the worker processes attached to them.
+        """
+        gt = {}
+        for name, x in self.gt.items():
+            shared = SharedGraphBlocks(
+                x["graph"], {"node_position": x["node_position"]}
+            )
+            self._shared.append(shared)
+            gt[name] = dict(x, graph=shared.handle, node_position=None)
+        lut_cache = (
+            None
+            if self.lut_cache is None
+            else (self.lut_cache.cache_dir, self.lut_cache.max_bytes, self.lut_cache.mode)
+        )
+        return ProcessPoolExecutor(
+            self.num_workers,
+            initializer=_init_process_worker,
+            initargs=(gt, self.memory_budget, lut_cache),
+        )
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        evaluate = _evaluate_in_process if self.use_processes else self.evaluate
+        while True:
+            request, future = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self._executor, evaluate, request)
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    async def _handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    result = {"error": f"invalid request: {e}"}
+                else:
+                    future = loop.create_future()
+                    await self._queue.put((request, future))
+                    result = await future
+                writer.write((json.dumps(result) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host="127.0.0.1", port=8765, ready=None):
+        """
+        The function `serve` accepts requests on a Unix socket (if `socket_path` is given) or on
+        a localhost TCP port, until it is cancelled.
+
+        :param ready: An optional `asyncio.Event` set once the server is listening
+        """
+        self._executor = (
+            self._start_processes()
+            if self.use_processes
+            else ThreadPoolExecutor(self.num_workers)
+        )
+        self._queue = asyncio.Queue(self.queue_size)
+        workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.num_workers)
+        ]
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self._handle_connection, socket_path)
+        else:
+            server = await asyncio.start_server(self._handle_connection, host, port)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._executor.shutdown(wait=not self.use_processes)
+            for shared in self._shared:
+                shared.close()
+            self._shared = []
+
+
+# server of the worker process, with the gt graphs attached to the shared memory
+_process_server = None
+
+
+def _init_process_worker(gt, memory_budget, lut_cache):
+    global _process_server
+    server = ERLServer(
+        {},
+        memory_budget=memory_budget,
+        lut_cache=None if lut_cache is None else LutCache(*lut_cache),
+    )
+    for name, x in gt.items():
+        graph = SharedNetworkXGraphLite(x["graph"])
+        server.gt[name] = dict(
+            x, graph=graph, node_position=graph.arrays["node_position"]
+        )
+    _process_server = server
+
+
+def _evaluate_in_process(request):
+    return _process_server.evaluate(request)
+
+
+def request_evaluation(request, socket_path=None, host="127.0.0.1", port=8765):
+    """
+    The function `request_evaluation` sends one request to a running `ERLServer` and waits for the
+    result.
+
+    :param request: The request dictionary (see `ERLServer.evaluate`)
+    :param socket_path: The Unix socket of the server. If not given, `host` and `port` are used
+    :return: the response dictionary.
+    """
+    if socket_path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+    else:
+        sock = socket.create_connection((host, port))
+    with sock, sock.makefile("rwb") as fid:
+        fid.write((json.dumps(request) + "\n").encode())
+        fid.flush()
+        return json.loads(fid.readline())
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="ERL evaluation server with resident gt statistics"
+    )
+    parser.add_argument(
+        "-g",
+        "--gt",
+        type=str,
+        action="append",
+        help="name:gt_stats_path[:gt_mask_path], can be repeated",
+        required=True,
+    )
+    parser.add_argument(
+        "-u",
+        "--socket-path",
+        type=str,
+        help="unix socket to listen on (default: localhost tcp)",
+        default=None,
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        help="localhost tcp port to listen on",
+        default=8765,
+    )
+    parser.add_argument(
+        "-w",
+        "--num-workers",
+        type=int,
+        help="number of submissions evaluated in parallel",
+        default=2,
+    )
+    parser.add_argument(
+        "-wp",
+        "--worker-processes",
+        action="store_true",
+        help="evaluate in worker processes sharing the gt graphs in shared memory",
+    )
+    parser.add_argument(
+        "-b",
+        "--memory-budget",
+        type=str,
+        help="memory budget of each worker, e.g., 2G",
+        default="",
+    )
+    parser.add_argument(
+        "-cd",
+        "--cache-dir",
+        type=str,
+        help="cache the node segment lookup tables in this folder",
+        default="",
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache-size",
+        type=str,
+        help="maximum size of the cache, e.g., 4G",
+        default="4G",
+    )
+    args = parser.parse_args()
+    gt_bundles = {}
+    for gt in args.gt:
+        gt = gt.split(":")
+        gt_bundles[gt[0]] = (gt[1], gt[2] if len(gt) > 2 else None)
+    args.gt = gt_bundles
+    args.memory_budget = (
+        parse_memory_size(args.memory_budget) if args.memory_budget else None
+    )
+    return args
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    lut_cache = (
+        LutCache(args.cache_dir, parse_memory_size(args.cache_size))
+        if args.cache_dir
+        else None
+    )
+    server = ERLServer(
+        args.gt,
+        args.num_workers,
+        args.memory_budget,
+        lut_cache=lut_cache,
+        use_processes=args.worker_processes,
+    )
+    asyncio.run(server.serve(args.socket_path, port=args.port))
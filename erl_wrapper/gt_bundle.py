@@ -0,0 +1,521 @@
+import argparse
+import itertools
+import json
+import os
+import struct
+import numpy as np
+from data_io import get_volume_info, read_box, mkdir, parse_memory_size
+from chains import SkeletonChains
+from mask_index import MaskIndex
+from networkx_lite import NetworkXGraphLite, get_node_dtypes, to_column
+from node_layout import NodeLayout, get_node_order
+from relabel import pack_pairs
+
+# build the gt evaluation bundle from a label volume in one command. Each stage streams to disk:
+# 1. the labels are skeletonized tile by tile (kimimaro), with a one-voxel overlap so that the
+#    skeletons of adjacent tiles meet at the same border vertices. Each tile is saved to the work
+#    folder and skipped if the build is restarted
+# 2. the tile skeletons are merged into node and edge arrays (shared border vertices merged), without
+#    building a networkx graph
+# 3. vectorized edge and skeleton lengths, nodes sorted by z-slice and Morton code (node_layout.py),
+#    skeleton chains between branch points and endpoints (chains.py)
+# 4. the mask index, read slab by slab (mask_index.py)
+# 5. a versioned binary bundle: raw arrays and a json index, loaded by `load_gt_stats` of test_axonEM
+# Only one tile or mask slab is held at a time; the node and edge arrays take tens of bytes per node
+#
+# python gt_bundle.py -s axonM_gt_16nm.h5 -r 30x16x16 -m axonM_gt_16nm_mask.h5 -o axonM_gt_16nm.erlgt -w work/
+# python test_axonEM.py -s seg_axonM.h5 -g axonM_gt_16nm.erlgt
+
+MAGIC = b"ERLGTBDL"
+# version 2: typed node columns, version 3: skeleton chains
+VERSION = 3
+HEADER = struct.Struct("<8sI")
+FOOTER = struct.Struct("<QQ8s")
+ALIGNMENT = 64
+
+
+def is_gt_bundle(path):
+    """
+    The function `is_gt_bundle` tells whether a file is a gt bundle (and not a pickle).
+
+    :param path: The path to the file
+    :return: a bool.
+    """
+    with open(path, "rb") as fid:
+        return fid.read(len(MAGIC)) == MAGIC
+
+
+class BundleWriter:
+    # The BundleWriter class writes the arrays of a gt bundle one by one, then its index.
+    def __init__(self, path):
+        """
+        :param path: The path to the bundle file
+        """
+        self.path = path
+        self.index = {"version": VERSION, "arrays": {}, "attributes": {}}
+        self.fid = open(path + ".tmp", "wb")
+        self.fid.write(HEADER.pack(MAGIC, VERSION))
+
+    def add_array(self, name, array):
+        """
+        The function `add_array` appends an array to the bundle, aligned for memory mapping.
+
+        :param name: The name of the array
+        :param array: The array
+        """
+        array = np.ascontiguousarray(array)
+        self.fid.write(b"\0" * (-self.fid.tell() % ALIGNMENT))
+        self.index["arrays"][name] = {
+            "offset": self.fid.tell(),
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+        }
+        array.tofile(self.fid)
+
+    def close(self, attributes=None):
+        """
+        The function `close` writes the index and the footer, then moves the bundle in place.
+
+        :param attributes: A json-serializable dictionary stored with the arrays (optional)
+        """
+        self.index["attributes"].update(attributes or {})
+        data = json.dumps(self.index).encode()
+        index_offset = self.fid.tell()
+        self.fid.write(data)
+        self.fid.write(FOOTER.pack(index_offset, len(data), MAGIC))
+        self.fid.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+def read_gt_bundle(path, mmap=False):
+    """
+    The function `read_gt_bundle` reads the arrays and attributes of a gt bundle.
+
+    :param path: The path to the bundle file
+    :param mmap: If True, the arrays are memory-mapped instead of read, defaults to False
+    :return: a dictionary of arrays and a dictionary of attributes.
+    """
+    with open(path, "rb") as fid:
+        magic, version = HEADER.unpack(fid.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"not a gt bundle: {path}")
+        if version > VERSION:
+            raise ValueError(
+                f"gt bundle version {version} is newer than the supported {VERSION}: {path}"
+            )
+        fid.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, index_size, magic = FOOTER.unpack(fid.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"truncated gt bundle: {path}")
+        fid.seek(index_offset)
+        index = json.loads(fid.read(index_size))
+        arrays = {}
+        for name, record in index["arrays"].items():
+            dtype = np.dtype(record["dtype"])
+            shape = tuple(record["shape"])
+            if mmap:
+                arrays[name] = np.memmap(
+                    path, dtype, "r", offset=record["offset"], shape=shape
+                )
+            else:
+                fid.seek(record["offset"])
+                arrays[name] = np.fromfile(
+                    fid, dtype, int(np.prod(shape, dtype=np.int64))
+                ).reshape(shape)
+    return arrays, index["attributes"]
+
+
+def load_gt_bundle(path, return_skeleton_chains=False):
+    """
+    The function `load_gt_bundle` loads a gt bundle as the gt statistics of the evaluation.
+
+    :param path: The path to the bundle file
+    :param return_skeleton_chains: If True, also return the `SkeletonChains` of the gt skeletons
+    (None if the bundle is older than version 3)
+    :return: the ground truth graph (`NetworkXGraphLite`, node position in physical unit), its
+    resolution, the `MaskIndex` (None if the bundle has no mask) and the `NodeLayout`.
+    """
+    arrays, attributes = read_gt_bundle(path)
+    node_attributes = attributes["node_attributes"]
+    if "nodes" in arrays:
+        # version 1: one [N, #node_attributes] matrix
+        columns = {key: arrays["nodes"][:, i] for i, key in enumerate(node_attributes)}
+    else:
+        columns = {key: arrays["node_" + key] for key in node_attributes}
+    gt_graph = NetworkXGraphLite(
+        node_attributes, node_dtype={key: x.dtype for key, x in columns.items()}
+    )
+    gt_graph.load_arrays(columns, arrays["edges"], arrays["edge_length"])
+    gt_res = np.array(attributes["gt_res"])
+    node_layout = NodeLayout()
+    node_layout.order = attributes["node_order"]
+    node_layout.z_offsets = arrays["node_z_offsets"]
+    mask_index = None
+    if "mask_run_start" in arrays:
+        mask_index = MaskIndex()
+        mask_index.shape = tuple(attributes["mask_shape"])
+        mask_index.run_start = arrays["mask_run_start"]
+        mask_index.run_length = arrays["mask_run_length"]
+        mask_index.z_offsets = arrays["mask_z_offsets"]
+    if not return_skeleton_chains:
+        return gt_graph, gt_res, mask_index, node_layout
+    skeleton_chains = None
+    if "chain_nodes" in arrays:
+        skeleton_chains = SkeletonChains()
+        skeleton_chains.load_arrays(
+            arrays["chain_nodes"],
+            arrays["chain_offsets"],
+            arrays["chain_skeleton"],
+            arrays["chain_cum_length"],
+            attributes["chain_exact"],
+        )
+    return gt_graph, gt_res, mask_index, node_layout, skeleton_chains
+
+
+def get_tiles(shape, tile_shape):
+    """
+    The function `get_tiles` splits a volume into tiles that overlap by one voxel, so that the
+    skeletons of adjacent tiles share their border vertices.
+
+    :param shape: The shape of the volume
+    :param tile_shape: The shape of the tiles (without the overlap)
+    :return: a list of boxes `[[z0, z1], [y0, y1], [x0, x1]]`.
+    """
+    starts = [range(0, size, tile) for size, tile in zip(shape, tile_shape)]
+    return [
+        [[s, min(s + t + 1, n)] for s, t, n in zip(start, tile_shape, shape)]
+        for start in itertools.product(*starts)
+    ]
+
+
+def skeletonize_tiles(
+    seg_path,
+    seg_resolution,
+    work_dir,
+    tile_shape=(256, 512, 512),
+    dataset_name=None,
+    obj_ids=None,
+    dust_size=100,
+    num_thread=1,
+):
+    """
+    The function `skeletonize_tiles` skeletonizes a label volume tile by tile and saves the skeleton
+    vertices (in voxels) and edges of each tile to the work folder. Tiles already saved are skipped.
+
+    :param seg_path: The path to the label volume
+    :param seg_resolution: The voxel resolution (zyx order)
+    :param work_dir: The folder of the tile files
+    :param tile_shape: The shape of the tiles, defaults to (256, 512, 512)
+    :param dataset_name: The name of the dataset (optional)
+    :param obj_ids: The labels to skeletonize, defaults to all
+    :param dust_size: The minimum number of voxels of a connected component within a tile
+    :param num_thread: The number of kimimaro processes
+    :return: the paths of the tile files.
+    """
+    # kimimaro is only needed by this stage
+    from skeleton import skeletonize
+
+    shape, _, _ = get_volume_info(seg_path, dataset_name)
+    seg_resolution = np.asarray(seg_resolution, np.float64)
+    tile_paths = []
+    for box in get_tiles(shape, tile_shape):
+        tile_path = os.path.join(
+            work_dir, "tile_%d_%d_%d.npz" % tuple(x[0] for x in box)
+        )
+        tile_paths.append(tile_path)
+        if os.path.exists(tile_path):
+            continue
+        labels = read_box(seg_path, box, dataset_name)
+        skeletons = {}
+        if labels.any():
+            skeletons = skeletonize(
+                labels,
+                obj_ids=obj_ids,
+                dust_size=dust_size,
+                res=tuple(seg_resolution),
+                num_thread=num_thread,
+            )
+        skeletons = [x for x in skeletons.items() if len(x[1].edges) > 0]
+        vertices = [x.vertices for _, x in skeletons]
+        num_vertices = np.cumsum([0] + [len(x) for x in vertices])
+        # kimimaro vertices are in physical unit, in the axis order of the array
+        position = np.round(
+            np.concatenate(vertices + [np.zeros((0, 3))]) / seg_resolution
+        ).astype(np.int64) + [x[0] for x in box]
+        np.savez(
+            tile_path + ".tmp.npz",
+            label=np.repeat(
+                np.array([x[0] for x in skeletons], np.uint64), np.diff(num_vertices)
+            ),
+            position=position.astype(np.int32),
+            edges=np.concatenate(
+                [
+                    x.edges.astype(np.int64) + num_vertices[i]
+                    for i, (_, x) in enumerate(skeletons)
+                ]
+                + [np.zeros((0, 2), np.int64)]
+            ),
+        )
+        os.replace(tile_path + ".tmp.npz", tile_path)
+    return tile_paths
+
+
+def merge_tile_skeletons(tile_paths):
+    """
+    The function `merge_tile_skeletons` merges the tile skeletons into one graph: the vertices of the
+    same label at the same voxel (on the borders of adjacent tiles) become one node.
+
+    :param tile_paths: The paths of the tile files (see `skeletonize_tiles`)
+    :return: the label of each skeleton (K), the skeleton id of each node (N), the voxel position of
+    each node (N, 3) and the node indices of each edge (E, 2).
+    """
+    label, position, edges = [], [], []
+    num_nodes = 0
+    for tile_path in tile_paths:
+        with np.load(tile_path) as tile:
+            label.append(tile["label"])
+            position.append(tile["position"])
+            edges.append(tile["edges"] + num_nodes)
+        num_nodes += len(label[-1])
+    label = np.concatenate(label)
+    position = np.concatenate(position)
+    edges = np.concatenate(edges)
+
+    # sort the vertices by label and voxel, and merge the equal ones
+    order = np.lexsort((position[:, 2], position[:, 1], position[:, 0], label))
+    is_new = np.ones(len(order), bool)
+    is_new[1:] = (np.diff(label[order]) != 0) | np.any(
+        np.diff(position[order], axis=0) != 0, axis=1
+    )
+    new_index = np.empty(len(order), np.int64)
+    new_index[order] = np.cumsum(is_new) - 1
+    label = label[order[is_new]]
+    position = position[order[is_new]]
+
+    edges = np.sort(new_index[edges], axis=1)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    keys = pack_pairs(edges)
+    if keys is None:
+        edges = np.unique(edges, axis=0)
+    else:
+        _, unique = np.unique(keys, return_index=True)
+        edges = edges[unique]
+    skeleton_label, node_skeleton = np.unique(label, return_inverse=True)
+    return skeleton_label, node_skeleton, position, edges
+
+
+def build_gt_bundle(
+    seg_path,
+    seg_resolution,
+    output_path,
+    work_dir,
+    mask_path=None,
+    tile_shape=(256, 512, 512),
+    dataset_name=None,
+    obj_ids=None,
+    dust_size=100,
+    num_thread=1,
+    memory_budget=None,
+):
+    """
+    The function `build_gt_bundle` builds the gt evaluation bundle of a label volume: tiled
+    skeletonization, graph arrays, edge and skeleton lengths, Morton node order and mask index.
+
+    :param seg_path: The path to the gt label volume
+    :param seg_resolution: The voxel resolution (zyx order)
+    :param output_path: The path to the bundle file
+    :param work_dir: The folder of the intermediate tile files
+    :param mask_path: The path to the gt no-background mask (optional)
+    :param tile_shape: The shape of the skeletonization tiles, defaults to (256, 512, 512)
+    :param dataset_name: The name of the label dataset (optional)
+    :param obj_ids: The labels to skeletonize, defaults to all
+    :param dust_size: The minimum number of voxels of a connected component within a tile
+    :param num_thread: The number of kimimaro processes
+    :param memory_budget: The maximum number of bytes of a slab of the mask (optional)
+    """
+    mkdir(work_dir, "all")
+    tile_paths = skeletonize_tiles(
+        seg_path,
+        seg_resolution,
+        work_dir,
+        tile_shape,
+        dataset_name,
+        obj_ids,
+        dust_size,
+        num_thread,
+    )
+    skeleton_label, node_skeleton, position, edges = merge_tile_skeletons(
+        tile_paths
+    )
+
+    # nodes sorted by z-slice, then along a Morton curve (node_layout.py)
+    order = get_node_order(position)
+    new_index = np.empty(len(order), np.int64)
+    new_index[order] = np.arange(len(order))
+    node_skeleton = node_skeleton[order]
+    position = position[order]
+    edges = np.sort(new_index[edges], axis=1)
+    node_layout = NodeLayout(position[:, 0])
+
+    # typed node columns as in the lite graph, node position in physical unit
+    gt_res = np.asarray(seg_resolution, np.int64)
+    physical = position.astype(np.int64) * gt_res
+    node_attributes = sorted(["skeleton_id", "z", "y", "x"])
+    node_dtypes = get_node_dtypes(node_attributes)
+    columns = {
+        "skeleton_id": node_skeleton,
+        "z": physical[:, 0],
+        "y": physical[:, 1],
+        "x": physical[:, 2],
+    }
+    columns = {key: to_column(columns[key], node_dtypes[key], key) for key in columns}
+
+    # vectorized lengths from the stored positions, as `get_graph_edge_lengths`
+    physical = physical.astype(np.float32)
+    edge_length = np.linalg.norm(
+        physical[edges[:, 0]] - physical[edges[:, 1]], axis=1
+    )
+    skeleton_length = np.bincount(
+        node_skeleton[edges[:, 0]], edge_length, minlength=len(skeleton_label)
+    )
+    del physical
+    skeleton_chains = SkeletonChains()
+    skeleton_chains.load_edges(columns["skeleton_id"], edges, edge_length)
+
+    writer = BundleWriter(output_path)
+    for key in node_attributes:
+        writer.add_array("node_" + key, columns[key])
+    writer.add_array(
+        "edges", edges.astype(np.uint32 if len(position) < 2**32 else np.uint64)
+    )
+    writer.add_array("edge_length", edge_length)
+    writer.add_array("skeleton_label", skeleton_label)
+    writer.add_array("skeleton_length", skeleton_length)
+    writer.add_array("node_z_offsets", node_layout.z_offsets)
+    writer.add_array("chain_nodes", skeleton_chains.nodes)
+    writer.add_array("chain_offsets", skeleton_chains.offsets)
+    writer.add_array("chain_skeleton", skeleton_chains.skeleton)
+    writer.add_array("chain_cum_length", skeleton_chains.cum_length)
+    chain_exact = skeleton_chains.exact
+    del columns, edges, edge_length, position, node_skeleton, skeleton_chains
+    attributes = {
+        "gt_res": gt_res.tolist(),
+        "node_attributes": node_attributes,
+        "node_order": node_layout.order,
+        "seg_shape": list(get_volume_info(seg_path, dataset_name)[0]),
+        "tile_shape": list(tile_shape),
+        "dust_size": dust_size,
+        "chain_exact": chain_exact,
+    }
+    if mask_path is not None:
+        mask_index = MaskIndex()
+        mask_index.load_volume(mask_path, memory_budget)
+        writer.add_array("mask_run_start", mask_index.run_start)
+        writer.add_array("mask_run_length", mask_index.run_length)
+        writer.add_array("mask_z_offsets", mask_index.z_offsets)
+        attributes["mask_shape"] = list(mask_index.shape)
+    writer.close(attributes)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Build the gt evaluation bundle from a label volume"
+    )
+    parser.add_argument(
+        "-s",
+        "--seg-path",
+        type=str,
+        help="path to the gt labels",
+        required=True,
+    )
+    parser.add_argument(
+        "-r",
+        "--seg-resolution",
+        type=str,
+        help="label resolution (zyx order)",
+        default="30x6x6",
+    )
+    parser.add_argument(
+        "-m",
+        "--mask-path",
+        type=str,
+        help="path to the gt no-background mask",
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        help="path to the output bundle",
+        required=True,
+    )
+    parser.add_argument(
+        "-w",
+        "--work-dir",
+        type=str,
+        help="folder of the skeletonized tiles (a restarted build skips the saved tiles)",
+        required=True,
+    )
+    parser.add_argument(
+        "-t",
+        "--tile-shape",
+        type=str,
+        help="shape of the skeletonization tiles (zyx order)",
+        default="256x512x512",
+    )
+    parser.add_argument(
+        "-i",
+        "--seg-index",
+        type=str,
+        help="selected label indices for skeletonization. '-1' means all",
+        default="-1",
+    )
+    parser.add_argument(
+        "-d",
+        "--dust-size",
+        type=int,
+        help="dust size parameter for skeletonization",
+        default=100,
+    )
+    parser.add_argument(
+        "-n",
+        "--num-thread",
+        type=int,
+        help="number of skeletonization processes",
+        default=1,
+    )
+    parser.add_argument(
+        "-b",
+        "--memory-budget",
+        type=str,
+        help="maximum memory of a slab of the mask, e.g., 2G (default: available memory)",
+        default=None,
+    )
+    result_args = parser.parse_args()
+    result_args.seg_resolution = [int(x) for x in result_args.seg_resolution.split("x")]
+    result_args.tile_shape = [int(x) for x in result_args.tile_shape.split("x")]
+    result_args.seg_index = (
+        None
+        if result_args.seg_index == "-1"
+        else [int(x) for x in result_args.seg_index.split(",")]
+    )
+    if result_args.memory_budget is not None:
+        result_args.memory_budget = parse_memory_size(result_args.memory_budget)
+    return result_args
+
+
+if __name__ == "__main__":
+    # python gt_bundle.py -s axonM_gt_16nm.h5 -r 30x16x16 -m axonM_gt_16nm_mask.h5 -o axonM_gt_16nm.erlgt -w work/
+    args = get_arguments()
+    build_gt_bundle(
+        args.seg_path,
+        args.seg_resolution,
+        args.output_path,
+        args.work_dir,
+        args.mask_path,
+        args.tile_shape,
+        obj_ids=args.seg_index,
+        dust_size=args.dust_size,
+        num_thread=args.num_thread,
+        memory_budget=args.memory_budget,
+    )
@@ -0,0 +1,406 @@
+import os
+import hashlib
+import numpy as np
+from data_io import (
+    read_pkl,
+    write_pkl,
+    read_box_h5,
+    get_volume_info,
+    iter_raw_chunks_h5,
+)
+from mask_index import MaskIndex
+from relabel import (
+    SegmentRelabel,
+    fits_data_type,
+    count_pairs,
+    pack_pairs,
+    unpack_pairs,
+)
+from networkx_lite import get_graph_arrays
+from eval_erl import (
+    get_skeleton_lengths,
+    find_merging_segments,
+    score_skeleton_edges,
+    aggregate_run_length,
+    relabel_histogram,
+)
+from profiling import profile_stage, profile_event
+
+# incremental re-evaluation of a prediction of which only some regions changed:
+# the checksum of each stored chunk is kept with the node lookup table, the per-chunk mask
+# histograms, the (skeleton, segment) contingency and the per-skeleton scores.
+# a new version of the prediction only reads the chunks whose checksum changed and only
+# rescores the skeletons whose nodes or merging segments changed
+#
+# evaluator = IncrementalERL(gt_graph, node_position, gt_mask, merge_threshold=50)
+# evaluator.load_state("pred_state.p")
+# evaluator.evaluate("pred_v2.h5")
+# evaluator.save_state("pred_state.p")
+
+
+def get_chunk_digests(filename, dataset_name=None):
+    """
+    The function `get_chunk_digests` hashes each stored chunk of an HDF5 dataset, without
+    decompressing it.
+
+    :param filename: The name of the HDF5 file
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :return: a dictionary mapping the offset of each stored chunk to its digest.
+    """
+    digests = {}
+    filter_masks = {}
+    # a contiguous dataset is one chunk read in pieces
+    for offset, filter_mask, raw_bytes in iter_raw_chunks_h5(filename, dataset_name):
+        offset = tuple(int(x) for x in offset)
+        if offset not in digests:
+            digests[offset] = hashlib.blake2b(digest_size=16)
+            filter_masks[offset] = filter_mask
+        digests[offset].update(raw_bytes)
+    for offset, digest in digests.items():
+        digest.update(np.int64(filter_masks[offset]).tobytes())
+    return {offset: digest.digest() for offset, digest in digests.items()}
+
+
+def add_counts(keys, counts, delta_keys, delta_counts):
+    """
+    The function `add_counts` adds (possibly negative) counts to a sparse histogram.
+
+    :param keys: The unique keys of the histogram, either ids (K) or pairs of ids (K, 2)
+    :param counts: The count of each key
+    :param delta_keys: The keys of the counts to add
+    :param delta_counts: The counts to add
+    :return: the updated `(keys, counts)` without the keys whose count drops to zero.
+    """
+    keys = np.concatenate([keys, delta_keys])
+    weights = np.concatenate([counts, delta_counts]).astype(np.float64)
+    packed = pack_pairs(keys) if keys.ndim > 1 else None
+    if packed is not None:
+        packed, index = np.unique(packed, return_inverse=True)
+        keys = unpack_pairs(packed)
+    else:
+        keys, index = np.unique(
+            keys, axis=0 if keys.ndim > 1 else None, return_inverse=True
+        )
+    counts = np.bincount(index.ravel(), weights, minlength=len(keys)).astype(np.int64)
+    return keys[counts != 0], counts[counts != 0]
+
+
+class IncrementalERL:
+    # The IncrementalERL class keeps the intermediate results of the last evaluated prediction.
+    def __init__(
+        self,
+        gt_graph,
+        node_position,
+        mask=None,
+        merge_threshold=0,
+        skeleton_id_attribute="skeleton_id",
+        edge_length_attribute="length",
+        skeleton_position_attributes=["z", "y", "x"],
+        data_type=np.uint32,
+    ):
+        """
+        :param gt_graph: The ground truth graph
+        :param node_position: The voxel position of each node (N, 3) in zyx order
+        :param mask: The gt no-background mask: a 3D volume, the name of an h5 file or a `MaskIndex`
+        (optional)
+        :param merge_threshold: The minimum number of nodes (resp. mask voxels) of a false merge
+        :param data_type: The data type of the node segment lookup table. Segment ids that do not
+        fit into it are relabeled to dense ids (kept in the state)
+        """
+        get_skeleton_lengths(
+            gt_graph,
+            skeleton_position_attributes,
+            skeleton_id_attribute,
+            store_edge_length=edge_length_attribute,
+        )
+        self.node_skeleton, self.edges, self.edge_length = get_graph_arrays(
+            gt_graph, skeleton_id_attribute, edge_length_attribute
+        )
+        self.edge_skeleton = self.node_skeleton[self.edges[:, 0]]
+        self.skeleton_ids = np.unique(self.node_skeleton)
+        self.node_position = np.asarray(node_position)
+        self.mask = mask
+        self.merge_threshold = merge_threshold
+        self.data_type = data_type
+        self.gt_fingerprint = self.get_gt_fingerprint()
+        self.state = None
+        # nodes sorted by chunk, for a given chunk shape
+        self._node_chunks = None
+
+    def get_gt_fingerprint(self):
+        """
+        The function `get_gt_fingerprint` hashes the gt graph and mask, to only reuse a state computed
+        with the same gt.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for array in [self.node_skeleton, self.edges, self.node_position]:
+            digest.update(np.ascontiguousarray(array).tobytes())
+        if isinstance(self.mask, MaskIndex):
+            digest.update(self.mask.run_start.tobytes())
+            digest.update(self.mask.run_length.tobytes())
+        elif isinstance(self.mask, str):
+            stat = os.stat(self.mask)
+            digest.update(
+                f"{os.path.abspath(self.mask)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+            )
+        elif self.mask is not None:
+            digest.update(np.ascontiguousarray(self.mask).tobytes())
+        return digest.hexdigest()
+
+    def load_state(self, filename):
+        """
+        The function `load_state` loads the state saved after a previous evaluation. The state is
+        ignored if it does not exist or was computed with another gt.
+
+        :param filename: The name of the state file
+        :return: whether the state was loaded.
+        """
+        if not os.path.exists(filename):
+            return False
+        state = read_pkl(filename)[0]
+        if state["gt_fingerprint"] != self.gt_fingerprint:
+            print("Warning: the incremental state was computed with another gt, ignore it")
+            return False
+        self.state = state
+        return True
+
+    def save_state(self, filename):
+        """
+        The function `save_state` saves the state of the last evaluation.
+
+        :param filename: The name of the state file
+        """
+        write_pkl(filename, self.state)
+
+    def _get_chunk_nodes(self, shape, chunks):
+        # flat chunk index of each node and the nodes sorted by chunk
+        if self._node_chunks is None or self._node_chunks[0] != (shape, chunks):
+            grid = tuple(-(-np.array(shape) // chunks))
+            node_chunk = np.ravel_multi_index(
+                tuple((self.node_position // chunks).T.astype(np.int64)), grid
+            )
+            order = np.argsort(node_chunk, kind="stable")
+            self._node_chunks = ((shape, chunks), grid, order, node_chunk[order])
+        return self._node_chunks[1:]
+
+    def _read_mask_box(self, box, mask_rows):
+        if isinstance(self.mask, MaskIndex):
+            # decode each z-row of chunks once
+            if box[0][0] not in mask_rows:
+                mask_rows.clear()
+                mask_rows[box[0][0]] = self.mask.decode(box[0][0], box[0][1])
+            return mask_rows[box[0][0]][:, box[1][0] : box[1][1], box[2][0] : box[2][1]]
+        if isinstance(self.mask, str):
+            return read_box_h5(self.mask, box) > 0
+        return self.mask[tuple(slice(x[0], x[1]) for x in box)] > 0
+
+    def update_segment_lut(self, segment, profiler=None):
+        """
+        The function `update_segment_lut` reads the chunks of the prediction whose checksum changed,
+        and patches the node segment lookup table and the mask histogram.
+
+        :param segment: The name of the h5 file of the prediction
+        :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+        :return: the indices of the nodes whose segment changed, or None if all nodes were computed.
+        """
+        assert ".h5" in segment
+        shape, dtype, chunks = get_volume_info(segment)
+        shape = tuple(shape)
+        chunks = shape if chunks is None else tuple(chunks)
+        with profile_stage(profiler, "chunk_digests"):
+            digests = get_chunk_digests(segment)
+
+        state = self.state
+        # states saved before the relabeling may hold truncated segment ids, or mask histograms in
+        # dense ids. The relabeling is chosen from the data type of the prediction, so a new data
+        # type recomputes all chunks
+        full = (
+            state is None
+            or state["shape"] != shape
+            or state["chunks"] != chunks
+            or "relabel" not in state
+            or state.get("dtype") != np.dtype(dtype).str
+            or state.get("mask_hist_ids") != "original"
+        )
+        if full:
+            # first evaluation: all chunks of the volume
+            grid = -(-np.array(shape) // chunks)
+            changed = [
+                tuple(int(x) for x in np.array(index) * chunks)
+                for index in np.ndindex(*grid)
+            ]
+            state = {
+                "gt_fingerprint": self.gt_fingerprint,
+                "shape": shape,
+                "chunks": chunks,
+                "dtype": np.dtype(dtype).str,
+                # the mask histograms keep the original segment ids, relabeled when they are used
+                "mask_hist_ids": "original",
+                "chunk_digests": {},
+                "chunk_mask_hist": {},
+                "node_lut": np.zeros(len(self.node_position), self.data_type),
+                "relabel": None
+                if fits_data_type(dtype, self.data_type)
+                else SegmentRelabel(self.data_type),
+            }
+        else:
+            changed = sorted(
+                offset
+                for offset in set(digests) | set(state["chunk_digests"])
+                if digests.get(offset) != state["chunk_digests"].get(offset)
+            )
+        grid, node_order, node_chunk = self._get_chunk_nodes(shape, chunks)
+
+        node_lut = state["node_lut"].copy()
+        relabel = state.get("relabel")
+        mask_delta = []
+        mask_rows = {}
+        for offset in changed:
+            box = [[x, min(x + c, s)] for x, c, s in zip(offset, chunks, shape)]
+            with profile_stage(profiler, "read_segment"):
+                seg = read_box_h5(segment, box)
+            with profile_stage(profiler, "node_lookup"):
+                chunk_id = np.ravel_multi_index(
+                    tuple(x // c for x, c in zip(offset, chunks)), grid
+                )
+                nodes = node_order[
+                    np.searchsorted(node_chunk, chunk_id) : np.searchsorted(
+                        node_chunk, chunk_id, "right"
+                    )
+                ]
+                pts = self.node_position[nodes].astype(np.int64) - np.array(offset)
+                if relabel is not None:
+                    node_lut[nodes] = relabel.update(seg[pts[:, 0], pts[:, 1], pts[:, 2]])
+                else:
+                    node_lut[nodes] = seg[pts[:, 0], pts[:, 1], pts[:, 2]]
+            if self.mask is not None:
+                with profile_stage(profiler, "mask_histogram"):
+                    mask_hist = np.unique(
+                        seg[self._read_mask_box(box, mask_rows)], return_counts=True
+                    )
+                    mask_hist = (mask_hist[0].astype(np.uint64), mask_hist[1])
+                    if offset in state["chunk_mask_hist"]:
+                        old_hist = state["chunk_mask_hist"][offset]
+                        mask_delta.append((old_hist[0], -old_hist[1]))
+                    mask_delta.append(mask_hist)
+                    state["chunk_mask_hist"][offset] = mask_hist
+            if offset in digests:
+                state["chunk_digests"][offset] = digests[offset]
+            else:
+                # the chunk is no longer stored (fill value)
+                state["chunk_digests"].pop(offset, None)
+
+        if self.mask is not None:
+            with profile_stage(profiler, "merge_mask_histogram"):
+                mask_hist = state.get(
+                    "mask_hist", (np.zeros(0, np.uint64), np.zeros(0, np.int64))
+                )
+                for delta in mask_delta:
+                    mask_hist = add_counts(*mask_hist, *delta)
+                state["mask_hist"] = mask_hist
+        if full:
+            changed_nodes, previous_segments = None, None
+        else:
+            changed_nodes = np.nonzero(node_lut != state["node_lut"])[0]
+            previous_segments = state["node_lut"][changed_nodes]
+        state["node_lut"] = node_lut
+        self.state = state
+        profile_event(
+            profiler,
+            "incremental_lut",
+            num_chunks=len(digests),
+            num_changed_chunks=len(changed),
+            num_changed_nodes=len(node_lut)
+            if changed_nodes is None
+            else len(changed_nodes),
+        )
+        return changed_nodes, previous_segments
+
+    def update_scores(self, changed_nodes=None, previous_segments=None, profiler=None):
+        """
+        The function `update_scores` patches the (skeleton, segment) contingency and rescores the
+        skeletons affected by the changed nodes or by a change of the merging segments.
+
+        :param changed_nodes: The indices of the nodes whose segment changed. If None, all skeletons
+        are scored
+        :param previous_segments: The previous segment of each changed node
+        :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+        """
+        state = self.state
+        node_lut = state["node_lut"]
+        rescore_all = (
+            changed_nodes is None
+            or "scores" not in state
+            or state["merge_threshold"] != self.merge_threshold
+        )
+        with profile_stage(profiler, "contingency"):
+            if changed_nodes is None or "contingency" not in state:
+                state["contingency"] = count_pairs(
+                    np.stack([self.node_skeleton, node_lut], axis=1)
+                )
+            elif len(changed_nodes) > 0:
+                skeletons = self.node_skeleton[changed_nodes]
+                state["contingency"] = add_counts(
+                    *state["contingency"],
+                    np.concatenate(
+                        [
+                            np.stack([skeletons, previous_segments], axis=1),
+                            np.stack([skeletons, node_lut[changed_nodes]], axis=1),
+                        ]
+                    ).astype(np.uint64),
+                    np.repeat([-1, 1], len(changed_nodes)),
+                )
+            mask_hist = state.get("mask_hist")
+            if mask_hist is not None and state["relabel"] is not None:
+                # only the segments found at the nodes, as `compute_segment_lut`
+                mask_hist = relabel_histogram(state["relabel"], mask_hist, node_lut)
+            merging_segments = find_merging_segments(
+                *state["contingency"], mask_hist, self.merge_threshold
+            )
+
+        with profile_stage(profiler, "score_skeletons"):
+            if rescore_all:
+                affected = self.skeleton_ids
+            else:
+                # skeletons with a changed node, or with a node on a segment that starts or stops
+                # being a merging segment
+                flipped = np.setxor1d(state["merging_segments"], merging_segments)
+                affected = np.union1d(
+                    self.node_skeleton[changed_nodes],
+                    self.node_skeleton[np.isin(node_lut, flipped)],
+                )
+            edge_mask = np.isin(self.edge_skeleton, affected)
+            scores = score_skeleton_edges(
+                affected,
+                self.edge_skeleton[edge_mask],
+                self.edges[edge_mask],
+                self.edge_length[edge_mask],
+                node_lut,
+                merging_segments,
+            )
+            if rescore_all:
+                state["scores"] = scores
+            else:
+                index = np.searchsorted(self.skeleton_ids, affected)
+                for key, value in scores.items():
+                    state["scores"][key][index] = value
+        state["merging_segments"] = merging_segments
+        state["merge_threshold"] = self.merge_threshold
+        profile_event(profiler, "incremental_scores", num_rescored_skeletons=len(affected))
+
+    def evaluate(self, segment, erl_intervals=None, profiler=None):
+        """
+        The function `evaluate` evaluates a (new version of a) prediction, reusing the results of the
+        previous evaluation for the unchanged chunks and skeletons.
+
+        :param segment: The name of the h5 file of the prediction
+        :param erl_intervals: The boundaries of the skeleton length intervals (optional)
+        :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+        :return: the same scores as `compute_erl`.
+        """
+        with profile_stage(profiler, "segment_lut"):
+            changed_nodes, previous_segments = self.update_segment_lut(segment, profiler)
+        with profile_stage(profiler, "erl"):
+            self.update_scores(changed_nodes, previous_segments, profiler)
+            scores = self.state["scores"]
+            return aggregate_run_length(scores["length"], scores["erl"], erl_intervals)
@@ -0,0 +1,510 @@
+import os
+import json
+import struct
+import zlib
+import argparse
+import numpy as np
+
+# compact archive of the node lookup tables and mask histograms of many submissions (one file per
+# gt), to re-rank them without reading the predictions again:
+# - the segment ids of a submission are remapped into its own sorted dictionary
+# - the dictionary indices are stored in node order as zigzag deltas in varints: consecutive nodes
+#   mostly share a segment, so that most deltas are single zero bytes. The gt node order (along
+#   each skeleton, or Morton order after node_layout.py) is used by default; another order can be
+#   given, e.g., get_node_order(node_position) for Morton order. On skeletons stored along their
+#   paths, the Morton order breaks the runs of equal segments and compresses 3-8x worse
+# - each submission is compressed separately (zstd if available, else zlib), and a json index at
+#   the end of the file maps the submission names to their records for random access
+# layout: magic | records ... | index | index offset, index size, magic. New records are appended
+# after the last footer, followed by a new index and footer: an interrupted update leaves the
+# previous index in place, and it is found again when the archive is opened
+#
+# archive = LutArchive("submissions.erllut")
+# archive.put("team_a_v3", node_lut, mask_id)
+# node_lut, mask_id = archive.get("team_a_v3")
+# python lut_archive.py -a submissions.erllut -g gt_stats.p -p lut_cache/ -mt 50
+
+MAGIC = b"ERLLUT01"
+FOOTER = struct.Struct("<QQ8s")
+
+
+def _get_zstd():
+    # zstd codec if available: the standard library (python 3.14+) or the zstandard package
+    try:
+        from compression import zstd
+
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+
+        return (
+            lambda data: zstandard.ZstdCompressor(level=9).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data),
+        )
+    except ImportError:
+        return None
+
+
+def compress(data, codec):
+    """
+    The function `compress` compresses a record of the archive.
+
+    :param data: The bytes to compress
+    :param codec: "zstd" or "zlib"
+    """
+    if codec == "zstd":
+        return _get_zstd()[0](data)
+    return zlib.compress(data, 9)
+
+
+def decompress(data, codec):
+    """
+    The function `decompress` decompresses a record of the archive (see `compress`).
+    """
+    if codec == "zstd":
+        zstd = _get_zstd()
+        if zstd is None:
+            raise ImportError("this archive requires zstd: pip install zstandard")
+        return zstd[1](data)
+    return zlib.decompress(data)
+
+
+def encode_varint(values, block_size=2**20):
+    """
+    The function `encode_varint` encodes unsigned integers as LEB128 varints (7 bits per byte,
+    the high bit marks that more bytes follow).
+
+    :param values: The unsigned integers
+    :param block_size: The number of values encoded at a time, to bound the temporary memory
+    :return: the encoded bytes.
+    """
+    values = np.asarray(values).astype(np.uint64, copy=False)
+    out = []
+    for start in range(0, len(values), block_size):
+        block = values[start : start + block_size]
+        num_bytes = np.ones(len(block), np.int64)
+        for k in range(1, 10):
+            num_bytes += block >= (np.uint64(1) << np.uint64(7 * k))
+        width = int(num_bytes.max())
+        shift = np.uint64(7) * np.arange(width, dtype=np.uint64)
+        groups = ((block[:, None] >> shift) & np.uint64(0x7F)).astype(np.uint8)
+        position = np.arange(width)
+        groups[position < num_bytes[:, None] - 1] |= 0x80
+        out.append(groups[position < num_bytes[:, None]].tobytes())
+    return b"".join(out)
+
+
+def decode_varint(data):
+    """
+    The function `decode_varint` decodes LEB128 varints (see `encode_varint`).
+
+    :param data: The encoded bytes
+    :return: the unsigned integers as a uint64 array.
+    """
+    data = np.frombuffer(data, np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, np.uint64)
+    last = data < 0x80
+    starts = np.flatnonzero(np.concatenate([[True], last[:-1]]))
+    value_index = np.cumsum(np.concatenate([[0], last[:-1]]))
+    shift = (np.arange(len(data)) - starts[value_index]) * 7
+    # the 7-bit groups do not overlap: adding them is the same as or-ing them
+    groups = (data & 0x7F).astype(np.uint64) << shift.astype(np.uint64)
+    return np.add.reduceat(groups, starts)
+
+
+def zigzag_encode(values):
+    values = np.asarray(values, np.int64)
+    return ((values << 1) ^ (values >> 63)).view(np.uint64)
+
+
+def zigzag_decode(values):
+    values = np.asarray(values, np.uint64)
+    return (values >> np.uint64(1)).view(np.int64) ^ -(values & np.uint64(1)).view(np.int64)
+
+
+def encode_lut(node_lut, mask_id=None, node_order=None):
+    """
+    The function `encode_lut` encodes the node lookup table and the mask histogram of a submission.
+
+    :param node_lut: The segment id of each gt node
+    :param mask_id: The mask histogram `(segment_ids, voxel_counts)` or None
+    :param node_order: The order of the nodes in which the lookup table is encoded (optional)
+    :return: a tuple `(data, sections)` with the encoded bytes and the size of each section.
+    """
+    # signed ids are encoded through their two's complement
+    values = np.asarray(node_lut).astype(np.uint64)
+    if node_order is not None:
+        values = values[node_order]
+    mask_segment = np.zeros(0, np.uint64)
+    mask_count = np.zeros(0, np.int64)
+    if mask_id is not None:
+        order = np.argsort(np.asarray(mask_id[0]).astype(np.uint64), kind="stable")
+        mask_segment = np.asarray(mask_id[0]).astype(np.uint64)[order]
+        mask_count = np.asarray(mask_id[1], np.int64)[order]
+    dictionary = np.unique(np.concatenate([values, mask_segment]))
+    codes = np.searchsorted(dictionary, values).astype(np.int64)
+    mask_codes = np.searchsorted(dictionary, mask_segment).astype(np.int64)
+    sections = [
+        encode_varint(np.diff(dictionary, prepend=np.uint64(0))),
+        encode_varint(zigzag_encode(np.diff(codes, prepend=0))),
+        encode_varint(np.diff(mask_codes, prepend=0)),
+        encode_varint(mask_count),
+    ]
+    return b"".join(sections), [len(x) for x in sections]
+
+
+def decode_lut(data, sections, num_nodes, dtype, has_mask, node_order=None):
+    """
+    The function `decode_lut` decodes a record encoded by `encode_lut`.
+
+    :return: the node lookup table and the mask histogram (None if `has_mask` is False).
+    """
+    bounds = np.cumsum([0] + list(sections))
+    data = [data[bounds[i] : bounds[i + 1]] for i in range(len(sections))]
+    dictionary = np.cumsum(decode_varint(data[0]), dtype=np.uint64)
+    codes = np.cumsum(zigzag_decode(decode_varint(data[1])))
+    values = dictionary[codes].astype(dtype)
+    if node_order is not None:
+        node_lut = np.empty(num_nodes, dtype)
+        node_lut[node_order] = values
+    else:
+        node_lut = values
+    mask_id = None
+    if has_mask:
+        mask_codes = np.cumsum(decode_varint(data[2]).astype(np.int64))
+        mask_id = (
+            dictionary[mask_codes].astype(dtype),
+            decode_varint(data[3]).astype(np.int64),
+        )
+    return node_lut, mask_id
+
+
+class LutArchive:
+    # The LutArchive class stores the node lookup tables of many submissions in one compact file.
+    def __init__(self, path, node_order=None, codec=None):
+        """
+        :param path: The archive file. It is created if it does not exist
+        :param node_order: The order in which the lookup tables are encoded (a permutation of the gt
+        nodes), defaults to the gt node order. Only used when the archive is created (optional)
+        :param codec: "zstd" or "zlib" for the new records, defaults to zstd if available
+        """
+        self.path = path
+        self.codec = codec or ("zstd" if _get_zstd() is not None else "zlib")
+        self._node_order = None
+        if os.path.exists(path):
+            self.index = self._read_index()
+        else:
+            self.index = {"version": 1, "num_nodes": None, "node_order": None, "entries": {}}
+            with open(path, "wb") as fid:
+                fid.write(MAGIC)
+                if node_order is not None:
+                    node_order = np.asarray(node_order, np.int64)
+                    self.index["num_nodes"] = len(node_order)
+                    if np.any(node_order != np.arange(len(node_order))):
+                        self.index["node_order"] = self._write_record(
+                            fid,
+                            encode_varint(zigzag_encode(np.diff(node_order, prepend=0))),
+                        )
+                self._write_index(fid)
+
+    def _read_index(self):
+        with open(self.path, "rb") as fid:
+            if fid.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"not a lut archive: {self.path}")
+            fid.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, index_size, magic = FOOTER.unpack(fid.read(FOOTER.size))
+            if magic == MAGIC:
+                fid.seek(index_offset)
+                return json.loads(zlib.decompress(fid.read(index_size)))
+            # interrupted update: the last complete footer and its index
+            fid.seek(0)
+            data = fid.read()
+        end = len(data)
+        while True:
+            end = data.rfind(MAGIC, len(MAGIC), end)
+            if end < FOOTER.size - len(MAGIC):
+                raise ValueError(f"truncated lut archive: {self.path}")
+            footer_start = end + len(MAGIC) - FOOTER.size
+            index_offset, index_size, _ = FOOTER.unpack(
+                data[footer_start : end + len(MAGIC)]
+            )
+            if index_offset + index_size == footer_start:
+                try:
+                    return json.loads(
+                        zlib.decompress(data[index_offset:footer_start])
+                    )
+                except (zlib.error, ValueError):
+                    pass
+
+    def _write_index(self, fid):
+        # a new index (and footer) is written after the records at each update
+        data = zlib.compress(json.dumps(self.index).encode())
+        index_offset = fid.tell()
+        fid.write(data)
+        fid.write(FOOTER.pack(index_offset, len(data), MAGIC))
+        fid.truncate()
+        fid.flush()
+        os.fsync(fid.fileno())
+
+    def _write_record(self, fid, data):
+        data = compress(data, self.codec)
+        record = {"offset": fid.tell(), "size": len(data), "codec": self.codec}
+        fid.write(data)
+        return record
+
+    def _read_record(self, fid, record):
+        fid.seek(record["offset"])
+        return decompress(fid.read(record["size"]), record["codec"])
+
+    def get_node_order(self):
+        """
+        The function `get_node_order` returns the order in which the lookup tables are encoded.
+
+        :return: the node indices in the encoding order, or None for the original order.
+        """
+        if self._node_order is None and self.index["node_order"] is not None:
+            with open(self.path, "rb") as fid:
+                data = self._read_record(fid, self.index["node_order"])
+            self._node_order = np.cumsum(zigzag_decode(decode_varint(data)))
+        return self._node_order
+
+    def get_names(self):
+        """
+        The function `get_names` returns the names of the submissions in the order they are stored.
+        """
+        entries = self.index["entries"]
+        return sorted(entries, key=lambda name: entries[name]["offset"])
+
+    def __contains__(self, name):
+        return name in self.index["entries"]
+
+    def __len__(self):
+        return len(self.index["entries"])
+
+    def put(self, name, node_lut, mask_id=None, metadata=None):
+        """
+        The function `put` adds (or replaces) the lookup table of a submission. The record of a
+        replaced submission and the previous index are not reclaimed.
+
+        :param name: The name of the submission
+        :param node_lut: The segment id of each gt node
+        :param mask_id: The mask histogram `(segment_ids, voxel_counts)` or None
+        :param metadata: A json-compatible dictionary stored along (optional)
+        """
+        self.put_many([(name, node_lut, mask_id, metadata)])
+
+    def put_many(self, items):
+        """
+        The function `put_many` adds the lookup tables of several submissions, writing the index
+        once.
+
+        :param items: An iterable of `(name, node_lut, mask_id, metadata)` tuples (see `put`)
+        """
+        with open(self.path, "r+b") as fid:
+            # the new records are appended: the previous index stays valid until the new footer is
+            # written
+            fid.seek(0, os.SEEK_END)
+            try:
+                for name, node_lut, mask_id, metadata in items:
+                    node_lut = np.asarray(node_lut)
+                    if self.index["num_nodes"] is None:
+                        self.index["num_nodes"] = len(node_lut)
+                    if len(node_lut) != self.index["num_nodes"]:
+                        raise ValueError(
+                            f"{name}: {len(node_lut)} nodes instead of {self.index['num_nodes']}"
+                        )
+                    data, sections = encode_lut(node_lut, mask_id, self.get_node_order())
+                    record = self._write_record(fid, data)
+                    record.update(
+                        sections=sections,
+                        dtype=node_lut.dtype.str,
+                        has_mask=mask_id is not None,
+                        metadata=metadata or {},
+                    )
+                    self.index["entries"][name] = record
+            finally:
+                self._write_index(fid)
+
+    def get(self, name):
+        """
+        The function `get` reads the lookup table of a submission.
+
+        :param name: The name of the submission
+        :return: the node lookup table and the mask histogram (None if it was not stored).
+        """
+        with open(self.path, "rb") as fid:
+            return self._decode(fid, self.index["entries"][name])
+
+    def _decode(self, fid, record):
+        return decode_lut(
+            self._read_record(fid, record),
+            record["sections"],
+            self.index["num_nodes"],
+            np.dtype(record["dtype"]),
+            record["has_mask"],
+            self.get_node_order(),
+        )
+
+    def iter_items(self, names=None):
+        """
+        The function `iter_items` decodes the lookup tables of many submissions, reading the file
+        sequentially.
+
+        :param names: The names of the submissions, defaults to all
+        :return: a generator of `(name, node_lut, mask_id)` tuples in storage order.
+        """
+        entries = self.index["entries"]
+        names = self.get_names() if names is None else sorted(
+            names, key=lambda name: entries[name]["offset"]
+        )
+        with open(self.path, "rb") as fid:
+            for name in names:
+                yield (name,) + self._decode(fid, entries[name])
+
+
+def rank_archive(archive, gt_graph, merge_threshold=0, erl_intervals=None, names=None):
+    """
+    The function `rank_archive` scores the submissions of an archive against the gt.
+
+    :param archive: The `LutArchive`
+    :param gt_graph: The gt graph the lookup tables were computed for
+    :param merge_threshold: The minimum number of nodes (resp. mask voxels) of a false merge
+    :param erl_intervals: The skeleton length intervals of the ERL (optional)
+    :param names: The names of the submissions, defaults to all
+    :return: a dictionary mapping the submission names to their scores.
+    """
+    from eval_erl import (
+        aggregate_run_length,
+        find_merging_segments,
+        get_graph_edge_lengths,
+        score_skeleton_edges,
+    )
+    from relabel import count_pairs
+
+    # the graph arrays are computed once, each submission is scored edge-wise with numpy
+    node_skeleton, edges, edge_length = get_graph_edge_lengths(
+        gt_graph, "skeleton_id", "length", ["z", "y", "x"]
+    )
+    skeleton_ids = np.unique(node_skeleton)
+    edge_skeleton = node_skeleton[edges[:, 0]]
+    scores = {}
+    for name, node_lut, mask_id in archive.iter_items(names):
+        merging_segments = find_merging_segments(
+            *count_pairs(np.stack([node_skeleton, node_lut], axis=1)),
+            mask_id,
+            merge_threshold,
+        )
+        skeleton_scores = score_skeleton_edges(
+            skeleton_ids, edge_skeleton, edges, edge_length, node_lut, merging_segments
+        )
+        scores[name] = np.asarray(
+            aggregate_run_length(
+                skeleton_scores["length"], skeleton_scores["erl"], erl_intervals
+            )
+        ).tolist()
+    return scores
+
+
+def pack_npz_files(archive, paths):
+    """
+    The function `pack_npz_files` adds the lookup tables saved in npz files (e.g., the entries of a
+    `LutCache` folder) to an archive, named after the files.
+
+    :param archive: The `LutArchive`
+    :param paths: The npz files or folders of npz files
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += [
+                os.path.join(path, x)
+                for x in sorted(os.listdir(path))
+                if x.endswith(".npz") and ".tmp" not in x
+            ]
+        else:
+            filenames.append(path)
+
+    def read_items():
+        for filename in filenames:
+            with np.load(filename) as data:
+                mask_id = (
+                    (data["mask_id"], data["mask_count"]) if "mask_id" in data else None
+                )
+                name = os.path.splitext(os.path.basename(filename))[0]
+                yield name, data["node_lut"], mask_id, {"source": filename}
+
+    archive.put_many(read_items())
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Archive of node lookup tables to re-rank submissions"
+    )
+    parser.add_argument(
+        "-a",
+        "--archive-path",
+        type=str,
+        help="path to the archive",
+        required=True,
+    )
+    parser.add_argument(
+        "-g",
+        "--gt-stats-path",
+        type=str,
+        help="path to ground truth skeleton statistics",
+        required=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--pack",
+        type=str,
+        help="comma-separated npz files or folders (e.g., a lut cache) to add to the archive",
+        default="",
+    )
+    parser.add_argument(
+        "-mt",
+        "--merge-threshold",
+        type=int,
+        help="threshold number of voxels to be a false merge",
+        default=50,
+    )
+    parser.add_argument(
+        "-i",
+        "--erl-intervals",
+        type=str,
+        help="compute erl for each skeleton length interval",
+        default="",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        help="save the scores of all submissions as json",
+        default="",
+    )
+    args = parser.parse_args()
+    args.erl_intervals = (
+        [int(x) for x in args.erl_intervals.split("-")]
+        if "-" in args.erl_intervals
+        else None
+    )
+    return args
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    from test_axonEM import load_gt_stats
+
+    gt_graph, _, _ = load_gt_stats(args.gt_stats_path)
+    archive = LutArchive(args.archive_path)
+    if args.pack:
+        pack_npz_files(archive, args.pack.split(","))
+    scores = rank_archive(archive, gt_graph, args.merge_threshold, args.erl_intervals)
+    for name in sorted(scores, key=lambda name: -scores[name][0]):
+        print(f"{name}: {scores[name]}")
+    if args.output_path:
+        with open(args.output_path, "w") as fid:
+            json.dump(scores, fid)
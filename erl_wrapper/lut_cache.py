@@ -0,0 +1,224 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from data_io import iter_raw_chunks_h5, get_volume_info
+
+# cache of compute_segment_lut results keyed by the content of the prediction and the gt,
+# so that re-scoring a submission (e.g., other merge_threshold or erl_intervals) does not
+# read the prediction volume again
+
+
+def get_file_fingerprint(filename, block_size=2**24):
+    """
+    The function `get_file_fingerprint` hashes the content of a file.
+
+    :param filename: The name of the file
+    :param block_size: The number of bytes hashed at a time
+    :return: the hex digest of the file content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as fid:
+        while True:
+            block = fid.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_folder_files(path):
+    """
+    The function `get_folder_files` lists the files of a folder (e.g., a zarr/n5 store) recursively.
+
+    :param path: The folder
+    :return: the sorted list of `(relative_path, size, mtime_ns)` of its files.
+    """
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            files.append(
+                (
+                    os.path.relpath(os.path.join(root, name), path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                )
+            )
+    return sorted(files)
+
+
+def get_folder_fingerprint(path):
+    """
+    The function `get_folder_fingerprint` hashes the names and contents of the files of a folder.
+
+    :param path: The folder
+    :return: the hex digest of the folder content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for relative_path, _, _ in get_folder_files(path):
+        digest.update(relative_path.encode())
+        digest.update(bytes.fromhex(get_file_fingerprint(os.path.join(path, relative_path))))
+    return digest.hexdigest()
+
+
+def get_dataset_fingerprint(filename, dataset_name=None):
+    """
+    The function `get_dataset_fingerprint` hashes an HDF5 dataset from its shape, dtype and stored
+    chunks. Unlike the file hash, it ignores the other datasets and the metadata of the file.
+
+    :param filename: The name of the HDF5 file
+    :param dataset_name: The name of the dataset. If it is not provided, the first dataset is used
+    :return: the hex digest of the dataset.
+    """
+    shape, dtype, chunks = get_volume_info(filename, dataset_name)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([shape, dtype.str, chunks]).encode())
+    # a contiguous dataset is one chunk read in pieces
+    chunk_digests = {}
+    for offset, filter_mask, raw_bytes in iter_raw_chunks_h5(filename, dataset_name):
+        if offset not in chunk_digests:
+            chunk_digests[offset] = (filter_mask, hashlib.blake2b(digest_size=16))
+        chunk_digests[offset][1].update(raw_bytes)
+    # chunks are sorted by their offset: the storage order does not matter
+    chunk_digests = sorted(
+        (offset, filter_mask, chunk_digest.digest())
+        for offset, (filter_mask, chunk_digest) in chunk_digests.items()
+    )
+    for offset, filter_mask, chunk_digest in chunk_digests:
+        digest.update(np.array(offset + (filter_mask,), np.int64).tobytes())
+        digest.update(chunk_digest)
+    return digest.hexdigest()
+
+
+class LutCache:
+    # The LutCache class stores node lookup tables and mask histograms on disk with LRU eviction.
+    def __init__(self, cache_dir, max_bytes=2**32, mode="dataset"):
+        """
+        :param cache_dir: The folder of the cache
+        :param max_bytes: The maximum size of the cached entries
+        :param mode: The fingerprint of h5 predictions: "dataset" (stored chunks and shape/dtype)
+        or "file" (whole file content)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mode = mode
+        os.makedirs(cache_dir, exist_ok=True)
+        # fingerprints of unchanged files (same path, size and mtime) are not recomputed
+        self._fingerprint_path = os.path.join(cache_dir, "fingerprints.json")
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self._fingerprint_path):
+            with open(self._fingerprint_path, "r") as fid:
+                self._fingerprints = json.load(fid)
+
+    def get_fingerprint(self, filename):
+        """
+        The function `get_fingerprint` returns the (memoized) content fingerprint of a file.
+
+        :param filename: The name of the file
+        :return: the fingerprint as a hex string.
+        """
+        if os.path.isdir(filename):
+            # zarr/n5 store: the folder changes with any of its files
+            files = get_folder_files(filename)
+            mode = "folder"
+            size = sum(x[1] for x in files)
+            mtime = max([x[2] for x in files], default=0)
+        else:
+            stat = os.stat(filename)
+            mode = self.mode if ".h5" in filename else "file"
+            size = stat.st_size
+            mtime = stat.st_mtime_ns
+        memo_key = json.dumps([os.path.abspath(filename), size, mtime, mode])
+        if memo_key not in self._fingerprints:
+            if mode == "dataset":
+                fingerprint = get_dataset_fingerprint(filename)
+            elif mode == "folder":
+                fingerprint = get_folder_fingerprint(filename)
+            else:
+                fingerprint = get_file_fingerprint(filename)
+            with self._lock:
+                self._fingerprints[memo_key] = fingerprint
+                tmp_path = self._fingerprint_path + f".{os.getpid()}.tmp"
+                with open(tmp_path, "w") as fid:
+                    json.dump(self._fingerprints, fid)
+                os.replace(tmp_path, self._fingerprint_path)
+        return self._fingerprints[memo_key]
+
+    def get_key(self, pred_seg_path, gt_stats_path, gt_mask_path=None):
+        """
+        The function `get_key` combines the fingerprints of the prediction and the gt bundle.
+
+        :param pred_seg_path: The path to the prediction
+        :param gt_stats_path: The path to the gt statistics (the version of the gt graph)
+        :param gt_mask_path: The path to the gt mask, if it is not part of the gt statistics
+        :return: the cache key.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        # not shared with the entries of uint64 predictions truncated to uint32 (before relabeling)
+        digest.update(b"relabel")
+        for filename in [pred_seg_path, gt_stats_path, gt_mask_path]:
+            digest.update(
+                b"none" if filename is None else self.get_fingerprint(filename).encode()
+            )
+        return digest.hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """
+        The function `get` looks up a cached entry.
+
+        :param key: The cache key
+        :return: the node lookup table and the mask histogram (None if there is no mask), or None if
+        the entry is not cached.
+        """
+        path = self._get_path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            node_lut = data["node_lut"]
+            mask_id = (
+                (data["mask_id"], data["mask_count"]) if "mask_id" in data else None
+            )
+        # mark as recently used
+        os.utime(path)
+        return node_lut, mask_id
+
+    def put(self, key, node_lut, mask_id=None):
+        """
+        The function `put` stores an entry and evicts the least recently used entries above the size
+        limit.
+
+        :param key: The cache key
+        :param node_lut: The node lookup table
+        :param mask_id: The mask histogram `(segment_ids, voxel_counts)` or None
+        """
+        data = {"node_lut": node_lut}
+        if mask_id is not None:
+            data["mask_id"], data["mask_count"] = mask_id
+        # write to a temporary file first: concurrent readers never see a partial entry
+        tmp_path = self._get_path(key) + f".{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp_path, **data)
+        os.replace(tmp_path, self._get_path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        The function `evict` removes the least recently used entries until the cache fits into
+        `max_bytes`.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz") and ".tmp" not in name:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(x[1] for x in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
@@ -0,0 +1,194 @@
+import argparse
+import numpy as np
+from data_io import read_vol, read_pkl, write_pkl, get_volume_info, plan_slabs
+
+# precompute the gt mask as run-length encoded voxel offsets, so that the mask volume
+# is read once during gt preparation instead of once per evaluated submission
+
+
+class MaskIndex:
+    # The MaskIndex class stores a binary mask as runs of foreground voxels per z-slice.
+    def __init__(self):
+        self.shape = None
+        # offset of the first voxel of each run within its z-slice (flattened yx)
+        self.run_start = None
+        self.run_length = None
+        # runs of z-slice z: run_start[z_offsets[z] : z_offsets[z + 1]]
+        self.z_offsets = None
+
+    def load_volume(self, mask, memory_budget=None):
+        """
+        The function `load_volume` run-length encodes a mask volume slab by slab.
+
+        :param mask: either a 3D volume or the name of a file containing the mask
+        :param memory_budget: The maximum number of bytes used to hold one slab of the mask when it
+        is read from a file (optional)
+        """
+        if isinstance(mask, str):
+            shape, dtype, chunks = get_volume_info(mask)
+            # the slab, its boolean copy and the padded run boundaries
+            plane_bytes = (dtype.itemsize + 3) * int(np.prod(shape[1:]))
+            slabs = plan_slabs(
+                shape[0],
+                plane_bytes,
+                memory_budget,
+                chunks[0] if chunks is not None else 1,
+            )
+        else:
+            shape = mask.shape
+            slabs = [[0, shape[0]]]
+        self.shape = tuple(shape)
+        plane_size = int(np.prod(shape[1:]))
+        offset_dtype = np.uint32 if plane_size < 2**32 else np.uint64
+
+        run_start = [None] * len(slabs)
+        run_length = [None] * len(slabs)
+        run_count = np.zeros(shape[0], np.int64)
+        for slab_id, (start_z, last_z) in enumerate(slabs):
+            if isinstance(mask, str):
+                mask_z = read_vol(mask, None, z_range=[start_z, last_z])
+            else:
+                mask_z = mask[start_z:last_z]
+            mask_z = (mask_z > 0).reshape(last_z - start_z, plane_size)
+            # run boundaries: +1 at the start of a run, -1 one voxel past its end
+            border = np.diff(
+                np.pad(mask_z.view(np.int8), ((0, 0), (1, 1))), axis=1
+            )
+            start_zz, start_yx = np.nonzero(border == 1)
+            _, end_yx = np.nonzero(border == -1)
+            run_start[slab_id] = start_yx.astype(offset_dtype)
+            run_length[slab_id] = (end_yx - start_yx).astype(np.uint32)
+            run_count[start_z:last_z] = np.bincount(
+                start_zz, minlength=last_z - start_z
+            )
+        self.run_start = np.concatenate(run_start)
+        self.run_length = np.concatenate(run_length)
+        self.z_offsets = np.concatenate([[0], np.cumsum(run_count)])
+
+    def get_num_voxels(self, start_z=0, last_z=None):
+        """
+        The function `get_num_voxels` returns the number of mask voxels within a z-range.
+
+        :param start_z: The first z-slice, defaults to 0
+        :param last_z: The z-slice after the last one, defaults to the end of the volume
+        :return: the number of foreground voxels.
+        """
+        last_z = self.shape[0] if last_z is None else last_z
+        run_range = slice(self.z_offsets[start_z], self.z_offsets[last_z])
+        return int(self.run_length[run_range].sum(dtype=np.int64))
+
+    def get_max_plane_voxels(self):
+        """
+        The function `get_max_plane_voxels` returns the largest number of mask voxels in one z-slice.
+        """
+        cumsum = np.concatenate([[0], np.cumsum(self.run_length, dtype=np.int64)])
+        return int(np.diff(cumsum[self.z_offsets]).max(initial=0))
+
+    def get_voxel_index(self, start_z, last_z):
+        """
+        The function `get_voxel_index` expands the runs of a z-range into flat voxel offsets.
+
+        :param start_z: The first z-slice of the slab
+        :param last_z: The z-slice after the last one of the slab
+        :return: the flat offsets of the mask voxels relative to the slab, in C order.
+        """
+        run_range = slice(self.z_offsets[start_z], self.z_offsets[last_z])
+        run_length = self.run_length[run_range].astype(np.int64)
+        if len(run_length) == 0:
+            return np.zeros(0, np.int64)
+        # add back the offset of the z-slice of each run
+        run_z = np.repeat(
+            np.arange(last_z - start_z, dtype=np.int64),
+            np.diff(self.z_offsets[start_z : last_z + 1]),
+        )
+        plane_size = int(np.prod(self.shape[1:]))
+        run_start = self.run_start[run_range].astype(np.int64) + run_z * plane_size
+        # start of each run, minus the number of voxels in all previous runs
+        run_cumsum = np.cumsum(run_length)
+        index = np.repeat(run_start - (run_cumsum - run_length), run_length)
+        return index + np.arange(run_cumsum[-1], dtype=np.int64)
+
+    def decode(self, start_z=0, last_z=None):
+        """
+        The function `decode` expands the runs of a z-range back into a binary volume.
+
+        :param start_z: The first z-slice, defaults to 0
+        :param last_z: The z-slice after the last one, defaults to the end of the volume
+        :return: a boolean volume of the z-slices `[start_z, last_z)`.
+        """
+        last_z = self.shape[0] if last_z is None else last_z
+        mask = np.zeros((last_z - start_z,) + self.shape[1:], bool)
+        mask.reshape(-1)[self.get_voxel_index(start_z, last_z)] = True
+        return mask
+
+    def gather(self, segment, start_z=0):
+        """
+        The function `gather` returns the values of a slab at the mask voxels, in the same order as
+        `segment[mask[start_z : start_z + len(segment)] > 0]`.
+
+        :param segment: A 3D volume covering the z-slices `[start_z, start_z + len(segment))`
+        :param start_z: The z-slice of the volume where the slab starts, defaults to 0
+        :return: a 1D array of values.
+        """
+        assert tuple(segment.shape[1:]) == self.shape[1:]
+        index = self.get_voxel_index(start_z, start_z + segment.shape[0])
+        return np.ascontiguousarray(segment).reshape(-1)[index]
+
+
+def add_mask_index(gt_stats_path, mask_path, output_path=None, memory_budget=None):
+    """
+    The function `add_mask_index` stores the mask index next to the gt graph and resolution of a
+    precomputed gt statistics file.
+
+    :param gt_stats_path: The path to the gt statistics file ([gt_graph, gt_res, ...])
+    :param mask_path: The path to the gt no-background mask volume
+    :param output_path: The path to the output statistics file, defaults to `gt_stats_path`
+    :param memory_budget: The maximum number of bytes used to hold one slab of the mask (optional)
+    """
+    gt_stats = read_pkl(gt_stats_path)
+    mask_index = MaskIndex()
+    mask_index.load_volume(mask_path, memory_budget)
+    # keep the other precomputed statistics (e.g., the node layout)
+    extras = [x for x in gt_stats[2:] if not isinstance(x, MaskIndex)]
+    write_pkl(
+        gt_stats_path if output_path is None else output_path,
+        gt_stats[:2] + [mask_index] + extras,
+    )
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Add the precomputed mask index to the gt skeleton statistics"
+    )
+    parser.add_argument(
+        "-g",
+        "--gt-stats-path",
+        type=str,
+        help="path to ground truth skeleton statistics",
+        required=True,
+    )
+    parser.add_argument(
+        "-m",
+        "--gt-mask-path",
+        type=str,
+        help="path to ground truth no-background mask",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        help="output path (default: overwrite the gt skeleton statistics)",
+        default=None,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # python mask_index.py -g gt_human_32nm_skel_stats.p -m gt_human_32nm_mask.h5
+    # the MaskIndex is pickled from the mask_index module, not from __main__, so that the gt file
+    # can be loaded by the other modules
+    from mask_index import add_mask_index
+
+    args = get_arguments()
+    add_mask_index(args.gt_stats_path, args.gt_mask_path, args.output_path)
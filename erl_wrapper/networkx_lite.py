@@ -1,6 +1,5 @@
 import argparse
 import numpy as np
-import scipy.sparse as sp
 from data_io import read_pkl, write_pkl
 
 # implement a light-weight networkx graph like class with npz backend
@@ -8,10 +7,59 @@ from data_io import read_pkl, write_pkl
 # skeletons.nodes()
 # skeletons.nodes(data=True)
 # skeletons.nodes[n][attr]
+# skeletons.nodes.column(attr)
 # skeletons.edges()
 # skeletons.edges[e][attr]
 # skeletons.edges(data=True)
 # return u, v, data, where data is a dict of edge attributes which can be SET
+# scipy.sparse is imported by the methods building the edge matrix, so that importing this module
+# (e.g., for the evaluation entry point) stays cheap
+
+
+# each node attribute is stored as a typed column: uint32 skeleton ids and coordinates (physical
+# unit), so that large volumes (e.g., j0126) fit and the evaluation reads whole attributes at once
+# skeletons.nodes.column("skeleton_id")
+NODE_DTYPES = {"skeleton_id": np.uint32, "z": np.uint32, "y": np.uint32, "x": np.uint32}
+
+
+def get_node_dtypes(node_attributes, node_dtype=None):
+    """
+    The function `get_node_dtypes` returns the data type of each node attribute.
+
+    :param node_attributes: The names of the node attributes
+    :param node_dtype: Either one data type for all the attributes or a dictionary mapping attributes
+    to their data type. The attributes not given get their type from `NODE_DTYPES` (uint32 by
+    default)
+    :return: a dictionary mapping each attribute to its data type.
+    """
+    if node_dtype is not None and not isinstance(node_dtype, dict):
+        node_dtype = {key: node_dtype for key in node_attributes}
+    node_dtype = node_dtype or {}
+    return {
+        key: np.dtype(node_dtype.get(key, NODE_DTYPES.get(key, np.uint32)))
+        for key in node_attributes
+    }
+
+
+def to_column(values, dtype, key=None):
+    """
+    The function `to_column` converts the values of a node attribute to its data type, checking
+    that integer values fit into it.
+
+    :param values: The values of the attribute, one per node
+    :param dtype: The data type of the attribute
+    :param key: The name of the attribute, for the error message (optional)
+    :return: the column as a 1D array.
+    """
+    values = np.asarray(values).ravel()
+    if np.issubdtype(dtype, np.integer) and len(values) > 0:
+        info = np.iinfo(dtype)
+        if values.min() < info.min or values.max() > info.max:
+            raise OverflowError(
+                f"node attribute {key}: [{values.min()}, {values.max()}] does not fit into "
+                f"{np.dtype(dtype).name}"
+            )
+    return values.astype(dtype, copy=False)
 
 
 class NetworkXGraphLite:
@@ -20,28 +68,54 @@ class NetworkXGraphLite:
         self,
         node_attributes=["skeleton_id", "z", "y", "x"],
         edge_attribute="length",
-        node_dtype=np.uint16,
+        node_dtype=None,
         edge_dtype=np.float32,
     ):
+        """
+        :param node_attributes: The names of the node attributes
+        :param edge_attribute: The name of the edge attribute
+        :param node_dtype: Either one data type for all the node attributes or a dictionary mapping
+        attributes to their data type, defaults to `NODE_DTYPES`
+        :param edge_dtype: The data type of the edge attribute
+        """
         self.node_attributes = sorted(node_attributes)
-        self.node_dtype = node_dtype
+        self.node_dtypes = get_node_dtypes(self.node_attributes, node_dtype)
         # since edges will be saved as 2D dok matrix, can only take single attribute
         assert isinstance(edge_attribute, str)
         self.edge_attribute = edge_attribute
         self.edge_dtype = edge_dtype
 
-        self._nodes = None  # will be saved as [N, #node_attributes] npz
+        self._columns = None  # attribute -> [N] array, will be saved as npz
         self._edges = None  # will be saved as dok npz
 
         self.nodes = None
         self.edges = None
 
+    def __setstate__(self, state):
+        # graphs pickled before the typed columns hold one [N, #node_attributes] uint16 matrix
+        if "_nodes" in state:
+            nodes = state.pop("_nodes")
+            state.pop("node_dtype", None)
+            state["node_dtypes"] = get_node_dtypes(state["node_attributes"])
+            state["_columns"] = None
+            if nodes is not None:
+                state["_columns"] = {
+                    key: to_column(nodes[:, i], state["node_dtypes"][key], key)
+                    for i, key in enumerate(state["node_attributes"])
+                }
+        self.__dict__.update(state)
+        if self._columns is not None and self._edges is not None:
+            self.init_viewers()
+
+    def __len__(self):
+        return len(self._columns[self.node_attributes[0]])
+
     def init_viewers(self):
         """
         The function initializes viewers for nodes and edges.
         """
-        assert self._nodes is not None
-        self.nodes = NodeViewerLite(self._nodes, self.node_attributes)
+        assert self._columns is not None
+        self.nodes = NodeViewerLite(self._columns, self.node_attributes)
         assert self._edges is not None
         self.edges = EdgeViewerLite(self._edges, self.edge_attribute)
 
@@ -53,28 +127,24 @@ class NetworkXGraphLite:
         :param graph: The `graph` parameter is an object that represents a graph. It contains
         information about the nodes and edges of the graph
         """
+        import scipy.sparse as sp
+
         assert len(graph.nodes) > 0
         # assert every node has the same attributes
         assert list(graph.nodes) == list(range(len(graph.nodes)))
 
         nodes = {key: [] for key in self.node_attributes}
-
-        minval = np.inf
-        maxval = 0
         for node in graph.nodes:
             node = graph.nodes[node]
             for key in self.node_attributes:
                 assert key in node
                 nodes[key].append(node[key])
-                maxval = max(maxval, node[key])
-                minval = min(minval, node[key])
-        assert minval >= np.iinfo(self.node_dtype).min
-        assert maxval <= np.iinfo(self.node_dtype).max
         assert len({len(nodes[key]) for key in nodes}) == 1
 
-        self._nodes = np.stack(
-            [np.array(nodes[key]) for key in self.node_attributes], axis=1
-        ).astype(self.node_dtype)
+        self._columns = {
+            key: to_column(nodes[key], self.node_dtypes[key], key)
+            for key in self.node_attributes
+        }
 
         edges = sp.dok_matrix(
             (len(graph.nodes), len(graph.nodes)), dtype=self.edge_dtype
@@ -88,42 +158,168 @@ class NetworkXGraphLite:
         self._edges = edges
         self.init_viewers()
 
+    def load_arrays(self, nodes, edges, edge_values=None):
+        """
+        The function `load_arrays` loads the graph directly from arrays, without building a networkx
+        graph first.
+
+        :param nodes: A dictionary mapping each node attribute to an array with one value per node
+        :param edges: An array of shape (E, 2) with the node indices of each edge
+        :param edge_values: An optional array with the value of the edge attribute for each edge. If
+        not given, the edge attribute is set to -1 (i.e., to be computed)
+        """
+        import scipy.sparse as sp
+
+        for key in self.node_attributes:
+            assert key in nodes
+        self._columns = {
+            key: to_column(nodes[key], self.node_dtypes[key], key)
+            for key in self.node_attributes
+        }
+        assert len({len(x) for x in self._columns.values()}) == 1
+        num_node = len(self)
+
+        edges = np.sort(np.asarray(edges), axis=1)
+        if edge_values is None:
+            edge_values = -np.ones(len(edges), self.edge_dtype)
+        self._edges = sp.coo_matrix(
+            (np.asarray(edge_values, self.edge_dtype), (edges[:, 0], edges[:, 1])),
+            shape=(num_node, num_node),
+        ).todok()
+        self.init_viewers()
+
+    def set_edge_values(self, edges, edge_values):
+        """
+        The function `set_edge_values` sets the edge attribute of all the edges at once.
+
+        :param edges: The node indices of each edge (E, 2), e.g., from `get_graph_arrays`
+        :param edge_values: The value of the edge attribute for each edge (E)
+        """
+        import scipy.sparse as sp
+
+        edges = np.sort(np.asarray(edges), axis=1)
+        self._edges = sp.coo_matrix(
+            (np.asarray(edge_values, self.edge_dtype), (edges[:, 0], edges[:, 1])),
+            shape=self._edges.shape,
+        ).todok()
+        self.init_viewers()
+
+    def reorder_nodes(self, order):
+        """
+        The function `reorder_nodes` permutes the nodes and remaps the edges accordingly.
+
+        :param order: The old index of each node in the new order (a permutation of the nodes)
+        """
+        import scipy.sparse as sp
+
+        order = np.asarray(order)
+        new_index = np.empty(len(order), np.int64)
+        new_index[order] = np.arange(len(order))
+        self._columns = {key: value[order] for key, value in self._columns.items()}
+        edges = self._edges.tocoo()
+        # edges are stored as (smaller index, larger index)
+        index = np.sort(
+            np.stack([new_index[edges.row], new_index[edges.col]], axis=1), axis=1
+        )
+        self._edges = sp.coo_matrix(
+            (edges.data, (index[:, 0], index[:, 1])), shape=edges.shape
+        ).todok()
+        self.init_viewers()
+
     def load_npz(self, node_npz_file, edge_npz_file):
         """
         The function `load_npz` loads node and edge data from npz files and initializes viewers.
 
         :param node_npz_file: The parameter `node_npz_file` is the file path to the .npz file that
-        contains the data for the nodes
+        contains the data for the nodes (one array per attribute, or the [N, #node_attributes]
+        matrix of the files saved before the typed columns)
         :param edge_npz_file: The `edge_npz_file` parameter is a file path to a NumPy compressed sparse
         matrix file (.npz) that contains the edge data
         """
-        self._nodes = np.load(node_npz_file)["data"]
+        import scipy.sparse as sp
+
+        with np.load(node_npz_file) as data:
+            if "data" in data:
+                nodes = data["data"]
+                self._columns = {
+                    key: to_column(nodes[:, i], self.node_dtypes[key], key)
+                    for i, key in enumerate(self.node_attributes)
+                }
+            else:
+                self._columns = {key: data[key] for key in self.node_attributes}
+                self.node_dtypes = {
+                    key: value.dtype for key, value in self._columns.items()
+                }
         self._edges = sp.load_npz(edge_npz_file).todok()
         self.init_viewers()
 
     def save_npz(self, node_npz_file, edge_npz_file):
-        assert self._nodes is not None
+        import scipy.sparse as sp
+
+        assert self._columns is not None
         assert self._edges is not None
-        np.savez_compressed(node_npz_file, data=self._nodes)
+        np.savez_compressed(node_npz_file, **self._columns)
         sp.save_npz(edge_npz_file, self._edges.tocoo())
 
 
+def get_graph_arrays(skeletons, skeleton_id_attribute, edge_length_attribute):
+    """
+    The function `get_graph_arrays` returns the skeleton ids of the nodes and the edges as arrays,
+    for the vectorized evaluation.
+
+    :param skeletons: A networkx-like graph
+    :param skeleton_id_attribute: The name of the node attribute containing the skeleton ID
+    :param edge_length_attribute: The name of the edge attribute for the length of an edge
+    :return: the skeleton id of each node (N), the node indices of each edge (E, 2) and the length of
+    each edge (E).
+    """
+    if isinstance(skeletons, NetworkXGraphLite):
+        node_skeleton = skeletons.nodes.column(skeleton_id_attribute)
+        edges = skeletons._edges.tocoo()
+        return (
+            node_skeleton,
+            np.stack([edges.row, edges.col], axis=1).astype(np.int64),
+            edges.data,
+        )
+    node_skeleton = np.array(
+        [data[skeleton_id_attribute] for _, data in skeletons.nodes(data=True)]
+    )
+    edges = [(u, v, data[edge_length_attribute]) for u, v, data in skeletons.edges(data=True)]
+    return (
+        node_skeleton,
+        np.array([x[:2] for x in edges], np.int64).reshape(-1, 2),
+        np.array([x[2] for x in edges]),
+    )
+
+
 # The NodeViewerLite class is a simplified version of a node viewer.
 class NodeViewerLite:
-    def __init__(self, nodes, node_attributes):
-        self._nodes = nodes
+    def __init__(self, columns, node_attributes):
+        self._columns = columns
         self._node_attributes = node_attributes
 
+    def __len__(self):
+        return len(self._columns[self._node_attributes[0]])
+
     def __getitem__(self, key):
-        node = self._nodes[key]
-        return {key: node[i] for i, key in enumerate(self._node_attributes)}
+        return {name: self._columns[name][key] for name in self._node_attributes}
 
     def __call__(self, data=False):
         if not data:
-            return range(len(self._nodes))
+            return range(len(self))
         else:
             # return generator, not instantiated list
-            return ((i, self[i]) for i in range(len(self._nodes)))
+            return ((i, self[i]) for i in range(len(self)))
+
+    def column(self, name):
+        """
+        The function `column` returns the values of a node attribute for all the nodes, without
+        building a dictionary per node.
+
+        :param name: The name of the node attribute
+        :return: the column (N) in the data type of the attribute.
+        """
+        return self._columns[name]
 
 
 # The EdgeViewerLite class is a lightweight viewer for displaying edges.
@@ -0,0 +1,160 @@
+import argparse
+import numpy as np
+from data_io import read_pkl, write_pkl
+from chains import SkeletonChains
+
+# reorder the gt nodes by z-slice, then along a Morton (z-order) curve within each slice, so
+# that each slab of the prediction looks up a contiguous range of nodes with nearby voxels.
+# the per-slice node offsets are stored next to the gt graph (slabs and h5 chunks are z-ranges)
+
+
+def morton_code(y, x):
+    """
+    The function `morton_code` interleaves the bits of two 32-bit coordinates.
+
+    :param y: The first coordinate (bits at odd positions)
+    :param x: The second coordinate (bits at even positions)
+    :return: the Morton code of each point as uint64.
+    """
+    code = np.zeros(np.broadcast(y, x).shape, np.uint64)
+    for value, shift in [(np.asarray(x, np.uint64), 0), (np.asarray(y, np.uint64), 1)]:
+        if value.size > 0 and value.max() >= 2**32:
+            raise OverflowError("the Morton code only interleaves 32-bit coordinates")
+        # spread the 32 bits of value to every other bit
+        value = (value | (value << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+        value = (value | (value << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+        value = (value | (value << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        value = (value | (value << np.uint64(2))) & np.uint64(0x3333333333333333)
+        value = (value | (value << np.uint64(1))) & np.uint64(0x5555555555555555)
+        code |= value << np.uint64(shift)
+    return code
+
+
+def get_node_order(node_position):
+    """
+    The function `get_node_order` sorts the nodes by z-slice, then by the Morton code of their yx
+    position.
+
+    :param node_position: The voxel position of each node (N, 3) in zyx order
+    :return: the node indices in the new order.
+    """
+    node_position = np.asarray(node_position, np.uint64)
+    code = morton_code(node_position[:, 1], node_position[:, 2])
+    # the last key is the primary one
+    return np.lexsort((code, node_position[:, 0]))
+
+
+class NodeLayout:
+    # The NodeLayout class stores the node range of each z-slice of z-sorted gt nodes.
+    def __init__(self, node_z=None):
+        """
+        :param node_z: The z-slice of each node, sorted (optional)
+        """
+        self.order = "morton"
+        # nodes of z-slice z: z_offsets[z] : z_offsets[z + 1]
+        self.z_offsets = None
+        if node_z is not None:
+            node_z = np.asarray(node_z)
+            assert np.all(np.diff(node_z.astype(np.int64)) >= 0)
+            num_z = int(node_z.max()) + 1 if len(node_z) > 0 else 0
+            self.z_offsets = np.searchsorted(node_z, np.arange(num_z + 1))
+
+    def get_node_range(self, start_z, last_z):
+        """
+        The function `get_node_range` returns the nodes of a z-range.
+
+        :param start_z: The first z-slice
+        :param last_z: The z-slice after the last one
+        :return: the slice of the node indices.
+        """
+        num_z = len(self.z_offsets) - 1
+        return slice(
+            int(self.z_offsets[min(start_z, num_z)]),
+            int(self.z_offsets[min(last_z, num_z)]),
+        )
+
+    def downsample(self, factor):
+        """
+        The function `downsample` returns the layout of the same nodes for z-slices downsampled by a
+        factor, i.e., with the node z-slices divided by `factor`.
+
+        :param factor: The downsampling factor along z
+        :return: a new `NodeLayout`.
+        """
+        num_z = len(self.z_offsets) - 1
+        num_slices = -(-num_z // factor)
+        layout = NodeLayout()
+        layout.order = self.order
+        layout.z_offsets = self.z_offsets[
+            np.minimum(np.arange(num_slices + 1) * factor, num_z)
+        ]
+        return layout
+
+
+def reorder_gt_graph(gt_graph, gt_res):
+    """
+    The function `reorder_gt_graph` reorders the nodes of a lite gt graph in place.
+
+    :param gt_graph: The ground truth graph (`NetworkXGraphLite`, node position in physical unit)
+    :param gt_res: The voxel resolution (zyx order)
+    :return: the `NodeLayout` of the reordered nodes and the node order (old index of each node).
+    """
+    node_position = (
+        np.stack([gt_graph.nodes.column(x) for x in ["z", "y", "x"]], axis=1) // gt_res
+    ).astype(np.int64)
+    order = get_node_order(node_position)
+    gt_graph.reorder_nodes(order)
+    return NodeLayout(node_position[order, 0]), order
+
+
+def add_node_layout(gt_stats_path, output_path=None):
+    """
+    The function `add_node_layout` reorders the nodes of a precomputed gt statistics file and stores
+    their layout next to the gt graph, resolution and (optional) mask index. The precomputed skeleton
+    chains (chains.py) are remapped to the new node order.
+
+    :param gt_stats_path: The path to the gt statistics file ([gt_graph, gt_res, ...])
+    :param output_path: The path to the output statistics file, defaults to `gt_stats_path`
+    """
+    gt_stats = read_pkl(gt_stats_path)
+    gt_graph, gt_res = gt_stats[:2]
+    node_layout, order = reorder_gt_graph(gt_graph, gt_res)
+    extras = [x for x in gt_stats[2:] if not isinstance(x, NodeLayout)]
+    for extra in extras:
+        if isinstance(extra, SkeletonChains):
+            extra.reorder_nodes(order)
+    write_pkl(
+        gt_stats_path if output_path is None else output_path,
+        [gt_graph, gt_res] + extras + [node_layout],
+    )
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Reorder the gt skeleton nodes for cache-friendly lookups"
+    )
+    parser.add_argument(
+        "-g",
+        "--gt-stats-path",
+        type=str,
+        help="path to ground truth skeleton statistics",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-path",
+        type=str,
+        help="output path (default: overwrite the gt skeleton statistics)",
+        default=None,
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # python node_layout.py -g gt_human_32nm_skel_stats.p
+    # the NodeLayout is pickled from the node_layout module, not from __main__, so that the gt file
+    # can be loaded by the other modules
+    from node_layout import add_node_layout
+
+    args = get_arguments()
+    add_node_layout(args.gt_stats_path, args.output_path)
@@ -0,0 +1,399 @@
+import os
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from data_io import read_pkl, write_pkl, mkdir, parse_memory_size
+from eval_erl import (
+    compute_segment_lut,
+    get_graph_edge_lengths,
+    find_merging_segments,
+    score_skeleton_edges,
+    aggregate_run_length,
+)
+from relabel import count_pairs
+
+# partitioned ERL evaluation for gt graphs too large for one process:
+# once the merging segments are known, the skeletons are scored independently
+# phase 1 (global, cheap): the (skeleton, segment) contingency of the nodes gives the merging
+#   segments, the skeletons are split into partitions of balanced number of edges and the
+#   self-contained input of each partition is built (edges, lengths, segments of its nodes)
+# phase 2 (parallel): each partition returns its per-skeleton length, run length and edge counts
+# reduce: the per-skeleton arrays are concatenated and aggregated into the erl
+#
+# local: partitioned_run_length(gt_graph, "skeleton_id", "length", node_segment_lut, num_workers=8)
+# job array (files in a shared folder):
+# python partition.py -st prepare -g gt_stats.p -s pred.h5 -m mask.h5 -n 100 -o work/
+# python partition.py -st score -o work/ --job $SLURM_ARRAY_TASK_ID,$SLURM_ARRAY_TASK_COUNT
+# python partition.py -st reduce -o work/ -i 0-20000-40000-150000
+
+
+def get_skeleton_partition(skeleton_ids, num_edges, num_partitions):
+    """
+    The function `get_skeleton_partition` splits the skeletons into ranges of ids with a balanced
+    number of edges.
+
+    :param skeleton_ids: The sorted skeleton ids
+    :param num_edges: The number of edges of each skeleton
+    :param num_partitions: The number of partitions
+    :return: the partition index of each skeleton.
+    """
+    edges_before = np.cumsum(num_edges) - num_edges
+    total = max(int(np.sum(num_edges)), 1)
+    return np.minimum(edges_before * num_partitions // total, num_partitions - 1).astype(
+        np.int64
+    )
+
+
+def get_partition_inputs(
+    skeletons,
+    skeleton_id_attribute,
+    edge_length_attribute,
+    node_segment_lut,
+    mask_segment_id=None,
+    merge_threshold=0,
+    num_partitions=1,
+    skeleton_position_attributes=None,
+):
+    """
+    The function `get_partition_inputs` is the global phase of the partitioned evaluation: it finds
+    the merging segments and builds the self-contained input of each partition of skeletons.
+
+    :param skeletons: A networkx-like graph
+    :param skeleton_id_attribute: The name of the node attribute containing the skeleton ID
+    :param edge_length_attribute: The name of the edge attribute for the length of an edge
+    :param node_segment_lut: The segment id of each node
+    :param mask_segment_id: The segment histogram of the mask voxels (optional)
+    :param merge_threshold: The minimum number of nodes (resp. mask voxels) of a false merge
+    :param num_partitions: The number of partitions
+    :param skeleton_position_attributes: The names of the node attributes for the spatial
+    coordinates. If given, the edge lengths are computed from the node positions
+    :return: a list of dictionaries, one per partition, with the sorted "skeleton_ids", the
+    "edge_skeleton", the "edges" (indices into "node_segment"), the "edge_length", the
+    "node_segment" of the nodes of the partition and its "merging_segments".
+    """
+    node_skeleton, edges, edge_length = get_graph_edge_lengths(
+        skeletons,
+        skeleton_id_attribute,
+        edge_length_attribute,
+        skeleton_position_attributes,
+    )
+    node_segment_lut = np.asarray(node_segment_lut)
+    skeleton_segment, count = count_pairs(np.stack([node_skeleton, node_segment_lut], axis=1))
+    merging_segments = find_merging_segments(
+        skeleton_segment, count, mask_segment_id, merge_threshold
+    )
+
+    # only skeletons with edges are scored
+    edge_skeleton = node_skeleton[edges[:, 0]]
+    skeleton_ids, edge_index, num_edges = np.unique(
+        edge_skeleton, return_inverse=True, return_counts=True
+    )
+    skeleton_partition = get_skeleton_partition(skeleton_ids, num_edges, num_partitions)
+    edge_partition = skeleton_partition[edge_index.ravel()]
+    edge_order = np.argsort(edge_partition, kind="stable")
+    edge_start = np.searchsorted(
+        edge_partition[edge_order], np.arange(num_partitions + 1)
+    )
+
+    partitions = []
+    for i in range(num_partitions):
+        index = edge_order[edge_start[i] : edge_start[i + 1]]
+        nodes, local_edges = np.unique(edges[index], return_inverse=True)
+        node_segment = node_segment_lut[nodes]
+        partitions.append(
+            {
+                "skeleton_ids": skeleton_ids[skeleton_partition == i],
+                "edge_skeleton": edge_skeleton[index],
+                "edges": local_edges.reshape(-1, 2),
+                "edge_length": edge_length[index],
+                "node_segment": node_segment,
+                "merging_segments": np.intersect1d(merging_segments, node_segment),
+            }
+        )
+    return partitions
+
+
+def score_partition(partition):
+    """
+    The function `score_partition` is the parallel phase of the partitioned evaluation: it scores
+    the skeletons of one partition.
+
+    :param partition: The input of the partition (see `get_partition_inputs`)
+    :return: a dictionary of arrays aligned with "skeleton_ids": "length", "erl", "ommitted",
+    "split", "merged" and "correct" (see `score_skeleton_edges`).
+    """
+    scores = score_skeleton_edges(
+        partition["skeleton_ids"],
+        partition["edge_skeleton"],
+        partition["edges"],
+        partition["edge_length"],
+        partition["node_segment"],
+        partition["merging_segments"],
+    )
+    scores["skeleton_ids"] = partition["skeleton_ids"]
+    return scores
+
+
+def reduce_partitions(results, erl_intervals=None, return_skeleton_stats=False):
+    """
+    The function `reduce_partitions` aggregates the scores of all partitions into the erl.
+
+    :param results: The outputs of `score_partition` for all partitions
+    :param erl_intervals: The ranges of the gt skeleton lengths to compute the erl for (optional)
+    :param return_skeleton_stats: If True, also return the concatenated per-skeleton scores
+    :return: the erl as `expected_run_length`, and the per-skeleton scores sorted by skeleton id.
+    """
+    scores = {
+        key: np.concatenate([x[key] for x in results]) for key in results[0].keys()
+    }
+    order = np.argsort(scores["skeleton_ids"], kind="stable")
+    scores = {key: value[order] for key, value in scores.items()}
+    erl = aggregate_run_length(scores["length"], scores["erl"], erl_intervals)
+    return (erl, scores) if return_skeleton_stats else erl
+
+
+def partitioned_run_length(
+    skeletons,
+    skeleton_id_attribute,
+    edge_length_attribute,
+    node_segment_lut,
+    mask_segment_id=None,
+    merge_threshold=0,
+    erl_intervals=None,
+    skeleton_position_attributes=None,
+    num_partitions=None,
+    num_workers=1,
+):
+    """
+    The function `partitioned_run_length` computes the same erl as `expected_run_length` by
+    scoring partitions of the skeletons in a local process pool. The per-skeleton sums of
+    `score_skeleton_edges` are those of `expected_run_length` (float64, same order), and the
+    skeletons are reduced by increasing id as well.
+
+    :param num_partitions: The number of partitions, defaults to `num_workers`
+    :param num_workers: The number of worker processes (1: no pool)
+    :return: the erl as `expected_run_length`.
+    """
+    partitions = get_partition_inputs(
+        skeletons,
+        skeleton_id_attribute,
+        edge_length_attribute,
+        node_segment_lut,
+        mask_segment_id,
+        merge_threshold,
+        num_workers if num_partitions is None else num_partitions,
+        skeleton_position_attributes,
+    )
+    if num_workers > 1:
+        with ProcessPoolExecutor(num_workers) as executor:
+            results = list(executor.map(score_partition, partitions))
+    else:
+        results = [score_partition(x) for x in partitions]
+    return reduce_partitions(results, erl_intervals)
+
+
+def prepare_partitions(
+    gt_stats_path,
+    pred_seg_path,
+    output_dir,
+    num_partitions,
+    gt_mask_path=None,
+    merge_threshold=0,
+    num_chunk=1,
+    memory_budget=None,
+):
+    """
+    The function `prepare_partitions` runs the global phase for a job array: it computes the node
+    segment lookup table of the prediction and writes the input of each partition to
+    `output_dir/partition_{i}.p`. The number of partitions is written to the manifest
+    `output_dir/partitions.p` and the files of a previous run in the folder are removed, so that
+    the score and reduce steps only see the partitions of this run.
+    """
+    from test_axonEM import load_gt_stats, get_node_position
+
+    gt_graph, gt_res, gt_mask, node_layout = load_gt_stats(
+        gt_stats_path, gt_mask_path, return_node_layout=True
+    )
+    node_segment_lut, mask_segment_id = compute_segment_lut(
+        pred_seg_path,
+        get_node_position(gt_graph, gt_res),
+        gt_mask,
+        num_chunk,
+        memory_budget=memory_budget,
+        node_layout=node_layout,
+    )
+    partitions = get_partition_inputs(
+        gt_graph,
+        "skeleton_id",
+        "length",
+        node_segment_lut,
+        mask_segment_id,
+        merge_threshold,
+        num_partitions,
+        ["z", "y", "x"],
+    )
+    mkdir(output_dir, "all")
+    manifest_path = os.path.join(output_dir, "partitions.p")
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for filename in os.listdir(output_dir):
+        if re.fullmatch(r"(partition|scores)_\d+\.p", filename):
+            os.remove(os.path.join(output_dir, filename))
+    for i, partition in enumerate(partitions):
+        write_pkl(os.path.join(output_dir, f"partition_{i}.p"), partition)
+    # written last: a folder without manifest is an unfinished prepare step
+    write_pkl(manifest_path, {"num_partitions": len(partitions)})
+
+
+def get_num_partitions(output_dir):
+    """
+    The function `get_num_partitions` reads the number of partitions of a job array from the
+    manifest written by `prepare_partitions`.
+    """
+    manifest_path = os.path.join(output_dir, "partitions.p")
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(f"partitions are not prepared yet: {manifest_path}")
+    return read_pkl(manifest_path)[0]["num_partitions"]
+
+
+def score_partition_files(output_dir, job_id=0, job_num=1):
+    """
+    The function `score_partition_files` runs the parallel phase for one job of a job array: the
+    job scores the partitions `job_id, job_id + job_num, ...` and writes their scores to
+    `output_dir/scores_{i}.p`.
+    """
+    for i in range(job_id, get_num_partitions(output_dir), job_num):
+        partition = read_pkl(os.path.join(output_dir, f"partition_{i}.p"))[0]
+        write_pkl(os.path.join(output_dir, f"scores_{i}.p"), score_partition(partition))
+
+
+def reduce_partition_files(output_dir, erl_intervals=None):
+    """
+    The function `reduce_partition_files` reduces the scores of all partitions of a job array.
+
+    :return: the erl as `expected_run_length`.
+    """
+    results = []
+    for i in range(get_num_partitions(output_dir)):
+        filename = os.path.join(output_dir, f"scores_{i}.p")
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f"partition {i} is not scored yet: {filename}")
+        results.append(read_pkl(filename)[0])
+    return reduce_partitions(results, erl_intervals)
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(
+        description="Partitioned ERL evaluation for job arrays"
+    )
+    parser.add_argument(
+        "-st",
+        "--stage",
+        type=str,
+        choices=["prepare", "score", "reduce"],
+        help="phase of the evaluation",
+        required=True,
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        type=str,
+        help="folder shared by the jobs for the partition inputs and scores",
+        required=True,
+    )
+    parser.add_argument(
+        "-s",
+        "--seg-path",
+        type=str,
+        help="path to the segmentation prediction (prepare)",
+        default="",
+    )
+    parser.add_argument(
+        "-g",
+        "--gt-stats-path",
+        type=str,
+        help="path to ground truth skeleton statistics (prepare)",
+        default="",
+    )
+    parser.add_argument(
+        "-m",
+        "--gt-mask-path",
+        type=str,
+        help="path to ground truth no-background mask (prepare)",
+        default="",
+    )
+    parser.add_argument(
+        "-n",
+        "--num-partitions",
+        type=int,
+        help="number of skeleton partitions (prepare)",
+        default=1,
+    )
+    parser.add_argument(
+        "-c",
+        "--num-chunk",
+        type=int,
+        help="number of chunks to process the volume (prepare)",
+        default=1,
+    )
+    parser.add_argument(
+        "-b",
+        "--memory-budget",
+        type=str,
+        help="memory budget to process the volume, e.g., 2G (prepare)",
+        default="",
+    )
+    parser.add_argument(
+        "-mt",
+        "--merge-threshold",
+        type=int,
+        help="threshold number of voxels to be a false merge (prepare)",
+        default=50,
+    )
+    parser.add_argument(
+        "-j",
+        "--job",
+        type=str,
+        help="job index and number of jobs, e.g., 3,10 (score)",
+        default="0,1",
+    )
+    parser.add_argument(
+        "-i",
+        "--erl-intervals",
+        type=str,
+        help="compute erl for each range. e.g., 0-20000-40000-150000 (reduce)",
+        default="",
+    )
+    args = parser.parse_args()
+    args.gt_mask_path = args.gt_mask_path if args.gt_mask_path else None
+    args.memory_budget = (
+        parse_memory_size(args.memory_budget) if args.memory_budget else None
+    )
+    args.job = [int(x) for x in args.job.split(",")]
+    args.erl_intervals = (
+        [int(x) for x in args.erl_intervals.split("-")]
+        if "-" in args.erl_intervals
+        else None
+    )
+    return args
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    if args.stage == "prepare":
+        prepare_partitions(
+            args.gt_stats_path,
+            args.seg_path,
+            args.output_dir,
+            args.num_partitions,
+            args.gt_mask_path,
+            args.merge_threshold,
+            args.num_chunk,
+            args.memory_budget,
+        )
+    elif args.stage == "score":
+        score_partition_files(args.output_dir, args.job[0], args.job[1])
+    else:
+        erl = reduce_partition_files(args.output_dir, args.erl_intervals)
+        print(f"ERL/GT: {np.asarray(erl).tolist()}")
@@ -0,0 +1,282 @@
+import json
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# per-stage accounting of wall time, cpu time, peak rss and peak traced (numpy) allocations
+# (tracemalloc slows down the python loops of the evaluation ~10x: the traced allocations are
+# only recorded with trace_malloc=True, e.g., to debug the memory of a stage)
+# usage:
+# profiler = StageProfiler()
+# with profile_stage(profiler, "load_gt"):
+#     ...
+# profiler.get_stats()
+#
+# structured events (stage start/end, per-slab bytes, throughput) go through a Tracer:
+# tracer = Tracer(JsonlSink("events.jsonl"), profiler=StageProfiler())
+# test_AxonEM(..., profiler=tracer)
+
+
+def _read_peak_rss():
+    # peak resident set size in bytes (VmHWM can be reset, ru_maxrss cannot)
+    try:
+        with open("/proc/self/status", "r") as fid:
+            for line in fid:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # linux: kB, macOS: bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _reset_peak_rss():
+    # only possible on linux: writing 5 to clear_refs resets VmHWM to the current rss
+    try:
+        with open("/proc/self/clear_refs", "w") as fid:
+            fid.write("5")
+    except OSError:
+        return False
+    return True
+
+
+class StageProfiler:
+    # The StageProfiler class records the resources used by (nested) named stages.
+    def __init__(self, trace_malloc=False):
+        self.trace_malloc = trace_malloc
+        self._started_tracemalloc = False
+        self._stack = []
+        self.stats = {}
+
+    def _get_peaks(self):
+        peak_traced = tracemalloc.get_traced_memory()[1] if self.trace_malloc else 0
+        return _read_peak_rss(), peak_traced
+
+    @contextmanager
+    def stage(self, name):
+        """
+        The function `stage` is a context manager measuring the enclosed code as one call of a stage.
+        Nested stages are recorded as "parent/child". Repeated calls of a stage are accumulated.
+
+        :param name: The name of the stage
+        """
+        if self.trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if len(self._stack) > 0:
+            # keep the peaks of the parent stage before resetting them
+            parent = self._stack[-1]
+            parent["peaks"] = list(map(max, parent["peaks"], self._get_peaks()))
+            name = parent["name"] + "/" + name
+        rss_reset = _reset_peak_rss()
+        if self.trace_malloc:
+            tracemalloc.reset_peak()
+        frame = {
+            "name": name,
+            "traced": tracemalloc.get_traced_memory()[0] if self.trace_malloc else 0,
+            "peaks": [0, 0],
+            "rss_reset": rss_reset,
+        }
+        self._stack.append(frame)
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - wall_time
+            cpu_time = time.process_time() - cpu_time
+            frame["peaks"] = list(map(max, frame["peaks"], self._get_peaks()))
+            self._stack.pop()
+            if len(self._stack) > 0:
+                parent = self._stack[-1]
+                parent["peaks"] = list(map(max, parent["peaks"], frame["peaks"]))
+
+            if name not in self.stats:
+                self.stats[name] = {
+                    "calls": 0,
+                    "wall_time": 0.0,
+                    "cpu_time": 0.0,
+                    "peak_rss": 0,
+                    "peak_traced": 0,
+                }
+            stats = self.stats[name]
+            stats["calls"] += 1
+            stats["wall_time"] += wall_time
+            stats["cpu_time"] += cpu_time
+            stats["peak_rss"] = max(stats["peak_rss"], frame["peaks"][0])
+            # allocations made within the stage, on top of what was alive at its start
+            stats["peak_traced"] = max(
+                stats["peak_traced"], frame["peaks"][1] - frame["traced"]
+            )
+            if not frame["rss_reset"]:
+                # the process peak so far: an upper bound of the stage peak
+                stats["peak_rss_is_process_peak"] = True
+
+    def get_stats(self):
+        """
+        The function `get_stats` returns the accumulated statistics of all stages.
+
+        :return: a dictionary mapping stage names to dictionaries with the number of calls, the wall
+        and cpu time in seconds and the peak rss and traced allocations in bytes.
+        """
+        return {name: dict(stats) for name, stats in self.stats.items()}
+
+    def emit(self, event, **fields):
+        # the profiler only accounts for stages
+        pass
+
+    def stop(self):
+        """
+        The function `stop` stops tracing the allocations, if they were started by the profiler.
+        """
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+
+def _to_json_value(value):
+    # numpy scalars are not json serializable
+    if hasattr(value, "item"):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_json_value(x) for x in value]
+    return value
+
+
+class Tracer:
+    # The Tracer class sends structured events to a sink, optionally profiling the stages.
+    def __init__(self, sink=None, profiler=None):
+        self.sink = MemorySink() if sink is None else sink
+        self.profiler = profiler
+        self._stack = []
+
+    def emit(self, event, **fields):
+        """
+        The function `emit` sends an event to the sink.
+
+        :param event: The name of the event, e.g., "slab" or "evaluate_skeletons"
+        :param fields: The content of the event. The current stage and the time are added
+        """
+        record = {"event": event, "time": time.time()}
+        if len(self._stack) > 0:
+            record["stage"] = "/".join(self._stack)
+        record.update({key: _to_json_value(val) for key, val in fields.items()})
+        self.sink(record)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        The function `stage` is a context manager emitting "stage_start" and "stage_end" events
+        around the enclosed code, which is also profiled if the tracer has a profiler.
+
+        :param name: The name of the stage
+        """
+        self._stack.append(name)
+        self.emit("stage_start")
+        wall_time = time.perf_counter()
+        try:
+            with profile_stage(self.profiler, name):
+                yield
+        finally:
+            self.emit("stage_end", wall_time=time.perf_counter() - wall_time)
+            self._stack.pop()
+
+    def get_stats(self):
+        return {} if self.profiler is None else self.profiler.get_stats()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+        if hasattr(self.sink, "close"):
+            self.sink.close()
+
+
+class MemorySink:
+    # The MemorySink class keeps the events in a list, e.g., for tests.
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, record):
+        self.events.append(record)
+
+    def get_events(self, event=None):
+        return [x for x in self.events if event is None or x["event"] == event]
+
+
+class JsonlSink:
+    # The JsonlSink class appends one json line per event to a file.
+    def __init__(self, filename):
+        self._fid = open(filename, "a")
+
+    def __call__(self, record):
+        self._fid.write(json.dumps(record) + "\n")
+        # keep the events of a run that gets killed
+        self._fid.flush()
+
+    def close(self):
+        self._fid.close()
+
+
+@contextmanager
+def capture_profile(output_path, mode="cprofile"):
+    """
+    The function `capture_profile` is a context manager capturing a function-level profile of the
+    enclosed code.
+
+    :param output_path: The path of the output. cProfile writes a pstats file, pyinstrument an html
+    report
+    :param mode: either "cprofile" or "pyinstrument" (optional dependency), defaults to "cprofile"
+    """
+    if mode == "cprofile":
+        import cProfile
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            profile.dump_stats(output_path)
+    elif mode == "pyinstrument":
+        from pyinstrument import Profiler
+
+        profile = Profiler()
+        profile.start()
+        try:
+            yield profile
+        finally:
+            profile.stop()
+            with open(output_path, "w") as fid:
+                fid.write(profile.output_html())
+    else:
+        raise ValueError("unknown profile mode:", mode)
+
+
+def profile_stage(profiler, name):
+    """
+    The function `profile_stage` returns the context manager of a stage, or a no-op context
+    manager if profiling is disabled.
+
+    :param profiler: a `StageProfiler`, a `Tracer` or None
+    :param name: The name of the stage
+    """
+    return nullcontext() if profiler is None else profiler.stage(name)
+
+
+def profile_event(profiler, event, **fields):
+    """
+    The function `profile_event` emits an event if tracing is enabled.
+
+    :param profiler: a `StageProfiler`, a `Tracer` or None
+    :param event: The name of the event
+    :param fields: The content of the event
+    """
+    if profiler is not None:
+        profiler.emit(event, **fields)
+
+
+def is_tracing(profiler):
+    """
+    The function `is_tracing` checks whether events are recorded, to skip computing their content.
+    """
+    return isinstance(profiler, Tracer)
@@ -0,0 +1,336 @@
+import time
+import numpy as np
+from data_io import read_vol, get_volume_info, get_completed_z_ranges
+from mask_index import MaskIndex
+from relabel import SegmentRelabel, fits_data_type
+from networkx_lite import get_graph_arrays
+from eval_erl import (
+    get_skeleton_lengths,
+    find_merging_segments,
+    score_skeleton_edges,
+    aggregate_run_length,
+    plan_segment_lut_slabs,
+    relabel_histogram,
+)
+from incremental import add_counts
+from profiling import profile_stage, profile_event
+
+# progressive evaluation of a prediction that is still being written slab by slab (e.g., by an
+# inference job): the z-ranges whose storage chunks are all written are read as they appear, the
+# node segment lookup table, the (skeleton, segment) contingency and the mask histogram are
+# accumulated, and the skeletons touched by a slab are rescored on the gt edges covered so far.
+# each slab gives a provisional ERL with the fraction of the gt length covered; once the whole
+# volume is read, the scores are the same as `compute_erl`
+#
+# evaluator = ProgressiveERL(gt_graph, node_position, gt_mask, merge_threshold=50)
+# for result in evaluator.watch("pred.h5", poll_interval=30):
+#     print(result["coverage"], result["scores"])
+#
+# the writer has to close (or flush in SWMR mode) the h5 file after each slab to make it readable
+
+
+def get_runs(flags):
+    """
+    The function `get_runs` finds the runs of True values of a boolean array.
+
+    :param flags: a 1D boolean array
+    :return: a list of `[start, last)` pairs.
+    """
+    edges = np.diff(np.concatenate([[0], np.asarray(flags, np.int8), [0]]))
+    return [
+        [int(start), int(last)]
+        for start, last in zip(np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0])
+    ]
+
+
+class ProgressiveERL:
+    # The ProgressiveERL class accumulates the evaluation of a prediction slab by slab.
+    def __init__(
+        self,
+        gt_graph,
+        node_position,
+        mask=None,
+        merge_threshold=0,
+        erl_intervals=None,
+        skeleton_id_attribute="skeleton_id",
+        edge_length_attribute="length",
+        skeleton_position_attributes=["z", "y", "x"],
+        data_type=np.uint32,
+        node_layout=None,
+    ):
+        """
+        :param gt_graph: The ground truth graph
+        :param node_position: The voxel position of each node (N, 3) in zyx order
+        :param mask: The gt no-background mask: a 3D volume, the name of an h5 file or a `MaskIndex`
+        (optional)
+        :param merge_threshold: The minimum number of nodes (resp. mask voxels) of a false merge
+        :param erl_intervals: The boundaries of the skeleton length intervals (optional)
+        :param data_type: The data type of the node segment lookup table. Segment ids that do not
+        fit into it are relabeled to dense ids (see relabel.py)
+        :param node_layout: The `NodeLayout` of nodes sorted by z-slice (optional)
+        """
+        get_skeleton_lengths(
+            gt_graph,
+            skeleton_position_attributes,
+            skeleton_id_attribute,
+            store_edge_length=edge_length_attribute,
+        )
+        self.node_skeleton, self.edges, self.edge_length = get_graph_arrays(
+            gt_graph, skeleton_id_attribute, edge_length_attribute
+        )
+        self.edge_skeleton = self.node_skeleton[self.edges[:, 0]]
+        self.skeleton_ids = np.unique(self.node_skeleton)
+        self.total_length = float(self.edge_length.sum())
+        self.node_position = np.asarray(node_position)
+        self.mask = mask
+        self.merge_threshold = merge_threshold
+        self.erl_intervals = erl_intervals
+        self.node_layout = node_layout
+
+        num_node = len(self.node_position)
+        self.node_lut = np.zeros(num_node, data_type)
+        # set with the first slab if its segment ids do not fit into `data_type`
+        self.relabel = None
+        self.node_done = np.zeros(num_node, bool)
+        self.edge_done = np.zeros(len(self.edges), bool)
+        self.contingency = (np.zeros([0, 2], np.uint64), np.zeros(0, np.int64))
+        # in the original segment ids: a segment of the mask may only reach the nodes in a later slab
+        self.mask_hist = (
+            None if mask is None else (np.zeros(0, np.uint64), np.zeros(0, np.int64))
+        )
+        self.merging_segments = np.zeros(0, np.uint64)
+        self.scores = {
+            "length": np.zeros(len(self.skeleton_ids)),
+            "erl": np.zeros(len(self.skeleton_ids)),
+        }
+        # z-slices of the prediction already read (allocated with the first slab)
+        self.z_done = None
+
+    def _start(self, num_z):
+        if self.z_done is not None:
+            return
+        self.z_done = np.zeros(num_z, bool)
+        # nodes outside the volume keep the segment 0, as in `compute_segment_lut`
+        outside = (self.node_position[:, 0] < 0) | (self.node_position[:, 0] >= num_z)
+        self.node_done[outside] = True
+
+    def is_complete(self):
+        """
+        The function `is_complete` tells whether the whole prediction has been read.
+        """
+        return self.z_done is not None and bool(self.z_done.all())
+
+    def get_coverage(self):
+        """
+        The function `get_coverage` returns the fraction of the gt length whose edges have both
+        nodes read.
+        """
+        if self.total_length == 0:
+            return 1.0 if self.is_complete() else 0.0
+        return float(self.edge_length[self.edge_done].sum()) / self.total_length
+
+    def get_result(self):
+        """
+        The function `get_result` returns the current (provisional) evaluation.
+
+        :return: a dictionary with the "scores" of the skeleton edges covered so far (as
+        `compute_erl`), the "coverage" fraction of the gt length, the fraction of z-slices read
+        ("z_coverage") and whether the prediction is "complete".
+        """
+        return {
+            "scores": aggregate_run_length(
+                self.scores["length"], self.scores["erl"], self.erl_intervals
+            ),
+            "coverage": self.get_coverage(),
+            "z_coverage": 0.0 if self.z_done is None else float(self.z_done.mean()),
+            "complete": self.is_complete(),
+        }
+
+    def get_mask_histogram(self):
+        """
+        The function `get_mask_histogram` returns the segment histogram of the mask voxels read so
+        far, with the segment ids of the node segment lookup table (None if no mask is given).
+        """
+        if self.mask_hist is None or self.relabel is None:
+            return self.mask_hist
+        # only the segments found at the nodes so far, as `compute_segment_lut`
+        return relabel_histogram(self.relabel, self.mask_hist, self.node_lut[self.node_done])
+
+    def add_slab(self, seg, start_z, num_z=None, mask_z=None, profiler=None):
+        """
+        The function `add_slab` adds a slab of the prediction: its node segments and mask voxels are
+        counted, and the skeletons with nodes in the slab (or on a segment that starts or stops
+        being a merging segment) are rescored.
+
+        :param seg: The slab of the prediction (Z, Y, X)
+        :param start_z: The first z-slice of the slab
+        :param num_z: The number of z-slices of the whole prediction (required for the first slab)
+        :param mask_z: The slab of the mask volume. If not given, it is read from `mask` (optional)
+        :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+        :return: the provisional result, see `get_result`.
+        """
+        self._start(num_z)
+        if self.relabel is None and not fits_data_type(seg.dtype, self.node_lut.dtype):
+            self.relabel = SegmentRelabel(self.node_lut.dtype)
+        last_z = start_z + seg.shape[0]
+        with profile_stage(profiler, "node_lookup"):
+            if self.node_layout is not None:
+                ind = np.arange(len(self.node_position))[
+                    self.node_layout.get_node_range(start_z, last_z)
+                ]
+            else:
+                ind = np.nonzero(
+                    (self.node_position[:, 0] >= start_z) & (self.node_position[:, 0] < last_z)
+                )[0]
+            ind = ind[~self.node_done[ind]]
+            pts = self.node_position[ind]
+            if self.relabel is not None:
+                self.node_lut[ind] = self.relabel.update(
+                    seg[pts[:, 0] - start_z, pts[:, 1], pts[:, 2]]
+                )
+            else:
+                self.node_lut[ind] = seg[pts[:, 0] - start_z, pts[:, 1], pts[:, 2]]
+            self.node_done[ind] = True
+            self.z_done[start_z:last_z] = True
+
+        if self.mask is not None:
+            with profile_stage(profiler, "mask_histogram"):
+                if mask_z is None and isinstance(self.mask, MaskIndex):
+                    mask_hist = np.unique(self.mask.gather(seg, start_z), return_counts=True)
+                else:
+                    if mask_z is None and isinstance(self.mask, str):
+                        mask_z = read_vol(self.mask, None, z_range=[start_z, last_z])
+                    elif mask_z is None:
+                        mask_z = self.mask[start_z:last_z]
+                    mask_hist = np.unique(seg[mask_z > 0], return_counts=True)
+                self.mask_hist = add_counts(
+                    *self.mask_hist, mask_hist[0].astype(np.uint64), mask_hist[1]
+                )
+
+        with profile_stage(profiler, "contingency"):
+            self.contingency = add_counts(
+                *self.contingency,
+                np.stack([self.node_skeleton[ind], self.node_lut[ind]], axis=1).astype(
+                    np.uint64
+                ),
+                np.ones(len(ind), np.int64),
+            )
+            merging_segments = find_merging_segments(
+                *self.contingency, self.get_mask_histogram(), self.merge_threshold
+            )
+
+        with profile_stage(profiler, "score_skeletons"):
+            self.edge_done = self.node_done[self.edges[:, 0]] & self.node_done[self.edges[:, 1]]
+            flipped = np.setxor1d(self.merging_segments, merging_segments)
+            affected = np.union1d(
+                self.node_skeleton[ind],
+                self.node_skeleton[self.node_done & np.isin(self.node_lut, flipped)],
+            )
+            if self.is_complete():
+                # also the skeletons with nodes outside the volume, whose edges were never in a slab
+                affected = self.skeleton_ids
+            edge_mask = self.edge_done & np.isin(self.edge_skeleton, affected)
+            scores = score_skeleton_edges(
+                affected,
+                self.edge_skeleton[edge_mask],
+                self.edges[edge_mask],
+                self.edge_length[edge_mask],
+                self.node_lut,
+                merging_segments,
+            )
+            index = np.searchsorted(self.skeleton_ids, affected)
+            for key in self.scores:
+                self.scores[key][index] = scores[key]
+            self.merging_segments = merging_segments
+
+        result = self.get_result()
+        profile_event(
+            profiler,
+            "progressive_slab",
+            start_z=start_z,
+            last_z=last_z,
+            num_nodes=len(ind),
+            num_rescored_skeletons=len(affected),
+            coverage=result["coverage"],
+        )
+        return result
+
+    def poll(
+        self, segment, dataset_name=None, final=False, chunk_num=1, memory_budget=None, profiler=None
+    ):
+        """
+        The function `poll` reads the z-ranges of the prediction completed since the last call.
+
+        :param segment: The name of the h5 file or zarr/n5 folder of the prediction
+        :param dataset_name: The dataset of the segment file (optional)
+        :param final: If True, the writer is done: all the z-ranges not read yet are read. A
+        contiguous h5 dataset is always read at once
+        :param chunk_num: The number of z-slabs the volume would be read in by `compute_segment_lut`.
+        A completed z-range is read by pieces within these slabs
+        :param memory_budget: The maximum number of bytes of a slab (overrides `chunk_num`)
+        :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+        :return: a generator of the provisional result after each slab read (see `get_result`).
+        """
+        try:
+            shape, _, chunks = get_volume_info(segment, dataset_name)
+            if final or chunks is None:
+                # a contiguous h5 dataset is allocated at once: as its progress is unknown, it is
+                # read as it is (a prediction written slab by slab has to be chunked)
+                completed = [[0, shape[0]]]
+            else:
+                completed = get_completed_z_ranges(segment, dataset_name)
+        except (OSError, KeyError, IndexError):
+            # not created yet, or being written
+            return
+        self._start(shape[0])
+        pending = np.zeros(shape[0], bool)
+        for start_z, last_z in completed:
+            pending[start_z:last_z] = True
+        pending &= ~self.z_done
+        if not pending.any():
+            return
+        for slab_z0, slab_z1 in plan_segment_lut_slabs(
+            segment, self.mask, chunk_num, memory_budget, dataset_name
+        ):
+            for start_z, last_z in get_runs(pending[slab_z0:slab_z1]):
+                with profile_stage(profiler, "read_segment"):
+                    seg = read_vol(
+                        segment, dataset_name, z_range=[slab_z0 + start_z, slab_z0 + last_z]
+                    )
+                yield self.add_slab(seg, slab_z0 + start_z, profiler=profiler)
+                del seg
+
+    def watch(
+        self,
+        segment,
+        dataset_name=None,
+        poll_interval=10,
+        timeout=None,
+        chunk_num=1,
+        memory_budget=None,
+        profiler=None,
+    ):
+        """
+        The function `watch` polls a prediction being written until all of it has been read.
+
+        :param segment: The name of the h5 file or zarr/n5 folder of the prediction
+        :param dataset_name: The dataset of the segment file (optional)
+        :param poll_interval: The number of seconds between two polls
+        :param timeout: The number of seconds without any new slab after which the remaining
+        z-ranges are read as they are (e.g., a writer skipping the chunks of background) (optional)
+        :param chunk_num: see `poll`
+        :param memory_budget: see `poll`
+        :param profiler: a `StageProfiler` or a `Tracer` recording each stage (optional)
+        :return: a generator of the provisional result after each slab read. The last result has
+        "complete" set and holds the same scores as `compute_erl`.
+        """
+        last_time = time.monotonic()
+        while not self.is_complete():
+            final = timeout is not None and time.monotonic() - last_time > timeout
+            for result in self.poll(
+                segment, dataset_name, final, chunk_num, memory_budget, profiler
+            ):
+                last_time = time.monotonic()
+                yield result
+            if not self.is_complete():
+                time.sleep(poll_interval)
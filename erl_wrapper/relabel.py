@@ -0,0 +1,156 @@
+import numpy as np
+
+# dense relabeling of the sparse (e.g., uint64) segment ids of a prediction, built while its slabs
+# are read: each id found at a gt node gets the next dense id of a compact type (uint32 by default),
+# so that the node lookup table, the mask histograms and the contingency hold half as many bytes.
+# the ids only need to be equal to score the ERL; the inverse map gives back the original ids
+# (e.g., of the merge stats). The background 0 stays 0
+#
+# relabel = SegmentRelabel(np.uint32)
+# node_segment_lut, mask_segment_id = compute_segment_lut("pred.h5", node_position, relabel=relabel)
+# merged_segments = relabel.get_original(merged_segments)
+
+
+def fits_data_type(dtype, data_type):
+    """
+    The function `fits_data_type` tells whether all the values of a data type can be stored in
+    another one without being truncated.
+
+    :param dtype: The data type of the values (e.g., of the prediction)
+    :param data_type: The data type to store them in
+    :return: a bool.
+    """
+    return np.can_cast(np.dtype(dtype), np.dtype(data_type), "safe")
+
+
+def pack_pairs(pairs):
+    """
+    The function `pack_pairs` packs pairs of 32-bit ids, e.g., (skeleton, segment) pairs, into
+    uint64 keys that sort in the same order as the rows, so that they are sorted as a 1D array.
+
+    :param pairs: The pairs (K, 2) of non-negative ids
+    :return: the uint64 keys (K), or None if an id does not fit into 32 bits.
+    """
+    pairs = np.asarray(pairs)
+    if len(pairs) > 0 and (pairs.min() < 0 or pairs.max() >= 2**32):
+        return None
+    pairs = pairs.astype(np.uint64, copy=False).reshape(-1, 2)
+    return (pairs[:, 0] << np.uint64(32)) | pairs[:, 1]
+
+
+def unpack_pairs(keys):
+    """
+    The function `unpack_pairs` is the inverse of `pack_pairs`.
+
+    :param keys: The uint64 keys (K)
+    :return: the pairs (K, 2) as uint64.
+    """
+    return np.stack([keys >> np.uint64(32), keys & np.uint64(2**32 - 1)], axis=1)
+
+
+def count_pairs(pairs):
+    """
+    The function `count_pairs` counts the unique rows of a (K, 2) array of ids, e.g., the (skeleton,
+    segment) pairs of the nodes, sorting them as packed keys if they fit (see `pack_pairs`).
+
+    :param pairs: The pairs (K, 2)
+    :return: the unique pairs (as uint64, sorted by their first then second id) and their counts.
+    """
+    keys = pack_pairs(pairs)
+    if keys is None:
+        return np.unique(
+            np.asarray(pairs).astype(np.uint64), axis=0, return_counts=True
+        )
+    keys, counts = np.unique(keys, return_counts=True)
+    return unpack_pairs(keys), counts
+
+
+class SegmentRelabel:
+    # The SegmentRelabel class maps segment ids to dense ids, assigned in the order they are found.
+    def __init__(self, data_type=np.uint32):
+        """
+        :param data_type: The (unsigned integer) data type of the dense ids
+        """
+        self.data_type = np.dtype(data_type)
+        # sorted original ids and their dense id, the background 0 is mapped to 0
+        self.segment_ids = np.zeros(1, np.uint64)
+        self.labels = np.zeros(1, self.data_type)
+        # original id of each dense id
+        self.inverse = np.zeros(1, np.uint64)
+
+    def __len__(self):
+        return len(self.inverse)
+
+    def lookup(self, segment_ids):
+        """
+        The function `lookup` maps segment ids without adding the unknown ones.
+
+        :param segment_ids: an array of original segment ids
+        :return: a pair of arrays `(labels, found)`: the dense id of each segment id (0 if unknown)
+        and whether it is known.
+        """
+        segment_ids = np.asarray(segment_ids).astype(np.uint64, copy=False)
+        index = np.minimum(
+            np.searchsorted(self.segment_ids, segment_ids), len(self.segment_ids) - 1
+        )
+        found = self.segment_ids[index] == segment_ids
+        return np.where(found, self.labels[index], 0).astype(self.data_type), found
+
+    def update(self, segment_ids):
+        """
+        The function `update` maps segment ids, giving the next dense ids to the ones not seen yet.
+
+        :param segment_ids: an array of original segment ids
+        :return: the dense id of each segment id, with the same shape.
+        """
+        segment_ids = np.asarray(segment_ids)
+        unique, index = np.unique(
+            segment_ids.astype(np.uint64, copy=False), return_inverse=True
+        )
+        position = np.searchsorted(self.segment_ids, unique)
+        known = position < len(self.segment_ids)
+        known[known] = self.segment_ids[position[known]] == unique[known]
+        new_ids = unique[~known]
+        if len(new_ids) > 0:
+            num_labels = len(self.inverse) + len(new_ids)
+            if num_labels - 1 > np.iinfo(self.data_type).max:
+                raise OverflowError(
+                    f"{num_labels} segment ids do not fit into {self.data_type.name}"
+                )
+            new_labels = np.arange(len(self.inverse), num_labels).astype(self.data_type)
+            self.segment_ids = np.insert(self.segment_ids, position[~known], new_ids)
+            self.labels = np.insert(self.labels, position[~known], new_labels)
+            self.inverse = np.concatenate([self.inverse, new_ids])
+        labels, _ = self.lookup(unique)
+        return labels[index.ravel()].reshape(segment_ids.shape)
+
+    def get_original(self, labels):
+        """
+        The function `get_original` maps dense ids back to the original segment ids.
+
+        :param labels: an array of dense ids
+        :return: the original segment ids (uint64).
+        """
+        return self.inverse[np.asarray(labels, np.int64)]
+
+    def get_original_stats(self, merge_split_stats):
+        """
+        The function `get_original_stats` maps the segment ids of the merge and split stats of
+        `expected_run_length` back to the original ids.
+
+        :param merge_split_stats: a dictionary with the "merge_stats" (segment id -> merged
+        skeletons) and the "split_stats" (skeleton id -> pairs of segment ids)
+        :return: the same dictionary with the original segment ids.
+        """
+        return {
+            "merge_stats": {
+                int(self.inverse[segment]): skeletons
+                for segment, skeletons in merge_split_stats["merge_stats"].items()
+            },
+            "split_stats": {
+                skeleton: [
+                    (int(self.inverse[u]), int(self.inverse[v])) for u, v in pairs
+                ]
+                for skeleton, pairs in merge_split_stats["split_stats"].items()
+            },
+        }
@@ -0,0 +1,253 @@
+import numpy as np
+from data_io import read_box
+from mask_index import MaskIndex
+from networkx_lite import NetworkXGraphLite, get_graph_arrays
+
+# evaluation restricted to a region of interest (ROI), e.g., a proofread block:
+# the gt nodes inside the ROI are found with a grid index, the edges crossing the ROI boundary
+# are clipped at the boundary (with a new node) and their length is apportioned
+# roi: [[z0, z1], [y0, y1], [x0, x1]] in voxels of the prediction
+
+
+def get_node_physical_position(gt_graph, position_attributes=["z", "y", "x"]):
+    """
+    The function `get_node_physical_position` returns the node positions of a gt graph.
+
+    :param gt_graph: The ground truth graph (networkx or `NetworkXGraphLite`)
+    :param position_attributes: The names of the node attributes of the zyx coordinates
+    :return: the position of each node (N, 3) in physical unit, zyx order.
+    """
+    if isinstance(gt_graph, NetworkXGraphLite):
+        return np.stack(
+            [gt_graph.nodes.column(x) for x in position_attributes], axis=1
+        ).astype(np.float64)
+    return np.array(
+        [[data[x] for x in position_attributes] for _, data in gt_graph.nodes(data=True)],
+        np.float64,
+    ).reshape(-1, 3)
+
+
+class SkeletonIndex:
+    # The SkeletonIndex class is a uniform grid index of the gt nodes to crop the gt graph.
+    def __init__(
+        self,
+        gt_graph,
+        gt_res,
+        cell_size=64,
+        skeleton_id_attribute="skeleton_id",
+        edge_length_attribute="length",
+    ):
+        """
+        :param gt_graph: The ground truth graph (networkx or `NetworkXGraphLite`)
+        :param gt_res: The voxel resolution (zyx order)
+        :param cell_size: The size of the grid cells in voxels
+        """
+        import scipy.sparse as sp
+
+        self.gt_graph = gt_graph
+        self.gt_res = np.array(gt_res, np.float64)
+        self.cell_size = cell_size
+        self.skeleton_id_attribute = skeleton_id_attribute
+        self.position = get_node_physical_position(gt_graph)
+        self.voxel = (self.position // self.gt_res).astype(np.int64)
+        self.node_skeleton, self.edges, _ = get_graph_arrays(
+            gt_graph, skeleton_id_attribute, edge_length_attribute
+        )
+        # edge lengths computed as in get_skeleton_lengths
+        self.edge_length = np.linalg.norm(
+            (self.position[self.edges[:, 0]] - self.position[self.edges[:, 1]]).astype(
+                np.float32
+            ),
+            axis=1,
+        )
+        # edge index (+1) of each (node, neighbor) pair
+        num_node = len(self.position)
+        edge_index = np.arange(1, len(self.edges) + 1)
+        self.adjacency = sp.csr_matrix(
+            (
+                np.concatenate([edge_index, edge_index]),
+                (
+                    np.concatenate([self.edges[:, 0], self.edges[:, 1]]),
+                    np.concatenate([self.edges[:, 1], self.edges[:, 0]]),
+                ),
+            ),
+            shape=(num_node, num_node),
+        )
+        # nodes outside the ROI whose edges may cross it are at most this far from it
+        self.margin = (
+            np.abs(self.voxel[self.edges[:, 0]] - self.voxel[self.edges[:, 1]]).max(axis=0)
+            + 1
+            if len(self.edges) > 0
+            else np.zeros(3, np.int64)
+        )
+
+        cell = self.voxel // cell_size
+        self.cell_min = cell.min(axis=0) if num_node > 0 else np.zeros(3, np.int64)
+        self.grid = tuple(
+            (cell.max(axis=0) - self.cell_min + 1) if num_node > 0 else np.ones(3, np.int64)
+        )
+        cell_id = np.ravel_multi_index(tuple((cell - self.cell_min).T), self.grid)
+        self.node_order = np.argsort(cell_id, kind="stable")
+        self.cell_start = np.searchsorted(
+            cell_id[self.node_order], np.arange(np.prod(self.grid) + 1)
+        )
+
+    def query(self, roi):
+        """
+        The function `query` finds the nodes within a box.
+
+        :param roi: The `[start, last)` voxel range of each dimension (zyx order)
+        :return: the sorted indices of the nodes inside the box.
+        """
+        roi = np.array(roi, np.int64)
+        cell_range = [
+            np.clip(
+                [roi[d, 0] // self.cell_size, (roi[d, 1] - 1) // self.cell_size + 1]
+                - self.cell_min[d],
+                0,
+                self.grid[d],
+            )
+            for d in range(3)
+        ]
+        if any(x[1] <= x[0] for x in cell_range):
+            return np.zeros(0, np.int64)
+        cells = np.ravel_multi_index(
+            tuple(
+                x.ravel()
+                for x in np.meshgrid(
+                    *[np.arange(x[0], x[1]) for x in cell_range], indexing="ij"
+                )
+            ),
+            self.grid,
+        )
+        nodes = np.concatenate(
+            [self.node_order[self.cell_start[c] : self.cell_start[c + 1]] for c in cells]
+        )
+        voxel = self.voxel[nodes]
+        inside = np.all((voxel >= roi[:, 0]) & (voxel < roi[:, 1]), axis=1)
+        return np.sort(nodes[inside])
+
+    def crop(self, roi):
+        """
+        The function `crop` builds the subgraph of the gt graph within a box. The edges crossing the
+        boundary of the box are clipped: their outside end is replaced by a new node on the boundary
+        and their length is apportioned to the part inside the box.
+
+        :param roi: The `[start, last)` voxel range of each dimension (zyx order)
+        :return: a tuple `(roi_graph, node_position, source_node)`: the cropped `NetworkXGraphLite`
+        with the edge lengths stored, the voxel position of each of its nodes (N', 3) and the index
+        of the node of the gt graph that each node stands for (for a new node, its end of the
+        clipped edge that is inside the box, or the nearest end if none is).
+        """
+        roi = np.array(roi, np.int64)
+        inner = self.query(roi)
+        near = self.query(
+            np.stack([roi[:, 0] - self.margin, roi[:, 1] + self.margin], axis=1)
+        )
+        edge_index = np.unique(self.adjacency[near].data) - 1
+        edges = self.edges[edge_index]
+
+        # clip the edges to the box [low, high) in physical unit (Liang-Barsky)
+        low = roi[:, 0] * self.gt_res
+        high = roi[:, 1] * self.gt_res
+        start = self.position[edges[:, 0]]
+        delta = self.position[edges[:, 1]] - start
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_low = (low - start) / delta
+            t_high = (high - start) / delta
+        parallel = delta == 0
+        t_enter = np.where(parallel, -np.inf, np.minimum(t_low, t_high)).max(axis=1)
+        t_exit = np.where(parallel, np.inf, np.maximum(t_low, t_high)).min(axis=1)
+        outside = np.any(parallel & ((start < low) | (start >= high)), axis=1)
+        t_enter = np.clip(t_enter, 0, 1)
+        t_exit = np.clip(t_exit, 0, 1)
+        keep = ~outside & (t_exit > t_enter)
+        edges, t_enter, t_exit = edges[keep], t_enter[keep], t_exit[keep]
+        start, delta = start[keep], delta[keep]
+        edge_length = self.edge_length[edge_index[keep]] * (t_exit - t_enter)
+
+        # renumber the inner nodes and add a node at each clipped end
+        node_map = np.full(len(self.position), -1, np.int64)
+        node_map[inner] = np.arange(len(inner))
+        num_node = len(inner)
+        new_position = []
+        new_source = []
+        roi_edges = np.zeros([len(edges), 2], np.int64)
+        for end, t in enumerate([t_enter, t_exit]):
+            roi_edges[:, end] = node_map[edges[:, end]]
+            clipped = np.nonzero(roi_edges[:, end] < 0)[0]
+            roi_edges[clipped, end] = num_node + np.arange(len(clipped))
+            num_node += len(clipped)
+            new_position.append(start[clipped] + t[clipped, None] * delta[clipped])
+            # the other end if it is inside the box, else the nearest end
+            other = edges[clipped, 1 - end]
+            nearest = edges[clipped, (t[clipped] >= 0.5).astype(np.int64)]
+            new_source.append(np.where(node_map[other] >= 0, other, nearest))
+        new_position = np.vstack(new_position)
+        source_node = np.concatenate([inner] + new_source)
+
+        position = np.vstack([self.position[inner], new_position])
+        node_position = np.vstack(
+            [
+                self.voxel[inner],
+                np.clip(new_position // self.gt_res, roi[:, 0], roi[:, 1] - 1).astype(
+                    np.int64
+                ),
+            ]
+        )
+
+        if isinstance(self.gt_graph, NetworkXGraphLite):
+            roi_graph = NetworkXGraphLite(
+                self.gt_graph.node_attributes,
+                self.gt_graph.edge_attribute,
+                self.gt_graph.node_dtypes,
+                self.gt_graph.edge_dtype,
+            )
+        else:
+            roi_graph = NetworkXGraphLite()
+        nodes = {self.skeleton_id_attribute: self.node_skeleton[source_node]}
+        for d, name in enumerate(["z", "y", "x"]):
+            nodes[name] = np.round(position[:, d])
+        roi_graph.load_arrays(nodes, roi_edges, edge_length)
+        return roi_graph, node_position, source_node
+
+    def get_skeleton_lengths(self, roi_graph):
+        """
+        The function `get_skeleton_lengths` sums up the stored edge lengths of a cropped graph.
+
+        :param roi_graph: The output graph of `crop`
+        :return: a dictionary mapping skeleton ids to their length within the box.
+        """
+        node_skeleton, edges, edge_length = get_graph_arrays(
+            roi_graph, self.skeleton_id_attribute, roi_graph.edge_attribute
+        )
+        skeleton_ids, index = np.unique(node_skeleton[edges[:, 0]], return_inverse=True)
+        lengths = np.bincount(index.ravel(), edge_length, minlength=len(skeleton_ids))
+        return dict(zip(skeleton_ids.tolist(), lengths))
+
+
+def read_roi(volume, roi):
+    """
+    The function `read_roi` reads the hyperslab of a volume covering a box.
+
+    :param volume: a 3D volume, the name of an h5 file or zarr/n5 folder, or a `MaskIndex`
+    :param roi: The `[start, last)` voxel range of each dimension (zyx order)
+    :return: the content of the box as a numpy array.
+    """
+    if isinstance(volume, str):
+        return read_box(volume, roi)
+    if isinstance(volume, MaskIndex):
+        return volume.decode(roi[0][0], roi[0][1])[
+            :, roi[1][0] : roi[1][1], roi[2][0] : roi[2][1]
+        ]
+    return volume[tuple(slice(x[0], x[1]) for x in roi)]
+
+
+def parse_roi(roi):
+    """
+    The function `parse_roi` parses a box given as "z0-z1,y0-y1,x0-x1".
+
+    :param roi: The box as a string
+    :return: the `[start, last)` voxel range of each dimension.
+    """
+    return [[int(x) for x in axis.split("-")] for axis in roi.split(",")]
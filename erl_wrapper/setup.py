@@ -5,4 +5,15 @@ setup(
     name="erl wrapper",
     version="1.0",
     packages=find_packages(),
+    install_requires=["numpy", "scipy", "h5py", "networkx"],
+    extras_require={
+        # tif stacks read by z-slab
+        "tif": ["tifffile"],
+        # zarr/n5 chunks with other codecs than raw, zlib/gzip, bz2 and lzma (e.g., blosc)
+        "zarr": ["numcodecs"],
+        # zstd compression of the lut archive (zlib otherwise)
+        "archive": ["zstandard"],
+        "skeleton": ["kimimaro"],
+        "test": ["pytest"],
+    },
 )
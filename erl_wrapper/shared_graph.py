@@ -0,0 +1,158 @@
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+from networkx_lite import NetworkXGraphLite, EdgeViewerLite, EdgeDataViewerLite
+
+# share one copy of a lite gt graph between processes: the publisher copies the node columns and
+# the (csr) edge arrays into shared memory blocks, the workers attach to them by name through a
+# small picklable handle. The attached graph is read-only: the edge lengths have to be computed
+# (get_skeleton_lengths with store_edge_length) before publishing. Other per-node arrays (e.g., the
+# node voxel positions) can be published along
+#
+# shared = SharedGraphBlocks(gt_graph, {"node_position": node_position})
+# pool = ProcessPoolExecutor(initializer=..., initargs=(shared.handle,))
+# worker: gt_graph = SharedNetworkXGraphLite(handle)
+# shared.close()  # once the workers are done
+
+
+def _create_block(array):
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach_block(spec):
+    name, shape, dtype = spec
+    if sys.version_info >= (3, 13):
+        # the publisher owns (and unlinks) the block
+        block = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        block = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+class SharedGraphBlocks:
+    # The SharedGraphBlocks class publishes a lite graph into shared memory blocks.
+    def __init__(self, gt_graph, arrays=None):
+        """
+        :param gt_graph: The `NetworkXGraphLite` to publish, with its edge lengths stored
+        :param arrays: A dictionary of other arrays to publish along (optional)
+        """
+        edges = gt_graph._edges.tocsr()
+        self._blocks = []
+        specs = {}
+        for key, array in [
+            ("node_" + key, value) for key, value in gt_graph._columns.items()
+        ] + [
+            ("indptr", edges.indptr),
+            ("indices", edges.indices),
+            ("data", edges.data),
+        ]:
+            block, specs[key] = _create_block(array)
+            self._blocks.append(block)
+        extra_specs = {}
+        for key, array in (arrays or {}).items():
+            block, extra_specs[key] = _create_block(array)
+            self._blocks.append(block)
+        self.handle = {
+            "node_attributes": gt_graph.node_attributes,
+            "edge_attribute": gt_graph.edge_attribute,
+            "node_dtypes": gt_graph.node_dtypes,
+            "edge_dtype": gt_graph.edge_dtype,
+            "shape": edges.shape,
+            "arrays": specs,
+            "extra_arrays": extra_specs,
+        }
+
+    def get_nbytes(self):
+        """
+        The function `get_nbytes` returns the size of the shared blocks in bytes.
+        """
+        return sum(block.size for block in self._blocks)
+
+    def close(self):
+        """
+        The function `close` releases the shared blocks. Attached graphs must not be used anymore.
+        """
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+class SharedNetworkXGraphLite(NetworkXGraphLite):
+    # The SharedNetworkXGraphLite class is a read-only lite graph attached to shared memory blocks.
+    def __init__(self, handle):
+        """
+        :param handle: The `handle` of the `SharedGraphBlocks` publishing the graph
+        """
+        import scipy.sparse as sp
+
+        super().__init__(
+            handle["node_attributes"],
+            handle["edge_attribute"],
+            handle["node_dtypes"],
+            handle["edge_dtype"],
+        )
+        self.handle = handle
+        self._blocks = []
+        arrays = {}
+        for key, spec in handle["arrays"].items():
+            block, arrays[key] = _attach_block(spec)
+            self._blocks.append(block)
+        # read-only views of the other published arrays
+        self.arrays = {}
+        for key, spec in handle["extra_arrays"].items():
+            block, self.arrays[key] = _attach_block(spec)
+            self._blocks.append(block)
+        self._columns = {key: arrays["node_" + key] for key in self.node_attributes}
+        # csr view of the shared arrays (no copy): supports the same lookups as the dok matrix
+        self._edges = sp.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=handle["shape"],
+            copy=False,
+        )
+        self.init_viewers()
+
+    def init_viewers(self):
+        """
+        The function initializes read-only viewers for nodes and edges.
+        """
+        super().init_viewers()
+        self.edges = ReadOnlyEdgeViewerLite(self._edges, self.edge_attribute)
+
+    def set_edge_values(self, edges, edge_values):
+        raise TypeError("the edges of a shared graph are read-only")
+
+    def __reduce__(self):
+        # pickle the handle only: the receiving process attaches to the same blocks
+        return (SharedNetworkXGraphLite, (self.handle,))
+
+    def close(self):
+        """
+        The function `close` detaches from the shared blocks.
+        """
+        self._columns = None
+        self._edges = None
+        self.arrays = {}
+        self.nodes = None
+        self.edges = None
+        for block in self._blocks:
+            block.close()
+        self._blocks = []
+
+
+# The ReadOnlyEdgeViewerLite class is an edge viewer whose edge data can not be set.
+class ReadOnlyEdgeViewerLite(EdgeViewerLite):
+    def __getitem__(self, key):
+        key = tuple(sorted(key))
+        return ReadOnlyEdgeDataViewerLite(self._edges, self._edge_attribute, key)
+
+
+# The ReadOnlyEdgeDataViewerLite class is a viewer for edge data that can not be set.
+class ReadOnlyEdgeDataViewerLite(EdgeDataViewerLite):
+    def __setitem__(self, edge_attribute, value):
+        raise TypeError("the edges of a shared graph are read-only")
@@ -1,7 +1,5 @@
 import argparse
 import numpy as np
-import kimimaro
-import networkx as nx
 from data_io import read_vol, write_pkl
 from networkx_lite import convert_networkx_to_lite
 
@@ -45,6 +43,9 @@ def skeletonize(
     :return: The function `skeletonize` returns the result of the `kimimaro.skeletonize` function, which
     is the skeletonized version of the input labels.
     """
+    # kimimaro and networkx are only needed to build the gt: the evaluation does not import them
+    import kimimaro
+
     if obj_ids is None:
         obj_ids = np.unique(labels)
         obj_ids = list(obj_ids[obj_ids > 0])
@@ -97,17 +98,22 @@ def skeleton_to_networkx(
     skeleton. Additionally, if the `return_all_nodes` parameter is set to `True`, the function also
     returns an array of all the nodes in the skeleton.
     """
+    import networkx as nx
 
     # node in gt_graph: physical unit
     gt_graph = nx.Graph()
     count = 0
-    all_nodes = [None] * len(skeletons)
+    all_nodes = []
+    # kimimaro returns a dictionary {label: skeleton}
+    if isinstance(skeletons, dict):
+        skeletons = list(skeletons.values())
     for skeleton_id, skeleton in enumerate(skeletons):
         if len(skeleton.edges) == 0:
             continue
+        node_arr = skeleton.vertices
         if skeleton_resolution is not None:
             node_arr = node_arr * skeleton_resolution
-        node_arr = skeleton.vertices.astype(data_type)
+        node_arr = node_arr.astype(data_type)
         # augment the node index
         edge_arr = skeleton.edges + count
         for node in node_arr:
@@ -119,7 +125,7 @@ def skeleton_to_networkx(
         for edge in edge_arr:
             gt_graph.add_edge(edge[0], edge[1])
         if return_all_nodes:
-            all_nodes[skeleton_id] = node_arr
+            all_nodes.append(node_arr)
 
     if return_all_nodes:
         all_nodes = np.vstack(all_nodes)
@@ -150,10 +156,11 @@ def node_edge_to_networkx(
     :return: a networkx graph object. If the parameter `return_all_nodes` is set to `True`, it also
     returns an array of all the nodes in the graph.
     """
+    import networkx as nx
 
     gt_graph = nx.Graph()
     count = 0
-    all_nodes = [None] * len(nodes)
+    all_nodes = []
     for skeleton_id, node_arr in enumerate(nodes):
         if len(edges[skeleton_id]) == 0:
             continue
@@ -171,7 +178,7 @@ def node_edge_to_networkx(
         for edge in edge_arr:
             gt_graph.add_edge(edge[0], edge[1])
         if return_all_nodes:
-            all_nodes[skeleton_id] = node_arr
+            all_nodes.append(node_arr)
     if return_all_nodes:
         all_nodes = np.vstack(all_nodes)
         return gt_graph, all_nodes
@@ -194,7 +201,7 @@ def get_arguments():
         "--seg-resolution",
         type=str,
         help="segmentation resolution (zyx order)",
-        default="30,6,6",
+        default="30x6x6",
     )
     parser.add_argument(
         "-d",
@@ -210,6 +217,15 @@ def get_arguments():
         help="output path",
         default="out.pkl",
     )
+    parser.add_argument(
+        "-t",
+        "--output-type",
+        type=str,
+        choices=["skeleton", "networkx", "erl"],
+        help="output: kimimaro skeletons, networkx graph or [lite graph, voxel node positions] "
+        "(for the evaluation bundle, see gt_bundle.py)",
+        default="erl",
+    )
     parser.add_argument(
         "-i",
         "--seg-index",
@@ -233,7 +249,7 @@ def get_arguments():
 
 if __name__ == "__main__":
     args = get_arguments()
-    # python skeleton.py yy.h5 30x6x6 -1 xx.pkl
+    # python skeleton.py -s yy.h5 -r 30x6x6 -i -1 -t erl -o xx.pkl
     print("load segmentation")
     seg = read_vol(args.seg_path)
 
@@ -252,7 +268,9 @@ if __name__ == "__main__":
         write_pkl(args.output_path, result_networkx)
     elif args.output_type == "erl":
         # for erl evaluation
-        result_networkx, result_all_nodes = skeleton_to_networkx(result_skeletons, True)
-        result_all_nodes_voxel = result_all_nodes // args.seg_resolution
+        result_networkx, result_all_nodes = skeleton_to_networkx(
+            result_skeletons, None, True
+        )
+        result_all_nodes_voxel = result_all_nodes // np.array(args.seg_resolution)
         result_networkx_lite = convert_networkx_to_lite(result_networkx)
         write_pkl(args.output_path, [result_networkx_lite, result_all_nodes_voxel])
@@ -0,0 +1,227 @@
+import numpy as np
+from networkx_lite import NetworkXGraphLite
+
+# deterministic synthetic data for benchmarks: tube-like "axons" with lite gt skeletons
+# and a predicted segmentation with controlled splits and merges
+
+
+def generate_skeletons(
+    volume_size=(64, 256, 256),
+    num_skeletons=20,
+    nodes_per_skeleton=100,
+    step=2.0,
+    branch_rate=0.0,
+    seed=0,
+):
+    """
+    The function `generate_skeletons` generates smooth random walks as gt skeletons.
+
+    :param volume_size: The size of the volume in voxels (zyx order)
+    :param num_skeletons: The number of skeletons
+    :param nodes_per_skeleton: The number of nodes of the main path of each skeleton
+    :param step: The distance in voxels between consecutive nodes
+    :param branch_rate: The probability for each node to start a branch of
+    `nodes_per_skeleton // 4` nodes, defaults to 0
+    :param seed: The seed of the random generator
+    :return: a tuple `(node_position, skeleton_id, edges)`: the voxel positions (N, 3), the skeleton
+    id of each node (N) and the node indices of each edge (E, 2).
+    """
+    rng = np.random.RandomState(seed)
+    volume_size = np.array(volume_size)
+    node_position = []
+    skeleton_id = []
+    edges = []
+    count = 0
+
+    def random_walk(start, num_node):
+        pos = np.zeros([num_node, 3])
+        direction = rng.randn(3)
+        direction /= np.linalg.norm(direction)
+        point = start.astype(float)
+        for i in range(num_node):
+            pos[i] = point
+            direction += 0.3 * rng.randn(3)
+            direction /= np.linalg.norm(direction)
+            point = point + step * direction
+            # bounce off the volume border
+            out = (point < 0) | (point > volume_size - 1)
+            direction[out] *= -1
+            point = np.clip(point, 0, volume_size - 1)
+        return np.round(pos).astype(np.int64)
+
+    for sid in range(num_skeletons):
+        paths = [(rng.uniform(0, 1, 3) * (volume_size - 1), nodes_per_skeleton, -1)]
+        while len(paths) > 0:
+            start, num_node, parent = paths.pop()
+            pos = random_walk(start, num_node)
+            index = count + np.arange(num_node)
+            node_position.append(pos)
+            skeleton_id.append(np.full(num_node, sid))
+            edges.append(np.stack([index[:-1], index[1:]], axis=1))
+            if parent >= 0:
+                edges.append(np.array([[parent, index[0]]]))
+            count += num_node
+            if parent < 0 and branch_rate > 0:
+                for i in np.nonzero(rng.rand(num_node) < branch_rate)[0]:
+                    paths.append((pos[i], max(nodes_per_skeleton // 4, 2), index[i]))
+    return (
+        np.vstack(node_position),
+        np.concatenate(skeleton_id),
+        np.vstack(edges),
+    )
+
+
+def paint_tubes(volume, node_position, node_label, radius=2):
+    """
+    The function `paint_tubes` paints a ball of the node label around each node.
+
+    :param volume: The 3D volume to paint into
+    :param node_position: The voxel position of each node (N, 3)
+    :param node_label: The label of each node (N)
+    :param radius: The radius of the ball in voxels
+    """
+    grid = np.mgrid[-radius : radius + 1, -radius : radius + 1, -radius : radius + 1]
+    offsets = grid.reshape(3, -1).T
+    offsets = offsets[(offsets**2).sum(axis=1) <= radius**2]
+    # process in batches to bound the memory
+    batch = max(1, 2**20 // len(offsets))
+    for i in range(0, len(node_position), batch):
+        pos = node_position[i : i + batch, None] + offsets[None]
+        pos = np.clip(pos, 0, np.array(volume.shape) - 1).reshape(-1, 3)
+        volume[pos[:, 0], pos[:, 1], pos[:, 2]] = np.repeat(
+            node_label[i : i + batch], len(offsets)
+        )
+
+
+def generate_segmentation(
+    volume_size,
+    node_position,
+    skeleton_id,
+    edges,
+    radius=2,
+    split_rate=0.02,
+    merge_rate=0.1,
+    seed=0,
+):
+    """
+    The function `generate_segmentation` generates a predicted segmentation and the gt
+    no-background mask around the skeletons.
+
+    :param volume_size: The size of the volume in voxels (zyx order)
+    :param node_position: The voxel position of each node (N, 3)
+    :param skeleton_id: The skeleton id of each node (N)
+    :param edges: The node indices of each edge (E, 2)
+    :param radius: The radius of the tubes in voxels
+    :param split_rate: The probability of each edge to be split
+    :param merge_rate: The probability of each split piece to be merged with a piece of another
+    skeleton, or with a blob in the background
+    :param seed: The seed of the random generator
+    :return: a tuple `(segmentation, mask)`: a uint64 prediction and a uint8 mask of the voxels
+    that do not belong to any gt skeleton.
+    """
+    rng = np.random.RandomState(seed)
+    num_node = len(node_position)
+    # split: cut edges, then label the connected pieces by propagating along the edges
+    keep = rng.rand(len(edges)) >= split_rate
+    piece = np.arange(num_node)
+    kept = edges[keep]
+    while True:
+        new_piece = piece.copy()
+        np.minimum.at(new_piece, kept[:, 0], piece[kept[:, 1]])
+        np.minimum.at(new_piece, kept[:, 1], piece[kept[:, 0]])
+        if (new_piece == piece).all():
+            break
+        piece = new_piece
+    pieces, node_label = np.unique(piece, return_inverse=True)
+    piece_label = np.arange(1, len(pieces) + 1, dtype=np.uint64)
+    piece_skeleton = np.zeros(len(pieces), np.int64)
+    piece_skeleton[node_label] = skeleton_id
+
+    # merge: relabel pieces into pieces of another skeleton
+    merged = np.nonzero(rng.rand(len(pieces)) < merge_rate / 2)[0]
+    for i in merged:
+        other = np.nonzero(piece_skeleton != piece_skeleton[i])[0]
+        if len(other) > 0:
+            piece_label[i] = piece_label[rng.choice(other)]
+    # spread the ids over a large range, as in real predictions
+    piece_label = piece_label * np.uint64(7919) + np.uint64(2**33)
+
+    gt = np.zeros(volume_size, np.uint8)
+    paint_tubes(gt, node_position, np.ones(num_node, np.uint8), radius)
+    segmentation = np.zeros(volume_size, np.uint64)
+    paint_tubes(segmentation, node_position, piece_label[node_label], radius)
+
+    # false merges with the background: blobs with the id of a piece
+    blobs = np.nonzero(rng.rand(len(pieces)) < merge_rate / 2)[0]
+    blob_position = (rng.uniform(0, 1, (len(blobs), 3)) * (np.array(volume_size) - 1)).astype(
+        np.int64
+    )
+    blob_segmentation = np.zeros(volume_size, np.uint64)
+    paint_tubes(blob_segmentation, blob_position, piece_label[blobs], radius + 2)
+    background = (gt == 0) & (blob_segmentation > 0)
+    segmentation[background] = blob_segmentation[background]
+    return segmentation, (gt == 0).astype(np.uint8)
+
+
+def generate_gt_graph(node_position, skeleton_id, edges, resolution=(30, 32, 32)):
+    """
+    The function `generate_gt_graph` builds the lite gt graph with node positions in physical unit.
+
+    :param node_position: The voxel position of each node (N, 3) in zyx order
+    :param skeleton_id: The skeleton id of each node (N)
+    :param edges: The node indices of each edge (E, 2)
+    :param resolution: The voxel size (zyx order)
+    :return: a `NetworkXGraphLite` object.
+    """
+    position = node_position * np.array(resolution)
+    graph = NetworkXGraphLite(["skeleton_id", "z", "y", "x"], "length")
+    graph.load_arrays(
+        {
+            "skeleton_id": skeleton_id,
+            "z": position[:, 0],
+            "y": position[:, 1],
+            "x": position[:, 2],
+        },
+        edges,
+    )
+    return graph
+
+
+def generate_dataset(
+    volume_size=(64, 256, 256),
+    num_skeletons=20,
+    nodes_per_skeleton=100,
+    resolution=(30, 32, 32),
+    radius=2,
+    branch_rate=0.0,
+    split_rate=0.02,
+    merge_rate=0.1,
+    seed=0,
+):
+    """
+    The function `generate_dataset` generates a complete synthetic evaluation case.
+
+    :return: a dictionary with the lite gt graph ("gt_graph"), its resolution ("gt_res"), the voxel
+    position of each node ("node_position"), the prediction ("segmentation") and the gt
+    no-background mask ("mask").
+    """
+    node_position, skeleton_id, edges = generate_skeletons(
+        volume_size, num_skeletons, nodes_per_skeleton, branch_rate=branch_rate, seed=seed
+    )
+    segmentation, mask = generate_segmentation(
+        volume_size,
+        node_position,
+        skeleton_id,
+        edges,
+        radius=radius,
+        split_rate=split_rate,
+        merge_rate=merge_rate,
+        seed=seed + 1,
+    )
+    return {
+        "gt_graph": generate_gt_graph(node_position, skeleton_id, edges, resolution),
+        "gt_res": np.array(resolution),
+        "node_position": node_position,
+        "segmentation": segmentation,
+        "mask": mask,
+    }
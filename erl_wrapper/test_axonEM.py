@@ -1,14 +1,121 @@
 import argparse
-from data_io import read_pkl
+import json
+from contextlib import nullcontext
+import numpy as np
+from data_io import read_pkl, parse_memory_size, read_points
+from lut_cache import LutCache
+from incremental import IncrementalERL
+from progressive import ProgressiveERL
+from relabel import SegmentRelabel
+from roi import SkeletonIndex, read_roi, parse_roi
+from mask_index import MaskIndex
+from node_layout import NodeLayout
+from gt_bundle import is_gt_bundle, load_gt_bundle
+from chains import SkeletonChains
 from eval_erl import (
     compute_segment_lut,
     compute_erl,
+    get_graph_edge_lengths,
+    get_node_spacing,
+    sample_skeletons,
+    bootstrap_run_length,
 )
-from networkx_lite import *
+from profiling import (
+    StageProfiler,
+    Tracer,
+    JsonlSink,
+    profile_stage,
+    capture_profile,
+)
+
+
+def load_gt_stats(
+    gt_stats_path, gt_mask_path=None, return_node_layout=False, return_skeleton_chains=False
+):
+    """
+    The function `load_gt_stats` loads the precomputed ground truth statistics.
+
+    :param gt_stats_path: The path to the ground truth statistics file ([gt_graph, gt_res] and
+    optionally the precomputed mask index, node layout and skeleton chains), or to a gt bundle
+    (gt_bundle.py)
+    :param gt_mask_path: The path to the ground truth no-background mask, used if the statistics file
+    has no mask index (optional)
+    :param return_node_layout: If True, also return the `NodeLayout` of the gt nodes (None if the
+    nodes were not reordered by node_layout.py)
+    :param return_skeleton_chains: If True, also return the `SkeletonChains` of the gt skeletons
+    (None if they were not precomputed by chains.py or stored in the bundle)
+    :return: the ground truth graph, its resolution and the mask (index, path or None).
+    """
+    node_layout = None
+    skeleton_chains = None
+    if is_gt_bundle(gt_stats_path):
+        gt_graph, gt_res, mask_index, node_layout, skeleton_chains = load_gt_bundle(
+            gt_stats_path, return_skeleton_chains=True
+        )
+        if mask_index is not None:
+            gt_mask_path = mask_index
+    else:
+        gt_stats = read_pkl(gt_stats_path)
+        gt_graph, gt_res = gt_stats[:2]
+        for extra in gt_stats[2:]:
+            if isinstance(extra, MaskIndex):
+                # precomputed mask index (mask_index.py): no need to read the mask volume
+                gt_mask_path = extra
+            elif isinstance(extra, NodeLayout):
+                node_layout = extra
+            elif isinstance(extra, SkeletonChains):
+                skeleton_chains = extra
+    out = [gt_graph, gt_res, gt_mask_path]
+    if return_node_layout:
+        out.append(node_layout)
+    if return_skeleton_chains:
+        out.append(skeleton_chains)
+    return tuple(out)
+
+
+def get_node_position(gt_graph, gt_res):
+    """
+    The function `get_node_position` converts the ground truth node positions into voxels.
+
+    :param gt_graph: The ground truth graph (node position in physical unit, xyz order)
+    :param gt_res: The voxel resolution (zyx order)
+    :return: the voxel position of each node (N, 3) in zyx order.
+    """
+    return (
+        np.stack([gt_graph.nodes.column(x) for x in ["z", "y", "x"]], axis=1) // gt_res
+    ).astype(np.int64)
+
+
+def print_scores(name, scores, num_bootstrap=None):
+    """
+    The function `print_scores` prints the scores of `test_AxonEM`, with their confidence intervals
+    if they were computed.
+    """
+    if num_bootstrap is not None:
+        print(f"ERL/GT for {name}: {np.asarray(scores[0]).tolist()}")
+        print(f"95% bootstrap intervals: {np.asarray(scores[1]['erl_ci']).tolist()}")
+    else:
+        print(f"ERL/GT for {name}: {scores}")
 
 
 def test_AxonEM(
-    gt_stats_path, pred_seg_path, gt_mask_path=None, num_chunk=1, merge_threshold=0, erl_intervals=''
+    gt_stats_path,
+    pred_seg_path,
+    gt_mask_path=None,
+    num_chunk=1,
+    merge_threshold=0,
+    erl_intervals='',
+    memory_budget=None,
+    profiler=None,
+    lut_cache=None,
+    incremental_state=None,
+    roi=None,
+    num_samples=None,
+    num_bootstrap=None,
+    pyramid=False,
+    mask_at_scale=False,
+    watch_interval=None,
+    watch_timeout=None,
 ):
     """
     The function `test_AxonEM` takes in the paths to ground truth statistics and predicted segmentation,
@@ -18,32 +125,204 @@ def test_AxonEM(
     about the ground truth graph (vertex in physical unit) and resolution (used to convert node position to voxel)
     :param pred_seg_path: The `pred_seg_path` parameter is the file path to the predicted segmentation.
     It is the path to a file that contains the predicted segmentation data
+    :param gt_mask_path: The path to the ground truth no-background mask. It is ignored if the ground
+    truth statistics file already contains the precomputed mask index
     :param num_chunk: The parameter `num_chunk` is an optional parameter that specifies the number of
     chunks to divide the computation into. It is used in the function `compute_node_segment_lut_low_mem`
     to divide the computation of the node segment lookup table into smaller chunks, which can help
     reduce memory usage and improve performance, defaults to 1 (optional)
+    :param memory_budget: The maximum number of bytes used to hold one slab of the prediction and the
+    mask. If given, `num_chunk` is ignored and the slabs are planned automatically (optional)
+    :param profiler: a `StageProfiler` recording the wall time, cpu time and peak memory of each stage,
+    or a `Tracer` also emitting structured events for each stage (optional)
+    :param lut_cache: a `LutCache` storing the node segment lookup table and the mask histogram of
+    each (prediction, gt) pair, so that re-scoring the same prediction does not read it (optional)
+    :param incremental_state: The path to the state of the previous evaluation of an earlier version
+    of the prediction. Only the changed chunks are read and only the affected skeletons are rescored,
+    then the state is updated (optional)
+    :param roi: The `[start, last)` voxel range of each dimension (zyx order) to restrict the
+    evaluation to. Only this box of the prediction and the mask is read (optional)
+    :param num_samples: The number of skeletons sampled (with probability proportional to their length)
+    to estimate the ERL with a bootstrap confidence interval. Only the nodes of the sampled skeletons
+    are read from the prediction, and the mask is not used (optional)
+    :param num_bootstrap: The number of bootstrap resamples of the skeletons to compute the confidence
+    intervals of the scores. If given, `(scores, skeleton_stats)` is returned, see `compute_erl`
+    (optional)
+    :param pyramid: If True and the prediction is a multiscale file, the nodes are looked up in the
+    coarsest scale that still resolves the gt node spacing (the lookup table is not cached)
+    :param mask_at_scale: If True, the mask histogram is computed at the scale chosen with `pyramid`
+    (with rescaled voxel counts) instead of the finest scale
+    :param watch_interval: The number of seconds between two polls of a prediction that is still
+    being written. If given, the z-ranges are read as soon as they are complete and a provisional
+    ERL is printed after each slab, with the fraction of the gt length covered (optional)
+    :param watch_timeout: The number of seconds without any new complete z-range after which the
+    rest of the prediction is read as it is, with `watch_interval` (optional)
     """
     print("Load gt info")
     # gt_graph: node position in physical unit (Nx3)
     # gt_no_bg: binary mask for non-axons
-    gt_graph, gt_res = read_pkl(gt_stats_path)
+    with profile_stage(profiler, "load_gt"):
+        gt_graph, gt_res, gt_mask_path, node_layout, skeleton_chains = load_gt_stats(
+            gt_stats_path, gt_mask_path, return_node_layout=True, return_skeleton_chains=True
+        )
+    if num_samples is not None:
+        print("Compute approximate ERL")
+        with profile_stage(profiler, "sample_skeletons"):
+            node_skeleton, edges, edge_length = get_graph_edge_lengths(
+                gt_graph, "skeleton_id", "length", ["z", "y", "x"]
+            )
+            skeleton_ids, index = np.unique(
+                node_skeleton[edges[:, 0]], return_inverse=True
+            )
+            skeleton_samples = sample_skeletons(
+                skeleton_ids, np.bincount(index.ravel(), edge_length), num_samples
+            )
+            nodes = np.nonzero(np.isin(node_skeleton, skeleton_samples))[0]
+        with profile_stage(profiler, "segment_lut"):
+            node_segment_lut = np.zeros(len(node_skeleton), np.uint32)
+            node_segment_lut[nodes] = SegmentRelabel(np.uint32).update(
+                read_points(pred_seg_path, get_node_position(gt_graph, gt_res)[nodes])
+            )
+        with profile_stage(profiler, "erl"):
+            scores = compute_erl(
+                gt_graph,
+                node_segment_lut,
+                None,
+                merge_threshold,
+                profiler=profiler,
+                skeleton_samples=skeleton_samples,
+                num_bootstrap=num_bootstrap,
+            )
+        print(f"Approximate ERL/GT for seg {pred_seg_path}: {scores}")
+        return scores
+
+    if roi is not None:
+        print("Compute ERL within the roi")
+        with profile_stage(profiler, "crop_roi"):
+            skeleton_index = SkeletonIndex(gt_graph, gt_res)
+            roi_nodes = skeleton_index.query(roi)
+        with profile_stage(profiler, "segment_lut"):
+            node_segment_lut, mask_segment_id = compute_segment_lut(
+                read_roi(pred_seg_path, roi),
+                skeleton_index.voxel[roi_nodes] - np.array(roi)[:, 0],
+                None if gt_mask_path is None else read_roi(gt_mask_path, roi),
+            )
+        gt_node_segment_lut = np.zeros(len(skeleton_index.voxel), node_segment_lut.dtype)
+        gt_node_segment_lut[roi_nodes] = node_segment_lut
+        with profile_stage(profiler, "erl"):
+            scores = compute_erl(
+                gt_graph,
+                gt_node_segment_lut,
+                mask_segment_id,
+                merge_threshold,
+                erl_intervals,
+                profiler=profiler,
+                roi=roi,
+                gt_res=skeleton_index,
+                num_bootstrap=num_bootstrap,
+            )
+        print_scores(f"seg {pred_seg_path} in roi {roi}", scores, num_bootstrap)
+        return scores
+
+    if watch_interval is not None:
+        print("Compute ERL while the prediction is written")
+        evaluator = ProgressiveERL(
+            gt_graph,
+            get_node_position(gt_graph, gt_res),
+            gt_mask_path,
+            merge_threshold,
+            erl_intervals,
+            node_layout=node_layout,
+        )
+        for result in evaluator.watch(
+            pred_seg_path,
+            poll_interval=watch_interval,
+            timeout=watch_timeout,
+            chunk_num=num_chunk,
+            memory_budget=memory_budget,
+            profiler=profiler,
+        ):
+            if not result["complete"]:
+                print(
+                    f"Provisional ERL/GT for seg {pred_seg_path} "
+                    f"({result['coverage']:.1%} of the gt length): {result['scores']}"
+                )
+        scores = result["scores"]
+        print_scores(f"seg {pred_seg_path}", scores)
+        return scores
+
+    if incremental_state is not None:
+        print("Compute ERL incrementally")
+        evaluator = IncrementalERL(
+            gt_graph,
+            get_node_position(gt_graph, gt_res),
+            gt_mask_path,
+            merge_threshold,
+        )
+        evaluator.load_state(incremental_state)
+        scores = evaluator.evaluate(pred_seg_path, erl_intervals, profiler)
+        evaluator.save_state(incremental_state)
+        if num_bootstrap is not None:
+            skeleton_scores = evaluator.state["scores"]
+            scores = scores, {
+                "skeleton_ids": evaluator.skeleton_ids,
+                "skeleton_lengths": skeleton_scores["length"],
+                "skeleton_erls": skeleton_scores["erl"],
+                "erl_ci": bootstrap_run_length(
+                    skeleton_scores["length"],
+                    skeleton_scores["erl"],
+                    erl_intervals,
+                    num_bootstrap,
+                ),
+            }
+        print_scores(f"seg {pred_seg_path}", scores, num_bootstrap)
+        return scores
+
     print("Compute prediction info")
     # node_segment_lut: seg id for each voxel location (N)
     # gt_graph: xyz order
     # voxel: zyx order
-    node_segment_lut, mask_segment_id = compute_segment_lut(
-        pred_seg_path,
-        (gt_graph.nodes._nodes[:, -1:0:-1] // gt_res).astype(np.uint16),
-        gt_mask_path,
-        num_chunk,
-    )
+    cached = None
+    if lut_cache is not None and not pyramid:
+        with profile_stage(profiler, "lut_cache"):
+            cache_key = lut_cache.get_key(
+                pred_seg_path,
+                gt_stats_path,
+                gt_mask_path if isinstance(gt_mask_path, str) else None,
+            )
+            cached = lut_cache.get(cache_key)
+    if cached is not None:
+        node_segment_lut, mask_segment_id = cached
+    else:
+        with profile_stage(profiler, "segment_lut"):
+            node_segment_lut, mask_segment_id = compute_segment_lut(
+                pred_seg_path,
+                get_node_position(gt_graph, gt_res),
+                gt_mask_path,
+                num_chunk,
+                memory_budget=memory_budget,
+                profiler=profiler,
+                node_layout=node_layout,
+                node_spacing=get_node_spacing(gt_graph, gt_res) if pyramid else None,
+                mask_at_scale=mask_at_scale,
+            )
+        if lut_cache is not None and not pyramid:
+            lut_cache.put(cache_key, node_segment_lut, mask_segment_id)
 
     print("Compute ERL")
     # https://donglaiw.github.io/paper/2021_miccai_axonEM.pdf
-    scores = compute_erl(
-        gt_graph, node_segment_lut, mask_segment_id, merge_threshold, erl_intervals
-    )
-    print(f"ERL/GT for seg {pred_seg_path}: {scores}")
+    with profile_stage(profiler, "erl"):
+        scores = compute_erl(
+            gt_graph,
+            node_segment_lut,
+            mask_segment_id,
+            merge_threshold,
+            erl_intervals,
+            profiler=profiler,
+            num_bootstrap=num_bootstrap,
+            skeleton_chains=skeleton_chains,
+        )
+    print_scores(f"seg {pred_seg_path}", scores, num_bootstrap)
     return scores
 
 
@@ -84,6 +363,13 @@ def get_arguments():
         help="number of chunks to process the volume",
         default=1,
     )
+    parser.add_argument(
+        "-b",
+        "--memory-budget",
+        type=str,
+        help="memory budget to process the volume, e.g., 2G (overrides --num-chunk)",
+        default="",
+    )
     parser.add_argument(
         "-mt",
         "--merge-threshold",
@@ -98,10 +384,122 @@ def get_arguments():
         help="compute erl for each range. e.g., 0-20000-40000-150000",
         default="",
     )
+    parser.add_argument(
+        "-cd",
+        "--cache-dir",
+        type=str,
+        help="cache the node segment lookup tables in this folder",
+        default="",
+    )
+    parser.add_argument(
+        "-cs",
+        "--cache-size",
+        type=str,
+        help="maximum size of the cache, e.g., 4G",
+        default="4G",
+    )
+    parser.add_argument(
+        "-r",
+        "--roi",
+        type=str,
+        help="only evaluate within this voxel box, e.g., 0-100,200-712,200-712 (zyx)",
+        default="",
+    )
+    parser.add_argument(
+        "-ns",
+        "--num-samples",
+        type=int,
+        help="estimate the erl from this number of length-weighted skeleton samples",
+        default=0,
+    )
+    parser.add_argument(
+        "-nb",
+        "--num-bootstrap",
+        type=int,
+        help="number of bootstrap resamples of the skeletons for confidence intervals",
+        default=0,
+    )
+    parser.add_argument(
+        "-is",
+        "--incremental-state",
+        type=str,
+        help="state file of the previous evaluation, to only re-evaluate the changed chunks",
+        default="",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        type=float,
+        help="poll interval (seconds) to evaluate a prediction while it is being written",
+        default=0,
+    )
+    parser.add_argument(
+        "-wt",
+        "--watch-timeout",
+        type=float,
+        help="with --watch, read the rest of the prediction after this many seconds without a new z-range",
+        default=0,
+    )
+    parser.add_argument(
+        "-py",
+        "--pyramid",
+        action="store_true",
+        help="read the coarsest scale of a multiscale prediction that resolves the gt nodes",
+    )
+    parser.add_argument(
+        "-pm",
+        "--pyramid-mask-at-scale",
+        action="store_true",
+        help="with --pyramid, compute the mask histogram at the chosen scale too",
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        action="store_true",
+        help="print the wall time, cpu time and peak memory of each stage",
+    )
+    parser.add_argument(
+        "-tm",
+        "--trace-malloc",
+        action="store_true",
+        help="with --profile, also trace the python allocations of each stage (~10x slower)",
+    )
+    parser.add_argument(
+        "-tp",
+        "--trace-path",
+        type=str,
+        help="append the stage and slab events to this jsonl file",
+        default="",
+    )
+    parser.add_argument(
+        "-cp",
+        "--capture-profile",
+        type=str,
+        choices=["", "cprofile", "pyinstrument"],
+        help="capture a function-level profile of the evaluation",
+        default="",
+    )
+    parser.add_argument(
+        "-cpp",
+        "--capture-profile-path",
+        type=str,
+        help="output of the captured profile",
+        default="erl_profile.out",
+    )
     args = parser.parse_args()
 
     if len(args.gt_mask_path) == 0:
         args.gt_mask_path = None
+    if len(args.incremental_state) == 0:
+        args.incremental_state = None
+    args.roi = parse_roi(args.roi) if args.roi else None
+    args.num_samples = args.num_samples if args.num_samples > 0 else None
+    args.num_bootstrap = args.num_bootstrap if args.num_bootstrap > 0 else None
+    args.watch = args.watch if args.watch > 0 else None
+    args.watch_timeout = args.watch_timeout if args.watch_timeout > 0 else None
+    args.memory_budget = (
+        parse_memory_size(args.memory_budget) if args.memory_budget else None
+    )
     args.erl_intervals = (
         [int(x) for x in args.erl_intervals.split("-")]
         if "-" in args.erl_intervals
@@ -114,12 +512,38 @@ if __name__ == "__main__":
     # python test_axonEM.py -s db/30um_human/axon_release/gt_16nm.h5 -g db/30um_human/axon_release/gt_16nm_skel_stats.p -c 1
     args = get_arguments()
 
-    # compute erl
-    test_AxonEM(
-        args.gt_stats_path,
-        args.seg_path,
-        args.gt_mask_path,
-        args.num_chunk,
-        args.merge_threshold,
-        args.erl_intervals,
+    profiler = StageProfiler(args.trace_malloc) if args.profile else None
+    if args.trace_path:
+        profiler = Tracer(JsonlSink(args.trace_path), profiler)
+    lut_cache = (
+        LutCache(args.cache_dir, parse_memory_size(args.cache_size))
+        if args.cache_dir
+        else None
     )
+    # compute erl
+    with capture_profile(
+        args.capture_profile_path, args.capture_profile
+    ) if args.capture_profile else nullcontext():
+        test_AxonEM(
+            args.gt_stats_path,
+            args.seg_path,
+            args.gt_mask_path,
+            args.num_chunk,
+            args.merge_threshold,
+            args.erl_intervals,
+            args.memory_budget,
+            profiler,
+            lut_cache,
+            args.incremental_state,
+            args.roi,
+            args.num_samples,
+            args.num_bootstrap,
+            args.pyramid,
+            args.pyramid_mask_at_scale,
+            args.watch,
+            args.watch_timeout,
+        )
+    if profiler is not None:
+        if args.profile:
+            print(json.dumps(profiler.get_stats(), indent=2))
+        profiler.stop()
@@ -1,8 +1,8 @@
 import argparse
 import numpy as np
-from data_io import read_vol, read_pkl
+from data_io import read_pkl, parse_memory_size
 from skeleton import skeleton_to_networkx
-from eval_erl import compute_node_segment_lut, compute_erl
+from eval_erl import compute_segment_lut, compute_erl
 
 
 def test_volume(
@@ -10,6 +10,8 @@ def test_volume(
     skeleton_path,
     skeleton_unit,
     skeleton_resolution,
+    num_chunk=1,
+    memory_budget=None,
 ):
     """
     The function `test_volume` takes in various inputs, including a segmentation path, a skeleton path,
@@ -24,10 +26,15 @@ def test_volume(
     :param skeleton_resolution: The `skeleton_resolution` parameter represents the voxel size of the
     skeleton data. It is used to convert the node positions from physical units to voxel units if
     `skeleton_unit` is set to "voxel"
+    :param num_chunk: The number of z-slabs the segmentation is read in
+    :param memory_budget: The maximum number of bytes of a z-slab of the segmentation. If given,
+    `num_chunk` is ignored (optional)
     """
 
-    pred_seg = read_vol(seg_path)
     gt_skeleton = read_pkl(skeleton_path)
+    if len(gt_skeleton) == 1 and isinstance(gt_skeleton[0], dict):
+        # kimimaro output saved by skeleton.py: {label: skeleton}
+        gt_skeleton = gt_skeleton[0]
 
     # graph: need physical unit
     # node position: need voxel unit
@@ -39,7 +46,10 @@ def test_volume(
             gt_skeleton, skeleton_resolution, True
         )
 
-    node_segment_lut = compute_node_segment_lut(all_nodes, [pred_seg])
+    # the segmentation (e.g., a tif stack) is read by z-slabs
+    node_segment_lut, _ = compute_segment_lut(
+        seg_path, all_nodes, None, num_chunk, memory_budget=memory_budget
+    )
     scores = compute_erl(gt_graph, node_segment_lut)
     print(f"ERL for seg {seg_path}: {scores[0]}")
 
@@ -80,6 +90,20 @@ def get_arguments():
         help="resolution of ground truth skeleton",
         required=True,
     )
+    parser.add_argument(
+        "-c",
+        "--num-chunk",
+        type=int,
+        help="number of chunks to process the volume",
+        default=1,
+    )
+    parser.add_argument(
+        "-b",
+        "--memory-budget",
+        type=str,
+        help="memory budget to process the volume, e.g., 2G (overrides --num-chunk)",
+        default="",
+    )
     result_args = parser.parse_args()
     assert (
         "x" in result_args.skeleton_resolution
@@ -87,6 +111,11 @@ def get_arguments():
     result_args.skeleton_resolution = [
         int(x) for x in result_args.skeleton_resolution.split("x")
     ]
+    result_args.memory_budget = (
+        parse_memory_size(result_args.memory_budget)
+        if result_args.memory_budget
+        else None
+    )
     return result_args
 
 
@@ -96,5 +125,7 @@ if __name__ == "__main__":
         args.seg_path,
         args.skeleton_path,
         args.skeleton_unit,
-        args.skeleton_resolution
+        args.skeleton_resolution,
+        args.num_chunk,
+        args.memory_budget,
     )
@@ -0,0 +1,18 @@
+import pytest
+from data_io import write_h5, write_pkl
+from synthetic import generate_dataset
+
+
+@pytest.fixture(scope="module")
+def synthetic_case(tmp_path_factory):
+    """
+    A small synthetic evaluation case: the gt statistics file `gt.p` ([gt_graph, gt_res]), the
+    prediction `seg.h5` and the gt no-background mask `mask.h5` in a temporary folder.
+    """
+    folder = tmp_path_factory.mktemp("synthetic")
+    data = generate_dataset((32, 128, 128), 12, 80, branch_rate=0.05, seed=3)
+    write_h5(str(folder / "seg.h5"), data["segmentation"])
+    write_h5(str(folder / "mask.h5"), data["mask"])
+    write_pkl(str(folder / "gt.p"), [data["gt_graph"], data["gt_res"]])
+    data["folder"] = folder
+    return data
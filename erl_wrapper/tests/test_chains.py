@@ -0,0 +1,30 @@
+import numpy as np
+from chains import SkeletonChains
+from eval_erl import compute_erl, compute_segment_lut
+from test_axonEM import get_node_position
+
+
+def test_chain_scores_equal_edge_scores(synthetic_case):
+    folder = synthetic_case["folder"]
+    gt_graph = synthetic_case["gt_graph"]
+    node_lut, mask_hist = compute_segment_lut(
+        str(folder / "seg.h5"),
+        get_node_position(gt_graph, synthetic_case["gt_res"]),
+        str(folder / "mask.h5"),
+    )
+    skeleton_chains = SkeletonChains.from_graph(gt_graph)
+    assert skeleton_chains.exact
+    for merge_threshold in [0, 5]:
+        for erl_intervals in [None, [0, 2000, 5000, 1e9]]:
+            expected = compute_erl(
+                gt_graph, node_lut, mask_hist, merge_threshold, erl_intervals
+            )
+            erl = compute_erl(
+                gt_graph,
+                node_lut,
+                mask_hist,
+                merge_threshold,
+                erl_intervals,
+                skeleton_chains=skeleton_chains,
+            )
+            np.testing.assert_array_equal(erl, expected)
@@ -0,0 +1,42 @@
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+from chains import SkeletonChains
+from mask_index import MaskIndex
+from node_layout import NodeLayout
+import test_axonEM
+from test_axonEM import load_gt_stats
+
+ERL_WRAPPER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_script(name, *args):
+    subprocess.run(
+        [sys.executable, os.path.join(ERL_WRAPPER, name), *args], check=True, cwd=ERL_WRAPPER
+    )
+
+
+def test_gt_stats_cli_round_trip(synthetic_case):
+    # the gt statistics file goes through the three CLIs in the order of the README
+    folder = synthetic_case["folder"]
+    gt_path, mask_path = str(folder / "gt_cli.p"), str(folder / "mask.h5")
+    shutil.copy(folder / "gt.p", gt_path)
+    run_script("mask_index.py", "-g", gt_path, "-m", mask_path)
+    run_script("node_layout.py", "-g", gt_path)
+    run_script("chains.py", "-g", gt_path)
+
+    gt_graph, gt_res, mask, node_layout, skeleton_chains = load_gt_stats(
+        gt_path, return_node_layout=True, return_skeleton_chains=True
+    )
+    assert isinstance(mask, MaskIndex)
+    assert isinstance(node_layout, NodeLayout)
+    assert isinstance(skeleton_chains, SkeletonChains)
+    assert len(gt_graph.nodes) == len(synthetic_case["gt_graph"].nodes)
+
+    # same scores as the plain gt file with the mask volume
+    seg_path = str(folder / "seg.h5")
+    erl = test_axonEM.test_AxonEM(gt_path, seg_path, merge_threshold=5)
+    expected = test_axonEM.test_AxonEM(str(folder / "gt.p"), seg_path, mask_path, merge_threshold=5)
+    np.testing.assert_allclose(erl, expected, rtol=1e-6)
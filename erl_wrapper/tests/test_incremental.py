@@ -0,0 +1,44 @@
+import numpy as np
+from data_io import write_h5
+from eval_erl import compute_erl, compute_segment_lut
+from incremental import IncrementalERL
+from relabel import SegmentRelabel
+from test_axonEM import get_node_position
+
+
+def test_incremental_scores_equal_compute_erl(synthetic_case):
+    folder = synthetic_case["folder"]
+    gt_graph = synthetic_case["gt_graph"]
+    node_position = get_node_position(gt_graph, synthetic_case["gt_res"])
+    mask_path = str(folder / "mask.h5")
+    erl_intervals = [0, 2000, 5000, 1e9]
+    # uint64 ids (relabeled to dense uint32 ids), a new version with a changed region, then the
+    # same prediction with small uint32 ids (full recompute)
+    segmentation = synthetic_case["segmentation"].copy()
+    assert segmentation.max() >= 2**32
+    # segments only found in the mask voxels, not at the nodes
+    background = np.flatnonzero(synthetic_case["mask"] > 0)[:100]
+    segmentation.flat[background] = 2**50 + np.arange(len(background))
+    changed = segmentation.copy()
+    changed[8:16, :64, :64] = changed[8, 0, 0]
+    _, dense = np.unique(changed, return_inverse=True)
+    versions = [segmentation, changed, dense.reshape(changed.shape).astype(np.uint32)]
+
+    evaluator = IncrementalERL(gt_graph, node_position, mask_path, merge_threshold=5)
+    for version, seg in enumerate(versions):
+        seg_path = str(folder / f"seg_v{version}.h5")
+        write_h5(seg_path, seg)
+        erl = evaluator.evaluate(seg_path, erl_intervals)
+
+        relabel = SegmentRelabel(np.uint32)
+        node_lut, mask_hist = compute_segment_lut(
+            seg_path, node_position, mask_path, relabel=relabel
+        )
+        np.testing.assert_array_equal(
+            erl, compute_erl(gt_graph, node_lut, mask_hist, 5, erl_intervals)
+        )
+        if version == 0:
+            # only the segments found at the nodes are relabeled, not those of the mask voxels
+            np.testing.assert_array_equal(
+                evaluator.state["relabel"].segment_ids, relabel.segment_ids
+            )
@@ -0,0 +1,46 @@
+import numpy as np
+from eval_erl import compute_erl, compute_segment_lut
+from partition import (
+    partitioned_run_length,
+    prepare_partitions,
+    score_partition_files,
+    reduce_partition_files,
+)
+from test_axonEM import get_node_position
+
+
+def test_partitioned_scores_equal_compute_erl(synthetic_case, tmp_path):
+    folder = synthetic_case["folder"]
+    gt_graph = synthetic_case["gt_graph"]
+    seg_path, mask_path = str(folder / "seg.h5"), str(folder / "mask.h5")
+    node_lut, mask_hist = compute_segment_lut(
+        seg_path, get_node_position(gt_graph, synthetic_case["gt_res"]), mask_path
+    )
+    erl_intervals = [0, 2000, 5000, 1e9]
+    expected = compute_erl(gt_graph, node_lut, mask_hist, 5, erl_intervals)
+    for num_partitions, num_workers in [(1, 1), (3, 1), (7, 2)]:
+        erl = partitioned_run_length(
+            gt_graph,
+            "skeleton_id",
+            "length",
+            node_lut,
+            mask_hist,
+            5,
+            erl_intervals,
+            ["z", "y", "x"],
+            num_partitions,
+            num_workers,
+        )
+        np.testing.assert_array_equal(erl, expected)
+
+    # job array through files, rerun in the same folder with fewer partitions
+    output_dir = str(tmp_path / "work")
+    for num_partitions in [5, 2]:
+        prepare_partitions(
+            str(folder / "gt.p"), seg_path, output_dir, num_partitions, mask_path, 5
+        )
+        for job_id in range(2):
+            score_partition_files(output_dir, job_id, 2)
+        np.testing.assert_array_equal(
+            reduce_partition_files(output_dir, erl_intervals), expected
+        )
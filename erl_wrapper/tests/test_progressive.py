@@ -0,0 +1,81 @@
+import h5py
+import numpy as np
+from data_io import write_h5
+from eval_erl import compute_erl, compute_segment_lut
+from progressive import ProgressiveERL
+from test_axonEM import get_node_position
+
+
+def get_expected(synthetic_case, seg_path, merge_threshold, erl_intervals=None):
+    gt_graph = synthetic_case["gt_graph"]
+    mask_path = str(synthetic_case["folder"] / "mask.h5")
+    node_lut, mask_hist = compute_segment_lut(
+        seg_path, get_node_position(gt_graph, synthetic_case["gt_res"]), mask_path
+    )
+    return compute_erl(gt_graph, node_lut, mask_hist, merge_threshold, erl_intervals)
+
+
+def get_evaluator(synthetic_case, merge_threshold, erl_intervals=None):
+    gt_graph = synthetic_case["gt_graph"]
+    return ProgressiveERL(
+        gt_graph,
+        get_node_position(gt_graph, synthetic_case["gt_res"]),
+        str(synthetic_case["folder"] / "mask.h5"),
+        merge_threshold,
+        erl_intervals,
+    )
+
+
+def test_progressive_scores_equal_compute_erl(synthetic_case):
+    folder = synthetic_case["folder"]
+    segmentation = synthetic_case["segmentation"]
+    # uint64 ids are relabeled to dense uint32 ids in both paths, with segments only found in the
+    # mask voxels
+    seg_ids = segmentation.astype(np.uint64)
+    seg_ids[seg_ids > 0] += 2**40
+    background = np.flatnonzero(synthetic_case["mask"] > 0)[:100]
+    seg_ids.flat[background] = 2**50 + np.arange(len(background))
+    write_h5(str(folder / "seg_uint64.h5"), seg_ids)
+    for seg, seg_path in [
+        (segmentation, str(folder / "seg.h5")),
+        (seg_ids, str(folder / "seg_uint64.h5")),
+    ]:
+        for merge_threshold in [0, 5]:
+            for erl_intervals in [None, [0, 2000, 5000, 1e9]]:
+                evaluator = get_evaluator(synthetic_case, merge_threshold, erl_intervals)
+                for z in range(0, seg.shape[0], 10):
+                    result = evaluator.add_slab(seg[z : z + 10], z, seg.shape[0])
+                assert result["complete"]
+                np.testing.assert_array_equal(
+                    result["scores"],
+                    get_expected(synthetic_case, seg_path, merge_threshold, erl_intervals),
+                )
+
+
+def test_watch_contiguous_and_timeout(synthetic_case):
+    folder = synthetic_case["folder"]
+    segmentation = synthetic_case["segmentation"]
+    # a contiguous dataset: its progress is unknown, it is read at once
+    seg_path = str(folder / "seg_contiguous.h5")
+    with h5py.File(seg_path, "w") as fid:
+        fid.create_dataset("main", data=segmentation)
+    evaluator = get_evaluator(synthetic_case, 5)
+    result = list(evaluator.watch(seg_path, poll_interval=0.1))[-1]
+    assert result["complete"]
+    np.testing.assert_array_equal(
+        result["scores"], get_expected(synthetic_case, seg_path, 5)
+    )
+
+    # a chunked dataset whose last row of chunks is never written (fill value)
+    seg_path = str(folder / "seg_partial.h5")
+    with h5py.File(seg_path, "w") as fid:
+        dataset = fid.create_dataset(
+            "main", segmentation.shape, segmentation.dtype, chunks=(8, 64, 64)
+        )
+        dataset[:24] = segmentation[:24]
+    evaluator = get_evaluator(synthetic_case, 5)
+    result = list(evaluator.watch(seg_path, poll_interval=0.1, timeout=0.5))[-1]
+    assert result["complete"]
+    np.testing.assert_array_equal(
+        result["scores"], get_expected(synthetic_case, seg_path, 5)
+    )
@@ -0,0 +1,15 @@
+from benchmark import IMPORT_MODULES, check_import_budget, launch_entry_point, time_function
+
+# the default startup budget of `benchmark.py -ib`
+IMPORT_BUDGET = 0.5
+
+
+def test_entry_point_startup_budget():
+    # `python -m <module> --help` of each entry point, without heavy dependencies
+    result = {
+        "results": {
+            f"launch_{module}": time_function(lambda: launch_entry_point(module))
+            for module in IMPORT_MODULES
+        }
+    }
+    assert check_import_budget(result, IMPORT_BUDGET) == []
@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+import numpy as np
+from chunked_store import write_zarr
+
+ERL_WRAPPER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_zarr_without_h5py(tmp_path):
+    # zarr/n5 stores are read without h5py
+    path = str(tmp_path / "seg.zarr")
+    data = np.arange(6 * 20 * 30, dtype=np.uint64).reshape(6, 20, 30)
+    write_zarr(path, data, (4, 16, 16))
+    code = (
+        "import sys; sys.modules['h5py'] = None\n"
+        "from data_io import get_volume_info, read_vol\n"
+        f"shape, dtype, chunks = get_volume_info({path!r})\n"
+        f"print(shape, dtype, chunks, int(read_vol({path!r}, z_range=[2, 5]).sum()))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, cwd=ERL_WRAPPER, capture_output=True, text=True
+    ).stdout
+    assert output.split() == (
+        f"(6, 20, 30) uint64 (4, 16, 16) {int(data[2:5].sum())}".split()
+    )
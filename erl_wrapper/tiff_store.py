@@ -0,0 +1,139 @@
+import numpy as np
+
+# multi-page TIFF stacks (one z-slice per page) read by z-slab instead of as a whole:
+# the uncompressed pages stored contiguously are memory-mapped (only the touched rows are read
+# from disk), the compressed pages are decoded one at a time by tifffile. The whole stack is
+# memory-mapped at once if its pages are stored back to back (e.g., ImageJ hyperstacks)
+#
+# stack = TiffStack("seg_snemi.tif")
+# slab = stack.read_box([[start_z, last_z], [0, stack.shape[1]], [0, stack.shape[2]]])
+
+
+def _import_tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError("reading tif stacks requires tifffile: pip install tifffile")
+    return tifffile
+
+
+class TiffStack:
+    # The TiffStack class reads boxes of a single-channel TIFF stack page by page.
+    def __init__(self, filename):
+        """
+        :param filename: The name of the .tif/.tiff file
+        """
+        tifffile = _import_tifffile()
+        self.filename = filename
+        with tifffile.TiffFile(filename) as tif:
+            series = tif.series[0]
+            if series.axes[-2:] != "YX" or (
+                len(series.pages) > 0 and series.pages[0].keyframe.samplesperpixel > 1
+            ):
+                raise ValueError(f"not a single-channel tif stack: {filename}")
+            # pages written one by one can each be a 2D series: they are stacked along z
+            self._page_series = len(tif.series) > 1 and all(
+                x.shape == series.shape and x.dtype == series.dtype and x.axes == "YX"
+                for x in tif.series
+            )
+            if self._page_series:
+                shape = (len(tif.series),) + series.shape
+            else:
+                shape = series.shape
+            # all the leading dimensions (pages) are stacked along z
+            self.shape = (int(np.prod(shape[:-2])),) + tuple(shape[-2:])
+            self.dtype = np.dtype(series.dtype).newbyteorder("=")
+            self._file_dtype = self.dtype.newbyteorder(tif.byteorder)
+            # offset of the stack if all the pages are stored uncompressed and back to back
+            self._dataoffset = None if self._page_series else series.dataoffset
+        self.chunks = (1,) + self.shape[1:]
+        self.ndim = 3
+
+    def _get_pages(self, tif):
+        return tif.pages if self._page_series else tif.series[0].pages
+
+    def _get_page_offset(self, page):
+        # offset of the raw page if it can be memory-mapped, else None
+        if page.keyframe.compression != 1 or not page.is_contiguous:
+            return None
+        if sum(page.databytecounts) != int(np.prod(self.shape[1:])) * self.dtype.itemsize:
+            return None
+        return page.dataoffsets[0]
+
+    def _iter_pages(self, page_z):
+        # yield each page of the list `page_z` as an array (memory-mapped if possible)
+        if self._dataoffset is not None:
+            stack = np.memmap(
+                self.filename, self._file_dtype, "r", self._dataoffset, self.shape
+            )
+            for z in page_z:
+                yield z, stack[z]
+            return
+        tifffile = _import_tifffile()
+        with tifffile.TiffFile(self.filename) as tif:
+            pages = self._get_pages(tif)
+            for z in page_z:
+                page = pages[z]
+                offset = self._get_page_offset(page)
+                if offset is None:
+                    yield z, page.asarray().reshape(self.shape[1:])
+                else:
+                    yield z, np.memmap(
+                        self.filename, self._file_dtype, "r", offset, self.shape[1:]
+                    )
+
+    def read_box(self, box):
+        """
+        The function `read_box` reads the content of a box, reading only the pages of its z-range.
+
+        :param box: The `[start, last)` range of each dimension
+        :return: the content of the box as a numpy array.
+        """
+        box = [[max(0, x[0]), min(x[1], s)] for x, s in zip(box, self.shape)]
+        out = np.empty([max(0, x[1] - x[0]) for x in box], self.dtype)
+        if out.size == 0:
+            return out
+        for z, page in self._iter_pages(range(*box[0])):
+            out[z - box[0][0]] = page[box[1][0] : box[1][1], box[2][0] : box[2][1]]
+        return out
+
+    def read_points(self, points):
+        """
+        The function `read_points` reads the values at a set of voxels, reading only the pages that
+        contain them.
+
+        :param points: The voxel coordinates (N, 3)
+        :return: the value at each point.
+        """
+        points = np.asarray(points, np.int64).reshape(-1, 3)
+        out = np.zeros(len(points), self.dtype)
+        if len(points) == 0:
+            return out
+        order = np.argsort(points[:, 0], kind="stable")
+        page_z = np.unique(points[:, 0])
+        start = np.searchsorted(points[order, 0], np.append(page_z, page_z[-1] + 1))
+        for page_id, (_, page) in enumerate(self._iter_pages(page_z.tolist())):
+            index = order[start[page_id] : start[page_id + 1]]
+            out[index] = page[points[index, 1], points[index, 2]]
+        return out
+
+    def get_chunk_storage(self):
+        """
+        The function `get_chunk_storage` returns the stored size of each page, as
+        `get_chunk_storage_h5`.
+
+        :return: a tuple `(chunk_start_z, chunk_last_z, chunk_bytes)` of arrays with one entry per
+        page.
+        """
+        chunk_start_z = np.arange(self.shape[0])
+        if self._dataoffset is not None:
+            chunk_bytes = np.full(
+                self.shape[0], int(np.prod(self.shape[1:])) * self.dtype.itemsize
+            )
+            return chunk_start_z, chunk_start_z + 1, chunk_bytes
+        tifffile = _import_tifffile()
+        with tifffile.TiffFile(self.filename) as tif:
+            chunk_bytes = np.array(
+                [sum(page.databytecounts) for page in self._get_pages(tif)], np.int64
+            )
+        return chunk_start_z, chunk_start_z + 1, chunk_bytes
@@ -3,6 +3,7 @@ import os
 import json
 from erl_wrapper.test_axonEM import test_AxonEM
 from erl_wrapper.networkx_lite import *
+from erl_wrapper.profiling import StageProfiler
 
 from evalutils.evalutils import (
     DEFAULT_INPUT_PATH,
@@ -13,7 +14,12 @@ from evalutils.evalutils import (
 
 class AxonEM:
     def __init__(self):
-        self.num_chunk = 64
+        # slabs are planned from this budget and the container memory limit
+        self.memory_budget = 1024**3
+        # record time and peak memory (rss) per stage in the "timing" section of the output
+        self.profile = True
+        # tracemalloc slows down the python loops of the evaluation (~10x), only for debugging
+        self.trace_malloc = os.environ.get("ERL_TRACE_MALLOC", "0") == "1"
 
         self.human_gt = os.path.join(
             DEFAULT_GROUND_TRUTH_PATH, "gt_human_32nm_skel_stats.p"
@@ -45,23 +51,34 @@ class AxonEM:
         self.output_file = DEFAULT_EVALUATION_OUTPUT_FILE_PATH
 
     def evaluate(self):
+        human_profiler = StageProfiler(self.trace_malloc) if self.profile else None
         human_scores = test_AxonEM(
             gt_stats_path=self.human_gt,
             gt_mask_path=self.human_gt_mask,
             pred_seg_path=self.human_input,
-            num_chunk=self.num_chunk,
+            memory_budget=self.memory_budget,
+            profiler=human_profiler,
         )[0]
+        mouse_profiler = StageProfiler(self.trace_malloc) if self.profile else None
         mouse_scores = test_AxonEM(
             gt_stats_path=self.mouse_gt,
             gt_mask_path=self.mouse_gt_mask,
             pred_seg_path=self.mouse_input,
-            num_chunk=self.num_chunk,
+            memory_budget=self.memory_budget,
+            profiler=mouse_profiler,
         )[0]
         metrics = {
             "erl": (human_scores + mouse_scores)/2,
             "erl_human": human_scores,
             "erl_mouse": mouse_scores,
         }
+        if self.profile:
+            human_profiler.stop()
+            mouse_profiler.stop()
+            metrics["timing"] = {
+                "human": human_profiler.get_stats(),
+                "mouse": mouse_profiler.get_stats(),
+            }
 
         with open(self.output_file, "w") as f:
             f.write(json.dumps(metrics))